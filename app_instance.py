@@ -1,16 +1,49 @@
-import os.path, json, threading, tempfile, getpass
+import os.path, json, threading, tempfile, getpass, Queue
 from multiprocessing.connection import Client, Listener
 
 import fileutil
-from async import Future, get_scheduler
+from async import Future, coroutine, get_scheduler
 from util import pid_exists
 
+# Messages between instances are sent with multiprocessing.connection.
+#
+# A request is a dict:
+#
+#   {"version": 1, "id": <int>, "calls": [[method_name, args, kwargs], ...]}
+#
+# and is answered with:
+#
+#   {"version": 1, "id": <int>, "results": [[ok, value], ...]}
+#
+# where value is the result of the call, or the error message if ok is
+# false. A request with an unsupported version is answered with
+# {"version": 1, "id": <int>, "error": <message>} instead.
+#
+# The calls of a request run in order on the main thread, and a call which
+# returns a future is waited on before the next call starts. A client may send
+# more requests before reading replies. Each reply is sent as soon as its
+# request has finished, so replies may arrive out of order.
+#
+# A (method_name, args, kwargs) tuple, as sent by older clients, is answered
+# with just the result of the call, or None if it failed. Older instances
+# answer a request dict with None, so when a client gets that reply it falls
+# back to sending each call as a tuple.
+
+PROTOCOL_VERSION = 1
+
+class AppInstanceError(Exception):
+    pass
+
 class AppInstance(object):
     def __init__(self, instance_filename):
         instance = json.loads(fileutil.read_file(instance_filename))
         self.pid = instance["pid"]
         self.address = str(instance["address"])
         self.client = None
+        self.next_id = 0
+        self.sent = {}
+        self.replies = {}
+        self.legacy = False
         if not pid_exists(self.pid):
             raise Exception("Instance pid is invalid")
 
@@ -19,13 +52,66 @@ class AppInstance(object):
             self.client = Client(self.address)
         return self.client
 
-    def call(self, name, *args, **kwargs):
+    def send_calls(self, calls):
+        client = self.connect()
+        self.next_id += 1
+        calls = [[name, list(args), dict(kwargs)] for name, args, kwargs in calls]
+        self.sent[self.next_id] = calls
+        if not self.legacy:
+            client.send({"version": PROTOCOL_VERSION, "id": self.next_id, "calls": calls})
+        return self.next_id
+
+    def send(self, name, *args, **kwargs):
+        return self.send_calls([(name, args, kwargs)])
+
+    # Legacy instances run one call per message, and can't report errors
+    def call_legacy(self, request_id):
         client = self.connect()
-        client.send((name, args, kwargs))
-        return client.recv()
+        results = []
+        for name, args, kwargs in self.sent.pop(request_id):
+            client.send((name, args, kwargs))
+            results.append([True, client.recv()])
+        return {"id": request_id, "results": results}
+
+    def wait(self, request_id):
+        client = self.connect()
+        while request_id not in self.replies:
+            if self.legacy:
+                self.replies[request_id] = self.call_legacy(request_id)
+                break
+            reply = client.recv()
+            if not isinstance(reply, dict) or "id" not in reply:
+                # A legacy instance answers every request sent so far with
+                # None, in order. The requests are sent again as tuples.
+                self.legacy = True
+                for i in xrange(len(self.sent) - 1):
+                    client.recv()
+                continue
+            self.sent.pop(reply["id"], None)
+            self.replies[reply["id"]] = reply
+        reply = self.replies.pop(request_id)
+        if "error" in reply:
+            raise AppInstanceError(reply["error"])
+        values = []
+        for ok, value in reply["results"]:
+            if not ok:
+                raise AppInstanceError(value)
+            values.append(value)
+        return values
+
+    def call_batch(self, calls):
+        return self.wait(self.send_calls(calls))
+
+    def call(self, name, *args, **kwargs):
+        return self.call_batch([(name, args, kwargs)])[0]
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+            self.client = None
 
 def make_instance_filename(name):
-    return os.path.join(tempfile.gettempdir(), "." + getpass.getuser() + ".devo-instance")
+    return os.path.join(tempfile.gettempdir(), "." + getpass.getuser() + "." + name + "-instance")
 
 def get_app_instance(app_name):
     try:
@@ -33,6 +119,12 @@ def get_app_instance(app_name):
     except Exception:
         pass
 
+def parse_call(call):
+    method_name = call[0]
+    args = call[1] if len(call) > 1 else ()
+    kwargs = call[2] if len(call) > 2 else {}
+    return method_name, args, kwargs
+
 class AppListener(object):
     def __init__(self, app_name, handler):
         self.handler = handler
@@ -61,46 +153,99 @@ class AppListener(object):
                 except Exception:
                     conn.close()
 
-    def get_call(self, call):
-        try:
-            method_name = call[0]
-            args = call[1] if len(call) >= 1 else ()
-            kwargs = call[2] if len(call) >= 2 else {}
-            method = getattr(self.handler, method_name, None)
-            return method, args, kwargs
-        except Exception:
-            return None, (), {}
-
-    def call(self, method, args, kwargs):
-        future = Future()
-        scheduler = get_scheduler()
-        scheduler.post_call(future.call, method, *args, **kwargs)
-        result = future.wait()
-        if isinstance(result, Future):
-            result = result.wait()
-        return result
+    def get_method(self, method_name):
+        if method_name.startswith("_"):
+            raise AttributeError("Invalid method name: %s" % method_name)
+        return getattr(self.handler, method_name)
 
-    def call_loop(self, conn):
-        while True:
+    @coroutine
+    def run_calls(self, calls):
+        results = []
+        for call in calls:
             try:
-                call = conn.recv()
-            except EOFError:
-                return
-            if call is None:
+                method_name, args, kwargs = parse_call(call)
+                result = self.get_method(method_name)(*args, **kwargs)
+                if isinstance(result, Future):
+                    result = (yield result)
+                results.append([True, result])
+            except Exception as e:
+                results.append([False, str(e)])
+        yield results
+
+    # Always puts a reply, so the client isn't left waiting if the calls fail
+    # or are cancelled
+    def post_calls(self, calls, make_reply, make_error, replies):
+        def start():
+            try:
+                future = self.run_calls(calls)
+            except Exception as e:
+                replies.put(make_error(str(e)))
                 return
+            future.bind(
+                success = lambda results: replies.put(make_reply(results)),
+                failure = lambda e, tb: replies.put(make_error(str(e))),
+                cancelled = lambda future: replies.put(make_error("Cancelled")))
+        get_scheduler().post_call(start)
 
-            result = None
-            method, args, kwargs = self.get_call(call)
-            if method:
-                try:
-                    result = self.call(method, args, kwargs)
-                except Exception:
-                    pass
+    def post_request(self, request, replies):
+        request_id = request.get("id")
+
+        def make_reply(results):
+            return {"version": PROTOCOL_VERSION, "id": request_id, "results": results}
+
+        def make_error(message):
+            return {"version": PROTOCOL_VERSION, "id": request_id, "error": message}
+
+        if request.get("version") != PROTOCOL_VERSION:
+            replies.put(make_error("Unsupported protocol version: %r" % request.get("version")))
+            return
+        self.post_calls(request.get("calls", ()), make_reply, make_error, replies)
+
+    def post_legacy_call(self, call, replies):
+        def make_reply(results):
+            ok, value = results[0]
+            return value if ok else None
+
+        def make_error(message):
+            return None
 
+        self.post_calls([call], make_reply, make_error, replies)
+
+    # Replies are sent from their own thread, so the main thread never
+    # blocks on a client which isn't reading them.
+    def reply_loop(self, conn, replies):
+        while True:
+            reply = replies.get()
+            if reply is None:
+                break
             try:
-                conn.send(result)
+                conn.send(reply)
             except Exception:
                 pass
+        conn.close()
+
+    def call_loop(self, conn):
+        replies = Queue.Queue()
+        thread = threading.Thread(target=self.reply_loop, args=(conn, replies))
+        thread.daemon = True
+        thread.start()
+        try:
+            while True:
+                try:
+                    message = conn.recv()
+                except (EOFError, IOError):
+                    return
+                if message is None:
+                    return
+                try:
+                    if isinstance(message, dict):
+                        self.post_request(message, replies)
+                    else:
+                        self.post_legacy_call(message, replies)
+                except Exception:
+                    pass
+        finally:
+            replies.put(None)
 
     def shutdown(self):
         if self.listener:
@@ -1,43 +1,143 @@
-import sys, traceback, threading, functools, types, weakref, collections
+import sys, time, traceback, threading, functools, types, weakref, collections, multiprocessing, cPickle
+
+# Priority classes for async calls. Interactive calls (the user is waiting on
+# the result) always run before background calls, which run before bulk
+# calls. Background and bulk calls together may use all but one of the
+# threads, so that there is always a thread free for interactive calls, and
+# bulk calls on their own may use half of them.
+PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND, PRIORITY_BULK = range(3)
+PRIORITIES = (PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND, PRIORITY_BULK)
+
+class AsyncCallStats(object):
+    def __init__(self):
+        self.num_run = 0
+        self.num_cancelled = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def add_wait(self, wait_time):
+        self.num_run += 1
+        self.wait_total += wait_time
+        self.wait_max = max(self.wait_max, wait_time)
 
 class AsyncCallThreadPool(object):
     def __init__(self, max_threads):
         self.max_threads = max_threads
         self.num_waiting = 0
+        self.num_starting = 0
         self.threads = set()
-        self.calls = collections.deque()
+        # Calls are queued per priority class and per caller. The callers of
+        # each class are served round-robin, so one caller queueing many calls
+        # doesn't hold up the others.
+        self.queues = [collections.OrderedDict() for priority in PRIORITIES]
+        self.num_queued = [0 for priority in PRIORITIES]
+        self.num_running = [0 for priority in PRIORITIES]
+        self.limits = [max_threads, max(1, max_threads - 1), max(1, max_threads // 2)]
+        self.non_interactive_limit = max(1, max_threads - 1)
+        self.stats = [AsyncCallStats() for priority in PRIORITIES]
         self.quit = False
         self.cond = threading.Condition()
 
-    def call(self, func, args, kwargs):
-        future = Future()
+    def call(self, func, args, kwargs, priority=PRIORITY_BACKGROUND, caller=None):
+        future = Future(getattr(func, "__name__", ""))
+        if caller is None:
+            caller = getattr(func, "im_self", None)
+            if caller is None:
+                caller = func
         with self.cond:
-            self.calls.appendleft((future, func, args, kwargs))
-            if self.num_waiting == 0 and len(self.threads) < self.max_threads:
+            calls = self.queues[priority].get(caller)
+            if calls is None:
+                calls = self.queues[priority][caller] = collections.deque()
+            calls.append((future, func, args, kwargs, time.time()))
+            self.num_queued[priority] += 1
+            # Start a thread for each call which could run now and which no
+            # idle thread will pick up
+            if self.__num_runnable() > self.num_waiting + self.num_starting \
+            and len(self.threads) < self.max_threads:
                 thread = threading.Thread(target=self.__call_thread)
                 thread.daemon = True
-                thread.start()
                 self.threads.add(thread)
+                self.num_starting += 1
+                thread.start()
             self.cond.notify()
         return future
 
+    def __num_non_interactive_free(self):
+        return self.non_interactive_limit \
+             - self.num_running[PRIORITY_BACKGROUND] - self.num_running[PRIORITY_BULK]
+
+    def __num_runnable(self):
+        bulk = max(0, min(self.num_queued[PRIORITY_BULK],
+                          self.limits[PRIORITY_BULK] - self.num_running[PRIORITY_BULK]))
+        non_interactive = min(self.__num_non_interactive_free(),
+                              self.num_queued[PRIORITY_BACKGROUND] + bulk)
+        return self.num_queued[PRIORITY_INTERACTIVE] + max(0, non_interactive)
+
+    def __next_call(self):
+        for priority in PRIORITIES:
+            if self.num_running[priority] >= self.limits[priority]:
+                continue
+            if priority != PRIORITY_INTERACTIVE and self.__num_non_interactive_free() <= 0:
+                break
+            callers = self.queues[priority]
+            while callers:
+                caller, calls = callers.iteritems().next()
+                call = calls.popleft()
+                del callers[caller]
+                if calls:
+                    callers[caller] = calls
+                self.num_queued[priority] -= 1
+                if call[0].cancelled:
+                    self.stats[priority].num_cancelled += 1
+                    continue
+                self.stats[priority].add_wait(time.time() - call[4])
+                return priority, call
+        return None, None
+
     def __call_thread(self):
+        priority = None
+        with self.cond:
+            self.num_starting -= 1
         try:
             while True:
                 with self.cond:
-                    if not self.calls:
+                    if priority is not None:
+                        self.num_running[priority] -= 1
+                    priority, call = self.__next_call()
+                    if call is None and not self.quit:
                         self.num_waiting += 1
                         try:
                             self.cond.wait(1)
                         finally:
                             self.num_waiting -= 1
-                    if self.quit or not self.calls:
+                        priority, call = self.__next_call()
+                    if self.quit or call is None:
+                        priority = None
                         return
-                    future, func, args, kwargs = self.calls.pop()
+                    self.num_running[priority] += 1
+                future, func, args, kwargs, queued_time = call
+                if _tracer is not None:
+                    _tracer.call_started(future)
                 future.call(func, *args, **kwargs)
+                if _tracer is not None:
+                    _tracer.call_finished(future)
         finally:
             with self.cond:
+                if priority is not None:
+                    self.num_running[priority] -= 1
                 self.threads.remove(threading.current_thread())
+                self.cond.notify()
+
+    def get_stats(self):
+        with self.cond:
+            return [dict(
+                queued = self.num_queued[priority],
+                running = self.num_running[priority],
+                run = stats.num_run,
+                cancelled = stats.num_cancelled,
+                wait_avg = stats.wait_total / stats.num_run if stats.num_run else 0.0,
+                wait_max = stats.wait_max,
+            ) for priority, stats in enumerate(self.stats)]
 
     def shutdown(self):
         with self.cond:
@@ -51,9 +151,101 @@ class AsyncCallThreadPool(object):
             for thread in threads:
                 thread.join()
 
+def _call_in_process(func, args, kwargs):
+    try:
+        return True, func(*args, **kwargs)
+    except Exception as e:
+        tb = traceback.format_exc()
+        try:
+            cPickle.dumps(e, cPickle.HIGHEST_PROTOCOL)
+        except Exception:
+            e = Exception(repr(e))
+        return False, (e, tb)
+
+# Runs CPU-bound calls in worker processes, started on first use and reused.
+# apply_async only queues the call; arguments are pickled by the pool's task
+# handler thread and results are unpickled by its result handler thread,
+# which completes the future.
+#
+# Python 2's apply_async has no error callback, and a call whose worker dies
+# is never completed, so while calls are pending a monitor thread polls them.
+# A call which failed (e.g. its arguments couldn't be pickled) fails its
+# future. If a worker process dies, every pending future is failed and the
+# pool is replaced on the next call.
+class AsyncCallProcessPool(object):
+    def __init__(self, max_processes=None, poll_interval=0.1):
+        self.max_processes = max_processes
+        self.poll_interval = poll_interval
+        self.pool = None
+        self.workers = []
+        self.pending = []
+        self.monitor = None
+        self.lock = threading.Lock()
+
+    def call(self, func, args, kwargs):
+        future = Future(getattr(func, "__name__", ""))
+        def on_result(result):
+            ok, value = result
+            if ok:
+                future.set_done(value)
+            else:
+                future.set_failed(*value)
+        with self.lock:
+            if self.pool is None:
+                self.pool = multiprocessing.Pool(self.max_processes)
+                self.workers = list(self.pool._pool)
+            result = self.pool.apply_async(_call_in_process, (func, args, kwargs), callback=on_result)
+            self.pending.append((result, future))
+            if self.monitor is None:
+                self.monitor = threading.Thread(target=self.__monitor)
+                self.monitor.daemon = True
+                self.monitor.start()
+        return future
+
+    def __monitor(self):
+        while True:
+            time.sleep(self.poll_interval)
+            failed = []
+            lost = []
+            dead_pool = None
+            with self.lock:
+                pending = []
+                for result, future in self.pending:
+                    if not result.ready():
+                        pending.append((result, future))
+                    elif not result.successful():
+                        failed.append((result, future))
+                if pending and any(not worker.is_alive() for worker in self.workers):
+                    lost = pending
+                    pending = []
+                    dead_pool = self.pool
+                    self.pool = None
+                self.pending = pending
+                if not pending:
+                    self.monitor = None
+            for result, future in failed:
+                try:
+                    result.get(0)
+                except Exception as e:
+                    future.set_failed(e, traceback.format_exc())
+            for result, future in lost:
+                future.set_failed(Exception("Worker process died"), "")
+            if dead_pool is not None:
+                dead_pool.terminate()
+            if not pending:
+                return
+
+    def shutdown(self):
+        with self.lock:
+            if self.pool is not None:
+                self.pool.terminate()
+                self.pool.join()
+                self.pool = None
+
 class Scheduler(object):
-    def __init__(self, max_threads=10):
+    def __init__(self, max_threads=10, max_processes=None):
         self.__async_pool = AsyncCallThreadPool(max_threads)
+        self.__process_pool = AsyncCallProcessPool(max_processes)
 
     def call(self, func, *args, **kwargs):
         raise NotImplementedError()
@@ -64,8 +256,18 @@ class Scheduler(object):
     def async_call(self, func, *args, **kwargs):
         return self.__async_pool.call(func, args, kwargs)
 
+    def async_call_priority(self, priority, func, *args, **kwargs):
+        return self.__async_pool.call(func, args, kwargs, priority)
+
+    def async_call_cpu(self, func, *args, **kwargs):
+        return self.__process_pool.call(func, args, kwargs)
+
+    def get_async_stats(self):
+        return self.__async_pool.get_stats()
+
     def shutdown(self):
         self.__async_pool.shutdown()
+        self.__process_pool.shutdown()
 
     def log_error(self, traceback):
         self.post_call(sys.stdout.write, traceback + "\n")
@@ -89,6 +291,15 @@ def shutdown_scheduler():
     if _global_scheduler:
         _global_scheduler.shutdown()
 
+_tracer = None
+
+def get_tracer():
+    return _tracer
+
+def set_tracer(tracer):
+    global _tracer
+    _tracer = tracer
+
 WAITING, DONE, FAILED, CANCELLED = range(4)
 
 class FutureNotReady(Exception):
@@ -164,6 +375,8 @@ class Future(object):
         self.__traceback = ""
         self.__cond = threading.Condition()
         self.__cleanup = _FutureCleanup(self, context, self.__on_finished)
+        if _tracer is not None:
+            _tracer.future_created(self)
 
     def __repr__(self):
         cls = self.__class__
@@ -193,10 +406,14 @@ class Future(object):
             self.__cleanup.finish_handled()
             if failure_handled:
                 self.__cleanup.failure_handled()
+        if _tracer is not None:
+            _tracer.callbacks_started(self)
         for handler in handlers:
             _global_scheduler.call(handler, *args)
         for handler in finished_handlers:
             _global_scheduler.call(handler)
+        if _tracer is not None:
+            _tracer.callbacks_finished(self)
 
     def set_done(self, result):
         with self.__cond:
@@ -207,6 +424,8 @@ class Future(object):
             self.__result = result
             self.__status = DONE
             self.__cond.notify_all()
+        if _tracer is not None:
+            _tracer.future_completed(self, "done")
         _global_scheduler.post_call(self.__finish)
 
     def set_failed(self, exn, traceback):
@@ -222,6 +441,8 @@ class Future(object):
             self.__status = FAILED
             self.__cleanup.failure_traceback(traceback)
             self.__cond.notify_all()
+        if _tracer is not None:
+            _tracer.future_completed(self, "failed")
         _global_scheduler.post_call(self.__finish)
 
     def cancel(self):
@@ -230,6 +451,8 @@ class Future(object):
                 return
             self.__status = CANCELLED
             self.__cond.notify_all()
+        if _tracer is not None:
+            _tracer.future_completed(self, "cancelled")
         _global_scheduler.post_call(self.__finish)
 
     def call(self, func, *args, **kwargs):
@@ -268,6 +491,11 @@ class Future(object):
         if self.__status == CANCELLED:
             raise FutureCancelled()
 
+    @property
+    def cancelled(self):
+        with self.__cond:
+            return self.__status == CANCELLED
+
     @property
     def failed(self):
         with self.__cond:
@@ -343,6 +571,8 @@ class Coroutine(Future):
             self.set_failed(sys.exc_info()[1], traceback.format_exc())
         else:
             if isinstance(ret, Future):
+                if _tracer is not None:
+                    _tracer.future_linked(self, ret)
                 self.__continuation = ret
                 ret.bind(self.__success_next, self.__failure_next, self.__cancelled_next)
             else:
@@ -470,6 +700,12 @@ def queued_coroutine(queue_name):
 def async_call(func, *args, **kwargs):
     return _global_scheduler.async_call(func, *args, **kwargs)
 
+def async_call_priority(priority, func, *args, **kwargs):
+    return _global_scheduler.async_call_priority(priority, func, *args, **kwargs)
+
+def async_call_cpu(func, *args, **kwargs):
+    return _global_scheduler.async_call_cpu(func, *args, **kwargs)
+
 def async_function(func):
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
@@ -0,0 +1,124 @@
+import os, json, time, threading, weakref
+
+# Opt-in tracing of futures and coroutines, enabled with async.set_tracer().
+#
+# For every future this records when it was created, when it ran on the
+# thread pool (if it was an async call), when it completed and when its
+# callbacks ran on the main thread. A future yielded by a coroutine is linked
+# to the coroutine as its parent, so chains of coroutines form a trace tree.
+# The trace can be exported in the Chrome trace event format, for viewing in
+# chrome://tracing or Perfetto.
+
+class FutureTrace(object):
+    __slots__ = (
+        "id", "name", "kind", "parent", "created", "exec_start", "exec_end",
+        "exec_thread", "completed", "status", "callback_start", "callback_end",
+    )
+
+    def __init__(self, id, name, kind, created):
+        self.id = id
+        self.name = name
+        self.kind = kind
+        self.parent = None
+        self.created = created
+        self.exec_start = None
+        self.exec_end = None
+        self.exec_thread = None
+        self.completed = None
+        self.status = ""
+        self.callback_start = None
+        self.callback_end = None
+
+class AsyncTracer(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.traces = []
+        self.future_traces = weakref.WeakKeyDictionary()
+        self.start_time = time.time()
+        self.main_thread = threading.current_thread().ident
+
+    def __get(self, future):
+        with self.lock:
+            return self.future_traces.get(future)
+
+    def future_created(self, future):
+        now = time.time()
+        with self.lock:
+            trace = FutureTrace(len(self.traces), future.name or "<anonymous>",
+                                future.__class__.__name__, now)
+            self.traces.append(trace)
+            self.future_traces[future] = trace
+
+    def future_linked(self, parent, child):
+        parent_trace = self.__get(parent)
+        child_trace = self.__get(child)
+        if parent_trace and child_trace and child_trace.parent is None:
+            child_trace.parent = parent_trace.id
+
+    def call_started(self, future):
+        trace = self.__get(future)
+        if trace:
+            trace.exec_start = time.time()
+            trace.exec_thread = threading.current_thread().ident
+
+    def call_finished(self, future):
+        trace = self.__get(future)
+        if trace:
+            trace.exec_end = time.time()
+
+    def future_completed(self, future, status):
+        trace = self.__get(future)
+        if trace:
+            trace.completed = time.time()
+            trace.status = status
+
+    def callbacks_started(self, future):
+        trace = self.__get(future)
+        if trace:
+            trace.callback_start = time.time()
+
+    def callbacks_finished(self, future):
+        trace = self.__get(future)
+        if trace:
+            trace.callback_end = time.time()
+
+    def get_chrome_trace_events(self):
+        with self.lock:
+            traces = list(self.traces)
+        pid = os.getpid()
+
+        def us(t):
+            return int((t - self.start_time) * 1000000)
+
+        def root_id(trace):
+            while trace.parent is not None:
+                trace = traces[trace.parent]
+            return trace.id
+
+        events = [dict(ph="M", name="thread_name", pid=pid, tid=self.main_thread,
+                       args=dict(name="main"))]
+        for trace in traces:
+            args = dict(id=trace.id, parent=trace.parent, kind=trace.kind, status=trace.status)
+            if trace.completed is not None:
+                # Async spans with the same id nest, so each chain gets one track
+                root = root_id(trace)
+                events.append(dict(ph="b", cat="future", name=trace.name, id=root,
+                                   pid=pid, tid=self.main_thread, ts=us(trace.created), args=args))
+                events.append(dict(ph="e", cat="future", name=trace.name, id=root,
+                                   pid=pid, tid=self.main_thread, ts=us(trace.completed)))
+            if trace.exec_start is not None and trace.exec_end is not None:
+                events.append(dict(ph="X", cat="execute", name=trace.name,
+                                   pid=pid, tid=trace.exec_thread,
+                                   ts=us(trace.exec_start), dur=us(trace.exec_end) - us(trace.exec_start),
+                                   args=dict(args, queue_wait_ms=(trace.exec_start - trace.created) * 1000)))
+            if trace.callback_start is not None and trace.callback_end is not None:
+                latency = trace.callback_start - (trace.completed or trace.callback_start)
+                events.append(dict(ph="X", cat="callback", name=trace.name,
+                                   pid=pid, tid=self.main_thread,
+                                   ts=us(trace.callback_start), dur=us(trace.callback_end) - us(trace.callback_start),
+                                   args=dict(args, callback_latency_ms=latency * 1000)))
+        return events
+
+    def export_chrome_trace(self, filename):
+        with open(filename, "w") as f:
+            json.dump(dict(traceEvents=self.get_chrome_trace_events(), displayTimeUnit="ms"), f)
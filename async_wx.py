@@ -1,20 +1,90 @@
-import sys, traceback, wx
+import sys, time, traceback, threading, collections, wx
 import async
 
+# Calls posted from any thread are queued and run on the main thread by a
+# single wx.CallAfter wakeup, which drains the queue until it is empty or the
+# time budget is used up. In the latter case, another wakeup is posted so the
+# rest of the queue runs on the next iteration of the event loop, after
+# pending paint and input events.
+
+class WxDispatchStats(object):
+    def __init__(self):
+        self.num_posted = 0
+        self.num_run = 0
+        self.num_wakeups = 0
+        self.max_batch = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def as_dict(self):
+        return dict(
+            posted = self.num_posted,
+            run = self.num_run,
+            wakeups = self.num_wakeups,
+            max_batch = self.max_batch,
+            latency_avg = self.latency_total / self.num_run if self.num_run else 0.0,
+            latency_max = self.latency_max,
+        )
+
 class WxScheduler(async.Scheduler):
+    def __init__(self, time_budget=0.02):
+        async.Scheduler.__init__(self)
+        self.time_budget = time_budget
+        self.stats = WxDispatchStats()
+        self.__lock = threading.Lock()
+        self.__calls = collections.deque()
+        self.__wakeup_posted = False
+
+    def __run(self, func, args, kwargs):
+        try:
+            func(*args, **kwargs)
+        except SystemExit:
+            raise
+        except:
+            sys.stdout.write(traceback.format_exc())
+
     def call(self, func, *args, **kwargs):
         if wx.Thread_IsMain():
-            try:
-                func(*args, **kwargs)
-            except SystemExit:
-                raise
-            except:
-                sys.stdout.write(traceback.format_exc())
+            self.__run(func, args, kwargs)
         else:
-            wx.CallAfter(func, *args, **kwargs)
+            self.post_call(func, *args, **kwargs)
 
     def post_call(self, func, *args, **kwargs):
-        wx.CallAfter(func, *args, **kwargs)
+        with self.__lock:
+            self.__calls.append((func, args, kwargs, time.time()))
+            self.stats.num_posted += 1
+            if self.__wakeup_posted:
+                return
+            self.__wakeup_posted = True
+        wx.CallAfter(self.__drain)
+
+    def __drain(self):
+        stats = self.stats
+        start = time.time()
+        batch = 0
+        stats.num_wakeups += 1
+        try:
+            while True:
+                with self.__lock:
+                    if not self.__calls:
+                        self.__wakeup_posted = False
+                        return
+                    func, args, kwargs, posted_time = self.__calls.popleft()
+                now = time.time()
+                latency = now - posted_time
+                stats.num_run += 1
+                stats.latency_total += latency
+                stats.latency_max = max(stats.latency_max, latency)
+                batch += 1
+                self.__run(func, args, kwargs)
+                if time.time() - start >= self.time_budget:
+                    break
+        finally:
+            stats.max_batch = max(stats.max_batch, batch)
+        wx.CallAfter(self.__drain)
+
+    def get_dispatch_stats(self):
+        return self.stats.as_dict()
 
 def set_wx_scheduler():
     async.set_scheduler(WxScheduler())
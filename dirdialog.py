@@ -21,7 +21,7 @@ class DirDialog(wx.Dialog):
         wx.Dialog.__init__(self, parent, size=size, title=message, style=style)
 
         toplevel = [DirNode(path)] if path else None
-        filter = DirTreeFilter(show_files=False)
+        filter = DirTreeFilter(show_files=False, use_ignore_files=False)
         self.dirtree = DirDialogTreeCtrl(self, filter)
         self.dirtree.SetTopLevel(toplevel)
         if select_path:
@@ -1,7 +1,9 @@
 import os, os.path
 import sys
+import collections
 import time
 import threading
+import weakref
 import wx
 from fsmonitor import FSMonitor, FSEvent
 
@@ -11,9 +13,10 @@ from dialogs import dialogs
 from dirtree_constants import *
 from dirtree_filter import DirTreeFilter
 from dirtree_node import SimpleNode, FSNode, DirNode
+from ignore import ignore_filenames
 from menu import Menu, MenuItem, MenuSeparator
 from signal_wx import Signal
-from util import iter_tree_children, iter_tree_breadth_first, frozen_window, is_dead_object
+from util import iter_tree_children, frozen_window, is_dead_object
 from resources import load_bitmap
 
 context_menu = Menu("", [
@@ -36,6 +39,11 @@ def split_path(path, relative_to=""):
             pass
     return path.strip(os.path.sep).split(os.path.sep)
 
+def merge_paths_changed(pending, emission):
+    (paths,), kwargs = pending
+    (new_paths,), new_kwargs = emission
+    return (paths + new_paths,), kwargs
+
 def make_top_level():
     if sys.platform == "win32":
         import win32api, pywintypes
@@ -116,9 +124,15 @@ class DirTreeCtrl(wx.TreeCtrl, wx.FileDropTarget):
         self.select_later_name = None
         self.select_later_time = 0
         self.expanding_all = False
+        self.expand_all_seen = weakref.WeakSet()
+        self.expand_all_view = None
+        self.expand_visible_future = None
+        self.chunk_size = 500
+        self.pending_nodes = weakref.WeakSet()
         self.drop_item = None
-        self.sig_update_tree = Signal(self)
+        self.sig_update_tree = Signal(self, coalesce=True)
         self.sig_update_tree.bind(self.UpdateFromFSMonitor)
+        self.sig_paths_changed = Signal(self, merge=merge_paths_changed)
         self.monitor = FSMonitor()
         self.monitor_thread = DirTreeMonitor(self, self.monitor)
 
@@ -134,6 +148,7 @@ class DirTreeCtrl(wx.TreeCtrl, wx.FileDropTarget):
         self.Bind(wx.EVT_TREE_BEGIN_LABEL_EDIT, self.OnItemBeginLabelEdit)
         self.Bind(wx.EVT_TREE_END_LABEL_EDIT, self.OnItemEndLabelEdit)
         self.Bind(wx.EVT_TREE_BEGIN_DRAG, self.OnBeginDrag)
+        self.Bind(wx.EVT_IDLE, self.OnIdle)
         self.Bind(wx.EVT_MENU, self.OnItemRename, id=ID_DIRTREE_RENAME)
         self.Bind(wx.EVT_MENU, self.OnItemDelete, id=ID_DIRTREE_DELETE)
         self.Bind(wx.EVT_MENU, self.OnNewFolder, id=ID_DIRTREE_NEW_FOLDER)
@@ -162,20 +177,35 @@ class DirTreeCtrl(wx.TreeCtrl, wx.FileDropTarget):
     @managed("cm")
     @coroutine
     def UpdateFromFSMonitor(self):
-        for evt in self.monitor_thread.get_events():
-            if evt.action in add_events:
-                item = (yield evt.user.add(evt.name, self, self.monitor, self.filter))
-                if item:
-                    self.TrySelectLater(item, evt.name)
-            elif evt.action in remove_events:
-                evt.user.remove(evt.name, self, self.monitor)
+        events = self.monitor_thread.get_events()
+        if events:
+            self.sig_paths_changed.signal(
+                [os.path.join(evt.user.path, evt.name) for evt in events])
+        ignore = self.filter.ignore
+        # Coalesce the events for each directory, keeping the last action per name
+        dir_events = collections.OrderedDict()
+        for evt in events:
+            if ignore is not None and evt.name in ignore_filenames:
+                ignore.invalidate(evt.user.path)
+            if evt.action in add_events or evt.action in remove_events:
+                names = dir_events.setdefault(evt.user, collections.OrderedDict())
+                names.pop(evt.name, None)
+                names[evt.name] = evt.action in add_events
+        for node, names in dir_events.iteritems():
+            added = [name for name, add in names.iteritems() if add]
+            removed = [name for name, add in names.iteritems() if not add]
+            items = (yield node.update(added, removed, self, self.monitor, self.filter))
+            for name, item in items.iteritems():
+                self.TrySelectLater(item, name)
 
     def OnItemExpanding(self, evt):
+        self.expand_all_view = None
         node = self.GetEventNode(evt)
         if node.type == 'd' and not node.populated:
             self.ExpandNode(node)
 
     def OnItemCollapsed(self, evt):
+        self.expand_all_view = None
         node = self.GetEventNode(evt)
         if node.type == 'd':
             self.CollapseNode(node)
@@ -260,10 +290,9 @@ class DirTreeCtrl(wx.TreeCtrl, wx.FileDropTarget):
             if name:
                 self.NewFolder(node, name)
 
-    @managed("cm")
-    @coroutine
+    # Expand All only sets a mode: folders are expanded as they scroll into
+    # view, from the idle handler.
     def OnExpandAll(self, evt):
-        del evt
         if self.expanding_all:
             return
         if not dialogs.yes_no(self,
@@ -271,26 +300,54 @@ class DirTreeCtrl(wx.TreeCtrl, wx.FileDropTarget):
                 icon_style=wx.ICON_WARNING):
             return
         self.expanding_all = True
-        try:
-            for item in iter_tree_breadth_first(self, self.GetRootItem()):
-                if not self.expanding_all:
-                    return
-                node = self.GetPyData(item)
-                if node.type == 'd':
-                    if not node.populated:
-                        try:
-                            yield self.ExpandNode(node)
-                        except Exception:
-                            pass
-                    else:
-                        self.Expand(item)
-        finally:
-            self.expanding_all = False
+        self.expand_all_seen.clear()
+        self.expand_all_view = None
 
     def OnCollapseAll(self, evt):
         self.expanding_all = False
         self.CollapseAll()
 
+    def IterVisibleNodes(self):
+        item = self.GetFirstVisibleItem()
+        while item.IsOk() and self.IsVisible(item):
+            yield self.GetPyData(item)
+            item = self.GetNextVisible(item)
+
+    # The visible nodes are only walked again for Expand All when the view
+    # has scrolled, been resized or had items expanded, collapsed or added.
+    def OnIdle(self, evt):
+        evt.Skip()
+        for node in list(self.pending_nodes):
+            if node.pending and node.child_nodes and self.IsExpanded(node.item) \
+            and self.IsVisible(node.child_nodes[-1].item):
+                node.materialise(self, self.chunk_size)
+                self.expand_all_view = None
+        if self.expanding_all and not (self.expand_visible_future and not self.expand_visible_future.ready):
+            view = (self.GetScrollPos(wx.VERTICAL), tuple(self.GetClientSize()))
+            if view == self.expand_all_view:
+                return
+            self.expand_all_view = view
+            nodes = [node for node in self.IterVisibleNodes()
+                     if node.type == 'd' and node not in self.expand_all_seen
+                     and not self.IsExpanded(node.item)]
+            if nodes:
+                self.expand_visible_future = self._ExpandVisibleNodes(nodes)
+
+    @managed("cm")
+    @coroutine
+    def _ExpandVisibleNodes(self, nodes):
+        try:
+            for node in nodes:
+                if not self.expanding_all:
+                    return
+                self.expand_all_seen.add(node)
+                try:
+                    yield self.ExpandNode(node)
+                except Exception:
+                    pass
+        finally:
+            self.expand_all_view = None
+
     def SetItemNode(self, item, node):
         self.SetPyData(item, node)
         node.item = item
@@ -375,6 +432,8 @@ class DirTreeCtrl(wx.TreeCtrl, wx.FileDropTarget):
         self.cm.cancel()
         self.cq.cancel()
         self.monitor_thread.clear()
+        self.expanding_all = False
+        self.pending_nodes.clear()
         self.DeleteAllItems()
         toplevel = toplevel or make_top_level()
         if len(toplevel) == 1:
@@ -409,7 +468,10 @@ class DirTreeCtrl(wx.TreeCtrl, wx.FileDropTarget):
     def _ExpandPaths(self, item, paths):
         expanded = [path[0] for path in paths if path]
         sub_paths = [path[1:] for path in paths if len(path) > 1]
-        yield self.ExpandNode(self.GetPyData(item))
+        node = self.GetPyData(item)
+        yield self.ExpandNode(node)
+        for name in expanded:
+            node.materialise_name(self, name)
         for child_item in iter_tree_children(self, item):
             node = self.GetPyData(child_item)
             name = os.path.basename(node.path) or node.path.strip(os.path.sep)
@@ -429,6 +491,9 @@ class DirTreeCtrl(wx.TreeCtrl, wx.FileDropTarget):
         if node.path == path:
             self.SelectItem(node.item)
         elif node.type == 'd':
+            prefix = os.path.join(node.path, "")
+            if node.path and path.startswith(prefix):
+                node.materialise_name(self, path[len(prefix):].split(os.path.sep)[0])
             for child_item in iter_tree_children(self, item):
                 self._SelectExpandedPath(child_item, path)
 
@@ -1,4 +1,5 @@
 import re
+from ignore import IgnoreRules
 from util import compile_file_patterns
 
 hidden_files = ".*;*~;*.swp;*.pyc;*.pyo;*.o;*.a;*.obj;*.lib;*.class"
@@ -9,10 +10,11 @@ re_hidden_dirs = compile_file_patterns(hidden_dirs)
 
 class DirTreeFilter(object):
     def __init__(self, show_hidden=False, show_files=True, show_dirs=True,
-                 hidden_files=hidden_files, hidden_dirs=hidden_dirs):
+                 hidden_files=hidden_files, hidden_dirs=hidden_dirs, use_ignore_files=True):
         self.show_hidden = show_hidden
         self.show_files = show_files
         self.show_dirs = show_dirs
+        self.ignore = IgnoreRules() if use_ignore_files and not show_hidden else None
         self.re_hidden_file = re_hidden_files
         self.re_hidden_dirs = re_hidden_dirs
 
@@ -1,88 +1,83 @@
-import collections
 import os, os.path
-import stat
 import traceback
+from bisect import bisect_left
 import wx
 
-import fileutil
 from async import async_call, coroutine
 from dirtree_constants import *
-from util import iter_tree_children, natural_order_key
+from listing import get_file_info, list_dir
+from util import frozen_window, natural_order_key
 
-class FileInfo(collections.namedtuple("FileInfo", "filename dirpath stat_result listable hidden")):
-    @property
-    def path(self):
-        return os.path.join(self.dirpath, self.filename)
-    @property
-    def is_file(self):
-        return stat.S_ISREG(self.stat_result.st_mode)
-    @property
-    def is_dir(self):
-        return stat.S_ISDIR(self.stat_result.st_mode)
-    @property
-    def node_type(self):
-        if stat.S_ISREG(self.stat_result.st_mode):
-            return 'f'
-        if stat.S_ISDIR(self.stat_result.st_mode):
-            return 'd'
-        return ''
-
-def get_file_info(dirpath, filename):
-    path = os.path.join(dirpath, filename)
-    stat_result = os.stat(path)
-    hidden = fileutil.is_hidden_file(path)
-    if stat.S_ISDIR(stat_result.st_mode):
-        try:
-            listable = os.access(path, os.X_OK)
-        except OSError:
-            listable = False
-    else:
-        listable = False
-    return FileInfo(filename, dirpath, stat_result, listable, hidden)
+def list_dir_file_info_sorted(dirpath, ignore=None):
+    result = []
+    for info in list_dir(dirpath):
+        if ignore is not None and ignore.is_ignored(dirpath, info.filename, info.is_dir):
+            continue
+        if info.node_type:
+            # Resolve the fields the tree uses while still off the main thread
+            info.hidden, info.listable
+            result.append(info)
+    result.sort(key=file_info_order_key)
+    return result
 
-def list_dir_file_info_sorted(dirpath):
+def file_info_order_key(file_info):
+    return (file_info.node_type != 'd', file_info.sort_key)
+
+def get_file_info_list(dirpath, names):
     result = []
-    for filename in os.listdir(dirpath):
+    for name in names:
         try:
-            result.append(get_file_info(dirpath, filename))
+            result.append(get_file_info(dirpath, name))
         except OSError:
             pass
-    result.sort(key=lambda info: natural_order_key(info.filename))
     return result
 
+# The children of each FSNode are indexed by order_key in parallel sorted
+# lists which mirror the order of the items in the tree, so the position of
+# a child can be found by bisection instead of walking the tree items.
+
 def dirtree_insert_node(tree, parent_item, node, image):
-    # Optimise common case when expanding directory for the first time
-    item = tree.GetLastChild(parent_item)
-    if item.IsOk() and tree.GetPyData(item) < node:
+    parent = tree.GetPyData(parent_item)
+    key = node.order_key
+    index = bisect_left(parent.child_keys, key)
+    if index < len(parent.child_keys) and parent.child_keys[index] == key:
+        existing_node = parent.child_nodes[index]
+        return existing_node.item, existing_node
+    if index == len(parent.child_keys):
         item = tree.AppendItem(parent_item, node.label, image)
-        tree.SetItemNode(item, node)
-        return item, node
-
-    # Search for the position to insert
-    for index, existing_item in enumerate(iter_tree_children(tree, parent_item)):
-        existing_node = tree.GetPyData(existing_item)
-        if node == existing_node:
-            return existing_item, existing_node
-        elif node < existing_node:
-            item = tree.InsertItemBefore(parent_item, index, node.label, image)
-            tree.SetItemNode(item, node)
-            return item, node
-
-    item = tree.AppendItem(parent_item, node.label, image)
+    else:
+        item = tree.InsertItemBefore(parent_item, index, node.label, image)
     tree.SetItemNode(item, node)
+    parent.child_keys.insert(index, key)
+    parent.child_nodes.insert(index, node)
     return item, node
 
 def dirtree_create_node(tree, parent_item, file_info):
-    node = FSNode(file_info.path, file_info.node_type)
+    node = FSNode(file_info.path, file_info.node_type, sort_key=file_info.sort_key)
     image = IM_FILE if node.type == 'f' else IM_FOLDER if file_info.listable else IM_FOLDER_DENIED
     item, node = dirtree_insert_node(tree, parent_item, node, image)
     tree.SetItemHasChildren(item, node.type == 'd')
     tree.SetItemHasChildren(parent_item, True)
     return item
 
+# Nodes stay alive while their directory is watched, so the nodes of a
+# deleted subtree must be dropped from the tree's pending set explicitly.
+def discard_pending_nodes(tree, node):
+    tree.pending_nodes.discard(node)
+    for child in node.child_nodes:
+        discard_pending_nodes(tree, child)
+
 def dirtree_delete(tree, parent_item, text):
-    for item in iter_tree_children(tree, parent_item):
-        if text == tree.GetItemText(item):
+    parent = tree.GetPyData(parent_item)
+    sort_key = natural_order_key(text)
+    for key in ((False, sort_key), (True, sort_key)):
+        index = bisect_left(parent.child_keys, key)
+        if index < len(parent.child_keys) and parent.child_keys[index] == key:
+            node = parent.child_nodes[index]
+            item = node.item
+            discard_pending_nodes(tree, node)
+            del parent.child_keys[index]
+            del parent.child_nodes[index]
             select_item = tree.GetNextSibling(item)
             if not select_item.IsOk():
                 select_item = tree.GetPrevSibling(item)
@@ -115,30 +110,48 @@ class SimpleNode(object):
     def collapse(self, tree, monitor):
         pass
 
+    def materialise_name(self, tree, name):
+        pass
+
+# Only the first chunk of a directory's children are created as tree items
+# when it is expanded. The rest are kept as file infos in the pending list
+# (sorted after all the materialised children) and materialised by the tree
+# as the user scrolls down to them.
+
 class FSNode(object):
-    __slots__ = ("populated", "path", "type", "item", "watch", "label")
+    __slots__ = ("populated", "path", "type", "item", "watch", "label", "sort_key",
+                 "child_keys", "child_nodes", "pending_keys", "pending", "__weakref__")
 
-    def __init__(self, path, type, label=""):
+    def __init__(self, path, type, label="", sort_key=None):
         self.populated = False
         self.path = path
         self.type = type
         self.item = None
         self.watch = None
         self.label = label or os.path.basename(path) or path
+        self.sort_key = sort_key or natural_order_key(self.label)
+        self.child_keys = []
+        self.child_nodes = []
+        self.pending_keys = []
+        self.pending = []
+
+    @property
+    def order_key(self):
+        return (self.type != 'd', self.sort_key)
 
     def __lt__(self, other):
         if not isinstance(other, FSNode):
             raise TypeError()
         if self.type != other.type:
             return self.type == 'd' and other.type == 'f'
-        return natural_order_key(self.label) < natural_order_key(other.label)
+        return self.sort_key < other.sort_key
 
     def __gt__(self, other):
         if not isinstance(other, FSNode):
             raise TypeError()
         if self.type != other.type:
             return self.type == 'f' and other.type == 'd'
-        return natural_order_key(self.label) > natural_order_key(other.label)
+        return self.sort_key > other.sort_key
 
     def __eq__(self, other):
         if not isinstance(other, FSNode):
@@ -160,11 +173,12 @@ class FSNode(object):
             try:
                 if not self.watch:
                     self.watch = monitor.add_dir_watch(self.path, user=self)
-                for file_info in (yield async_call(list_dir_file_info_sorted, self.path)):
-                    if file_info.node_type and filter(file_info):
-                        dirtree_create_node(tree, self.item, file_info)
+                file_infos = (yield async_call(list_dir_file_info_sorted, self.path, filter.ignore))
+                self.pending = [x for x in file_infos if x.node_type and filter(x)]
+                self.pending_keys = [file_info_order_key(x) for x in self.pending]
+                self.materialise(tree, tree.chunk_size)
                 tree.SetItemImage(self.item, IM_FOLDER)
-                tree.SetItemHasChildren(self.item, tree.GetFirstChild(self.item)[0].IsOk())
+                tree.SetItemHasChildren(self.item, bool(self.child_nodes))
             except Exception:
                 self.populated = False
                 print traceback.format_exc()
@@ -176,19 +190,63 @@ class FSNode(object):
         #monitor.remove_watch(self.watch)
         #self.populated = False
 
+    def materialise(self, tree, count):
+        file_infos = self.pending[:count]
+        del self.pending[:count]
+        del self.pending_keys[:count]
+        with frozen_window(tree):
+            for file_info in file_infos:
+                dirtree_create_node(tree, self.item, file_info)
+        if self.pending:
+            tree.pending_nodes.add(self)
+        else:
+            tree.pending_nodes.discard(self)
+
+    def materialise_name(self, tree, name):
+        for index, file_info in enumerate(self.pending):
+            if file_info.filename == name:
+                self.materialise(tree, index + 1)
+                break
+
+    def _add_pending(self, file_info):
+        key = file_info_order_key(file_info)
+        index = bisect_left(self.pending_keys, key)
+        if index < len(self.pending_keys) and self.pending_keys[index] == key:
+            self.pending[index] = file_info
+        else:
+            self.pending_keys.insert(index, key)
+            self.pending.insert(index, file_info)
+
+    def _remove_pending(self, name):
+        sort_key = natural_order_key(name)
+        for key in ((False, sort_key), (True, sort_key)):
+            index = bisect_left(self.pending_keys, key)
+            if index < len(self.pending_keys) and self.pending_keys[index] == key:
+                del self.pending_keys[index]
+                del self.pending[index]
+                break
+
+    # Applies a batch of added and removed names to the children in a single
+    # frozen update. Returns a dict of the added items by name.
     @coroutine
-    def add(self, name, tree, monitor, filter):
-        try:
-            file_info = (yield async_call(get_file_info, self.path, name))
-            if file_info.node_type and filter(file_info):
-                yield dirtree_create_node(tree, self.item, file_info)
-        except OSError as e:
-            pass
-
-    def remove(self, name, tree, monitor):
-        dirtree_delete(tree, self.item, name)
-        child_item = tree.GetFirstChild(self.item)[0]
-        tree.SetItemHasChildren(self.item, child_item.IsOk())
+    def update(self, added, removed, tree, monitor, filter):
+        file_infos = (yield async_call(get_file_info_list, self.path, added)) if added else []
+        if filter.ignore is not None:
+            file_infos = [x for x in file_infos if not filter.ignore.is_ignored(self.path, x.filename, x.is_dir)]
+        items = {}
+        with frozen_window(tree):
+            for name in removed:
+                if self.pending:
+                    self._remove_pending(name)
+                dirtree_delete(tree, self.item, name)
+            for file_info in file_infos:
+                if file_info.node_type and filter(file_info):
+                    if self.pending and file_info_order_key(file_info) > self.pending_keys[0]:
+                        self._add_pending(file_info)
+                    else:
+                        items[file_info.filename] = dirtree_create_node(tree, self.item, file_info)
+            tree.SetItemHasChildren(self.item, bool(self.child_nodes))
+        yield items
 
 def DirNode(path):
     return FSNode(path, 'd')
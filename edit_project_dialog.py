@@ -8,10 +8,14 @@ class EditProjectDialog(wx.Dialog):
         wx.Dialog.__init__(self, parent, title="Edit Project", style=style)
 
         self.text_name = wx.TextCtrl(self, value=project["name"], size=(250, -1))
+        self.check_search_index = wx.CheckBox(self, label="&Index files for faster search")
+        self.check_search_index.SetValue(project.get("search_index", False))
         grid = wx.FlexGridSizer(cols=2, vgap=5, hgap=5)
         grid.AddGrowableCol(1)
         grid.Add(wx.StaticText(self, label="Project Name"), 0, wx.ALIGN_CENTRE_VERTICAL)
         grid.Add(self.text_name, 1, wx.EXPAND | wx.ALIGN_CENTRE_VERTICAL)
+        grid.AddSpacer(0)
+        grid.Add(self.check_search_index, 0, wx.ALIGN_CENTRE_VERTICAL)
 
         btnsizer = wx.StdDialogButtonSizer()
         btn_ok = wx.Button(self, wx.ID_OK)
@@ -38,6 +42,7 @@ class EditProjectDialog(wx.Dialog):
         name = self.text_name.Value.strip()
         if name:
             project["name"] = name
+        project["search_index"] = self.check_search_index.GetValue()
 
 if __name__ == "__main__":
     app = wx.App()
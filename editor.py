@@ -1,22 +1,71 @@
-import os
+import os, codecs, hashlib, threading
 import wx
 import wx.stc
 from urllib import urlencode
 
 import ID
-from async import async_call, coroutine
+from async import async_call, async_call_priority, coroutine, PRIORITY_INTERACTIVE
 from dialogs import dialogs
-from fileutil import atomic_write_file, read_file, mkpath
+from fileutil import atomic_write_file, mkpath, FSYNC_NONE
 from menu import MenuItem, MenuSeparator
 from signal_wx import Signal
 from styled_text_ctrl import StyledTextCtrl
-from util import clean_text, shorten_text, set_clipboard_text
+from text_encoding import FALLBACK_ENCODING, get_file_encoding, set_file_encoding, read_file_text
+from util import clean_text, shorten_text, set_clipboard_text, non_printable_re, line_end_re, unique
 
-def decode_text(text):
+def read_text_file(path):
+    text, encoding = read_file_text(path)
+    return clean_text(text), encoding
+
+# Files at least this big are streamed into the editor in chunks
+STREAM_LOAD_THRESHOLD = 4 * 1024 * 1024
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+# Files at least this big are edited in large file mode
+LARGE_FILE_THRESHOLD = 64 * 1024 * 1024
+
+def get_file_size(path):
     try:
-        return text.decode("utf-8"), "utf-8"
-    except UnicodeDecodeError:
-        return text.decode("iso-8859-1"), "iso-8859-1"
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+def is_large_file(path):
+    return get_file_size(path) >= STREAM_LOAD_THRESHOLD
+
+# Reads, decodes and cleans a file a chunk at a time, on a worker thread.
+# A trailing CR is held back in case the next chunk starts with LF.
+class TextFileReader(object):
+    def __init__(self, path, encoding, chunk_size=STREAM_CHUNK_SIZE):
+        self.lock = threading.Lock()
+        self.f = open(path, "rb")
+        self.decoder = codecs.getincrementaldecoder(encoding)()
+        self.chunk_size = chunk_size
+        self.pos = 0
+        self.pending_cr = False
+
+    # Returns None at the end of the file
+    def read(self):
+        with self.lock:
+            if self.f is None:
+                return None
+            data = self.f.read(self.chunk_size)
+            self.pos += len(data)
+            text = non_printable_re.sub(u"", self.decoder.decode(data, final=not data))
+            if self.pending_cr:
+                text = u"\r" + text
+            self.pending_cr = bool(data) and text.endswith(u"\r")
+            if self.pending_cr:
+                text = text[:-1]
+            if not data and not text:
+                return None
+            return u"\n".join(line_end_re.split(text))
+
+    def close(self):
+        with self.lock:
+            if self.f is not None:
+                self.f.close()
+                self.f = None
 
 def encode_text(text, encoding):
     try:
@@ -24,6 +73,34 @@ def encode_text(text, encoding):
     except UnicodeEncodeError:
         return text.encode("utf-8"), "utf-8"
 
+def hash_text(text, encoding):
+    return hashlib.sha1(encoding + "\0" + text.encode("utf-8")).digest()
+
+def get_saved_state(path, text_hash):
+    st = os.stat(path)
+    return text_hash, st.st_size, st.st_mtime
+
+# Cleans, encodes and writes the text on a worker thread. The write is skipped
+# if the text hashes the same as at the last save, and the file hasn't changed
+# since. Returns the encoding used and the state to pass to the next save.
+def write_text_file(path, text, encoding, saved_state=None, fsync=FSYNC_NONE):
+    if saved_state and saved_state[0] == hash_text(text, encoding):
+        try:
+            if get_saved_state(path, saved_state[0]) == saved_state:
+                return encoding, saved_state
+        except OSError:
+            pass
+    # Cleaned before encoding, so UTF-16 and UTF-32 data isn't mangled
+    data = text
+    if u"\r" in data or non_printable_re.search(data):
+        data = clean_text(data)
+    data, encoding = encode_text(data, encoding)
+    dirpath = os.path.dirname(path)
+    if not os.path.isdir(dirpath):
+        mkpath(dirpath)
+    atomic_write_file(path, data, fsync=fsync)
+    return encoding, get_saved_state(path, hash_text(text, encoding))
+
 class EditorSelectionWriter(object):
     def __init__(self, editor):
         self.editor = editor
@@ -61,10 +138,14 @@ class Editor(StyledTextCtrl, wx.FileDropTarget):
         self.path = path
         self.file_encoding = "utf-8"
         self.modified_externally = False
+        self.saved_state = None
         self.static_title = None
+        self.pending_perspective = None
+        self.pending_load = None
+        self.load_progress = None
 
-        self.sig_title_changed = Signal(self)
-        self.sig_status_changed = Signal(self)
+        self.sig_title_changed = Signal(self, coalesce=True)
+        self.sig_status_changed = Signal(self, coalesce=True)
 
         self.SetTabIndents(True)
         self.SetBackSpaceUnIndents(True)
@@ -97,6 +178,8 @@ class Editor(StyledTextCtrl, wx.FileDropTarget):
 
     @property
     def status_text(self):
+        if self.load_progress is not None:
+            return "Loading... %d%%" % self.load_progress
         return "Line %d, Column %d" % (
             self.GetCurrentLine() + 1, self.GetColumn(self.GetCurrentPos()))
 
@@ -106,8 +189,19 @@ class Editor(StyledTextCtrl, wx.FileDropTarget):
 
     @property
     def status_text_syntax(self):
+        if self.large_file_mode:
+            return "Large file mode"
         return "Syntax: " + self.syntax.description
 
+    @property
+    def pending(self):
+        return self.pending_perspective is not None
+
+    @property
+    def can_hibernate(self):
+        return bool(self.path) and self.static_title is None \
+           and not self.pending and not self.modified
+
     @property
     def dialog_parent(self):
         return wx.GetTopLevelParent(self)
@@ -151,22 +245,27 @@ class Editor(StyledTextCtrl, wx.FileDropTarget):
 
     @coroutine
     def LoadFile(self, path):
+        self.pending_perspective = None
+        self.pending_load = None
         self.SetReadOnly(True)
         self.Disable()
 
         old_path = self.path
         self.path = path
+        self.saved_state = None
         self.sig_title_changed.signal(self)
 
         try:
-            text = (yield async_call(read_file, path, "r"))
-            text, self.file_encoding = decode_text(text)
-            text = clean_text(text)
-
-            self.modified_externally = False
-            self.SetReadOnly(False)
-            self.SetSyntaxFromFilename(path)
-            self.SetText(text)
+            size = get_file_size(path)
+            self.SetLargeFileMode(size >= LARGE_FILE_THRESHOLD)
+            if size >= STREAM_LOAD_THRESHOLD:
+                yield self.StreamFile(path)
+            else:
+                text, self.file_encoding = (yield async_call_priority(PRIORITY_INTERACTIVE, read_text_file, path))
+                self.modified_externally = False
+                self.SetReadOnly(False)
+                self.SetSyntaxFromFilename(path)
+                self.SetText(text)
             self.SetSavePoint()
 
             if old_path:
@@ -181,6 +280,51 @@ class Editor(StyledTextCtrl, wx.FileDropTarget):
             self.Enable()
             self.SetReadOnly(False)
 
+    # Appends the file a chunk at a time, while the next chunk is read on a
+    # worker. The editor is enabled (but read-only) after the first chunk, so
+    # the start of the file can be read while the rest is loading. If the
+    # file turns out not to be in the detected encoding past the prefix that
+    # was checked, it is loaded again as ISO-8859-1.
+    @coroutine
+    def StreamFile(self, path):
+        size = max(os.path.getsize(path), 1)
+        self.modified_externally = False
+        self.SetSyntaxFromFilename(path)
+        self.SetUndoCollection(False)
+        detected_encoding = (yield async_call(get_file_encoding, path))
+        try:
+            for encoding in unique([detected_encoding, FALLBACK_ENCODING]):
+                reader = TextFileReader(path, encoding)
+                try:
+                    with self.ModifyReadOnly():
+                        self.ClearAll()
+                    future = async_call(reader.read)
+                    while True:
+                        chunk = (yield future)
+                        if chunk is None:
+                            break
+                        future = async_call(reader.read)
+                        with self.ModifyReadOnly():
+                            self.AppendText(chunk)
+                        self.Enable()
+                        self.load_progress = min(reader.pos * 100 // size, 100)
+                        self.sig_status_changed.signal(self)
+                    self.file_encoding = encoding
+                    if encoding != detected_encoding:
+                        async_call(set_file_encoding, path, encoding)
+                    break
+                except UnicodeDecodeError:
+                    if encoding == FALLBACK_ENCODING:
+                        raise
+                finally:
+                    reader.close()
+        finally:
+            if self:
+                self.load_progress = None
+                self.SetUndoCollection(not self.large_file_mode)
+                self.EmptyUndoBuffer()
+                self.sig_status_changed.signal(self)
+
     @coroutine
     def TryLoadFile(self, path):
         try:
@@ -193,20 +337,23 @@ class Editor(StyledTextCtrl, wx.FileDropTarget):
 
     @coroutine
     def Reload(self):
+        if self.pending:
+            # Read again when the tab is shown
+            self.pending_perspective = dict(self.pending_perspective)
+            self.pending_load = None
+            return
         line_num = self.GetFirstVisibleLine()
         yield self.LoadFile(self.path)
         self.ScrollToLine(line_num)
 
     @coroutine
-    def WriteFile(self, path):
-        def do_write_file(path, text):
-            mkpath(os.path.dirname(path))
-            atomic_write_file(path, text)
-
-        text, self.file_encoding = encode_text(self.GetText(), self.file_encoding)
-        text = clean_text(text)
+    def WriteFile(self, path, fsync=None):
+        if fsync is None:
+            fsync = self.env.fsync_policy
+        saved_state = self.saved_state if path == self.path and not self.modified_externally else None
         with self.env.updating_path(path):
-            yield async_call(do_write_file, path, text)
+            self.file_encoding, self.saved_state = (yield async_call(
+                write_text_file, path, self.GetText(), self.file_encoding, saved_state, fsync))
         self.modified_externally = False
         self.SetSavePoint()
 
@@ -261,10 +408,16 @@ class Editor(StyledTextCtrl, wx.FileDropTarget):
             return self.SaveAsInSameTab()
 
     @coroutine
-    def Save(self):
+    def Save(self, fsync=None):
+        if self.pending:
+            # The text isn't in memory, so it has to be loaded to be saved
+            yield self.Materialise()
+            if self.pending:
+                dialogs.error(self.dialog_parent, "Error saving file '%s'\n\nThe file couldn't be loaded." % self.path)
+                raise Exception("File not loaded: %s" % self.path)
         if self.path:
             try:
-                yield self.WriteFile(self.path)
+                yield self.WriteFile(self.path, fsync)
                 self.env.add_monitor_path(self.path)
                 yield True
             except Exception as e:
@@ -323,7 +476,7 @@ class Editor(StyledTextCtrl, wx.FileDropTarget):
 
     @coroutine
     def OnModifiedExternally(self):
-        if dialogs.ask_reload(self.dialog_parent, os.path.basename(self.path)):
+        if self.pending or dialogs.ask_reload(self.dialog_parent, os.path.basename(self.path)):
             yield self.Reload()
         else:
             self.SetModified()
@@ -331,12 +484,13 @@ class Editor(StyledTextCtrl, wx.FileDropTarget):
     @coroutine
     def OnUnloadedExternally(self):
         if os.path.exists(self.path):
-            if dialogs.ask_reload(self.dialog_parent, os.path.basename(self.path)):
+            if self.pending or dialogs.ask_reload(self.dialog_parent, os.path.basename(self.path)):
                 yield self.Reload()
             else:
                 self.SetModified()
         else:
-            if dialogs.ask_unload(self.dialog_parent, os.path.basename(self.path)):
+            # A pending editor has nothing in memory to keep
+            if self.pending or dialogs.ask_unload(self.dialog_parent, os.path.basename(self.path)):
                 self.env.close_view(self)
             else:
                 self.SetModified()
@@ -383,6 +537,8 @@ class Editor(StyledTextCtrl, wx.FileDropTarget):
             return EditorAllTextWriter(self)
 
     def SavePerspective(self):
+        if self.pending:
+            return dict(self.pending_perspective)
         p = {
             "line"      : self.GetFirstVisibleLine(),
             "selection" : self.GetSelection(),
@@ -413,3 +569,75 @@ class Editor(StyledTextCtrl, wx.FileDropTarget):
 
         self.ScrollToLine(p.get("line", 0))
         self.SetSelection(*p.get("selection", (0, 0)))
+
+    # Reads the file in the background but leaves the control empty until
+    # Materialise is called, which is done when the tab is first shown.
+    def DeferLoadPerspective(self, p):
+        self.path = p["path"]
+        self.pending_perspective = p
+        if is_large_file(self.path):
+            # Streamed by Materialise instead
+            self.pending_load = None
+        else:
+            self.pending_load = async_call(read_text_file, self.path)
+        self.SetReadOnly(True)
+        self.env.add_monitor_path(self.path)
+        self.sig_title_changed.signal(self)
+        return self.pending_load
+
+    @coroutine
+    def Materialise(self):
+        if self.pending and self.pending_load is None and is_large_file(self.path):
+            p = self.pending_perspective
+            if (yield self.TryLoadFile(self.path)):
+                self.ScrollToLine(p.get("line", 0))
+                self.SetSelection(*p.get("selection", (0, 0)))
+            return
+
+        # The load may be restarted by a reload while waiting for it
+        while self.pending:
+            p = self.pending_perspective
+            # A load started by DeferLoadPerspective is reported by whoever
+            # deferred it, otherwise the error is reported here
+            report_error = self.pending_load is None
+            if report_error:
+                self.pending_load = async_call_priority(PRIORITY_INTERACTIVE, read_text_file, self.path)
+            try:
+                text, encoding = (yield self.pending_load)
+            except Exception as e:
+                if self.pending_perspective is not p:
+                    continue
+                if report_error:
+                    self.pending_load = None
+                    dialogs.error(self.dialog_parent, "Error opening file:\n\n%s" % e)
+                return
+            if self.pending_perspective is p:
+                break
+        else:
+            return
+        self.pending_perspective = None
+        self.pending_load = None
+        self.file_encoding = encoding
+        self.modified_externally = False
+        self.SetReadOnly(False)
+        self.SetLargeFileMode(False)
+        self.SetSyntaxFromFilename(self.path)
+        self.SetText(text)
+        self.SetSavePoint()
+        self.EmptyUndoBuffer()
+        self.ScrollToLine(p.get("line", 0))
+        self.SetSelection(*p.get("selection", (0, 0)))
+        self.sig_title_changed.signal(self)
+        self.sig_status_changed.signal(self)
+
+    # Releases the text, styling and undo history of an unmodified editor,
+    # keeping only its perspective. Deleting the whole document frees
+    # Scintilla's buffers, rather than just emptying them.
+    def Hibernate(self):
+        self.pending_perspective = self.SavePerspective()
+        self.pending_load = None
+        self.SetReadOnly(False)
+        self.ClearAll()
+        self.EmptyUndoBuffer()
+        self.SetSavePoint()
+        self.SetReadOnly(True)
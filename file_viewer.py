@@ -0,0 +1,204 @@
+import os, mmap
+import wx, wx.stc
+from async import coroutine
+from signal_wx import Signal
+from styled_text_ctrl import StyledTextCtrl
+from util import clean_text
+
+# Read-only view of files too big to load into an editor. The file is memory
+# mapped, and only one page of it is shown at a time, cut at line breaks.
+# Alt+PageDown and Alt+PageUp move to the next and previous pages.
+
+PAGE_SIZE = 4 * 1024 * 1024
+
+# How far to look for a line break before cutting a page mid-line
+MAX_LINE_SEARCH = 64 * 1024
+
+class MappedFile(object):
+    def __init__(self, path):
+        self.f = open(path, "rb")
+        try:
+            self.size = os.fstat(self.f.fileno()).st_size
+            self.map = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ) if self.size else None
+        except:
+            self.f.close()
+            raise
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.f.close()
+
+    def line_start(self, offset):
+        if offset <= 0:
+            return 0
+        if offset >= self.size:
+            return self.size
+        i = self.map.rfind("\n", max(0, offset - MAX_LINE_SEARCH), offset)
+        if i != -1:
+            return i + 1
+        return 0 if offset <= MAX_LINE_SEARCH else offset
+
+    def line_end(self, offset):
+        if offset >= self.size:
+            return self.size
+        i = self.map.find("\n", offset, offset + MAX_LINE_SEARCH)
+        return i + 1 if i != -1 else min(offset + MAX_LINE_SEARCH, self.size)
+
+    def page_at(self, offset):
+        start = self.line_start(offset)
+        return start, self.line_end(start + PAGE_SIZE)
+
+    def page_before(self, end):
+        return self.line_start(end - PAGE_SIZE), end
+
+    def read(self, start, end):
+        return self.map[start:end] if self.map is not None else ""
+
+class FileViewer(StyledTextCtrl):
+    def __init__(self, parent, env, path=""):
+        StyledTextCtrl.__init__(self, parent, env)
+        self.path = path
+        self.static_title = None
+        self.temporary = False
+        self.file = None
+        self.page_start = 0
+        self.page_end = 0
+
+        self.sig_title_changed = Signal(self, coalesce=True)
+        self.sig_status_changed = Signal(self, coalesce=True)
+
+        self.SetLargeFileMode(True)
+        self.SetReadOnly(True)
+
+        self.Bind(wx.EVT_KEY_DOWN, self.OnKeyDown)
+        self.Bind(wx.stc.EVT_STC_UPDATEUI, self.OnStcUpdateUI)
+
+    @property
+    def name(self):
+        return os.path.basename(self.path)
+
+    @property
+    def modified(self):
+        return False
+
+    @property
+    def title(self):
+        if self.static_title is not None:
+            return self.static_title
+        return (os.path.basename(self.path) or "Untitled") + " (read-only)"
+
+    @property
+    def status_text(self):
+        if self.file is None:
+            return ""
+        return "Line %d, Column %d, bytes %d-%d of %d" % (
+            self.GetCurrentLine() + 1, self.GetColumn(self.GetCurrentPos()),
+            self.page_start, self.page_end, self.file.size)
+
+    @property
+    def status_text_path(self):
+        return self.path
+
+    @property
+    def status_text_syntax(self):
+        return "Paged viewer (Alt+PgUp/PgDn)"
+
+    def Open(self, path, offset=0):
+        new_file = MappedFile(path)
+        self.CloseFile()
+        self.file = new_file
+        if path != self.path:
+            if self.path:
+                self.env.remove_monitor_path(self.path)
+            self.path = path
+            self.env.add_monitor_path(path)
+        self.ShowPage(*self.file.page_at(offset))
+        self.sig_title_changed.signal(self)
+
+    def CloseFile(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    # Temporary files are removed when the viewer is closed
+    def OpenTemporary(self, title, path):
+        self.static_title = title
+        self.temporary = True
+        self.Open(path)
+
+    def RemoveTemporaryFile(self):
+        self.CloseFile()
+        if self.temporary:
+            self.temporary = False
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def ShowPage(self, start, end):
+        text = clean_text(self.file.read(start, end).decode("utf-8", "replace"))
+        self.page_start = start
+        self.page_end = end
+        with self.ModifyReadOnly():
+            self.SetText(text)
+        self.sig_status_changed.signal(self)
+
+    def NextPage(self):
+        if self.file is not None and self.page_end < self.file.size:
+            self.ShowPage(*self.file.page_at(self.page_end))
+
+    def PreviousPage(self):
+        if self.file is not None and self.page_start > 0:
+            self.ShowPage(*self.file.page_before(self.page_start))
+            self.ScrollToLine(self.GetLineCount())
+
+    def OnKeyDown(self, evt):
+        if evt.GetModifiers() == wx.MOD_ALT:
+            key = evt.GetKeyCode()
+            if key in (wx.WXK_PAGEDOWN, wx.WXK_NUMPAD_PAGEDOWN):
+                self.NextPage()
+                return
+            if key in (wx.WXK_PAGEUP, wx.WXK_NUMPAD_PAGEUP):
+                self.PreviousPage()
+                return
+        evt.Skip()
+
+    def OnStcUpdateUI(self, evt):
+        self.sig_status_changed.signal(self)
+        evt.Skip()
+
+    @coroutine
+    def TryClose(self):
+        if self.path:
+            self.env.remove_monitor_path(self.path)
+        self.RemoveTemporaryFile()
+        yield True
+
+    def SavePerspective(self):
+        return {
+            "view_type" : "viewer",
+            "path"      : self.path,
+            "offset"    : self.page_start,
+            "line"      : self.GetFirstVisibleLine(),
+        }
+
+    @coroutine
+    def LoadPerspective(self, p):
+        self.Open(p["path"], p.get("offset", 0))
+        self.ScrollToLine(p.get("line", 0))
+        yield
+
+    @coroutine
+    def OnModifiedExternally(self):
+        self.Open(self.path, self.page_start)
+        yield
+
+    @coroutine
+    def OnUnloadedExternally(self):
+        if os.path.exists(self.path):
+            self.Open(self.path, self.page_start)
+        else:
+            self.env.close_view(self)
+        yield
@@ -3,7 +3,16 @@ from async import async_call, coroutine
 from dialogs import dialogs
 from fileutil_common import *
 
-def atomic_write_file(path, data, mode="wb"):
+# How much atomic_write_file does to make a write survive a crash:
+#   FSYNC_NONE      - leave it to the OS to write back
+#   FSYNC_FILE      - fsync the file before it is renamed into place
+#   FSYNC_DIRECTORY - also fsync the directory after the rename
+FSYNC_NONE = "none"
+FSYNC_FILE = "file"
+FSYNC_DIRECTORY = "directory"
+FSYNC_POLICIES = (FSYNC_NONE, FSYNC_FILE, FSYNC_DIRECTORY)
+
+def atomic_write_file(path, data, mode="wb", fsync=FSYNC_NONE):
     temp = os.path.join(os.path.dirname(path), ".saving." + os.path.basename(path))
     try:
         with open(temp, mode) as out:
@@ -12,6 +21,9 @@ def atomic_write_file(path, data, mode="wb"):
             except OSError:
                 pass
             out.write(data)
+            if fsync != FSYNC_NONE:
+                out.flush()
+                os.fsync(out.fileno())
     except Exception as e:
         try:
             os.remove(temp)
@@ -27,6 +39,14 @@ def atomic_write_file(path, data, mode="wb"):
             except Exception:
                 pass
             raise e
+        if fsync == FSYNC_DIRECTORY:
+            sync_directory(os.path.dirname(path) or ".")
+
+# Makes many writes to the same directories durable with one fsync per
+# directory, after writing the files with FSYNC_FILE.
+def sync_directories(paths):
+    for dirpath in set(os.path.dirname(path) or "." for path in paths):
+        sync_directory(dirpath)
 
 def read_file(path, mode="rb"):
     with open(path, mode) as f:
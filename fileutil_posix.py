@@ -20,7 +20,16 @@ def get_user_config_dir(name=""):
         path = os.path.join(path, name)
     return os.path.realpath(path)
 
+# Makes renames and new entries in a directory durable
+def sync_directory(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
 __all__ = (
+    "sync_directory",
     "shell_open",
     "get_user_config_dir",
 )
@@ -12,6 +12,11 @@ def rename(old, new):
     except pywintypes.error as e:
         raise WindowsError(*e.args)
 
+# Directories can't be opened for fsync on windows, and renames are already
+# journaled by NTFS
+def sync_directory(path):
+    pass
+
 def shell_open(path, workdir=None):
     return win32api.ShellExecute(None, "open", path, None, workdir, win32con.SW_SHOW) > 32
 
@@ -55,6 +60,7 @@ def shell_move_or_copy(srcpath, dstpath, parent=None):
 
 __all__ = (
     "rename",
+    "sync_directory",
     "shell_open",
     "get_user_config_dir",
     "is_hidden_file",
@@ -2,162 +2,9 @@ import wx
 import re
 from dialogs import dialogs
 from dialog_util import bind_escape_key
+from find_replace_details import FindReplaceDetails
 from util import get_combo_history
 
-def _get_selected_or_target_range(editor, target=False):
-    if target:
-        return editor.GetTargetStart(), editor.GetTargetEnd()
-    else:
-        return editor.GetSelection()
-
-def _get_selected_or_target_text(editor, target=False):
-    return editor.GetTextRange(*_get_selected_or_target_range(editor, target))
-
-class FindReplaceDetails(object):
-    def __init__(self, find="", replace="", case=False, reverse=False, regexp=False,
-                 find_history=(), replace_history=()):
-        self.case = case
-        self.reverse = reverse
-        self.regexp = regexp
-        self.__find = None
-        self.find = find
-        self.replace = replace
-        self.find_history = find_history
-        self.replace_history = replace_history
-
-    @property
-    def find(self):
-        return self.__find
-
-    @find.setter
-    def find(self, ptn):
-        self.rx_find = re.compile(
-            ptn.encode("utf-8") if self.regexp else re.escape(ptn.encode("utf-8")),
-            0 if self.case else re.IGNORECASE)
-        self.__find = ptn
-
-    def _IterFindLines(self, editor, wrap=True):
-        init_pos = editor.GetSelection()[1]
-        init_line = editor.LineFromPosition(init_pos)
-        last_line = editor.LineFromPosition(editor.GetTextLength())
-
-        line_start = editor.PositionFromLine(init_line)
-        line_end = editor.GetLineEndPosition(init_line)
-
-        yield init_pos, editor.GetTextRangeRaw(init_pos, line_end)
-
-        for line in xrange(init_line + 1, last_line + 1):
-            yield editor.PositionFromLine(line), editor.GetLineRaw(line)
-
-        if wrap:
-            for line in xrange(0, init_line):
-                yield editor.PositionFromLine(line), editor.GetLineRaw(line)
-
-            yield line_start, editor.GetTextRangeRaw(line_start, init_pos)
-
-    def _IterFindLinesReversed(self, editor, wrap=True):
-        init_pos = editor.GetSelection()[0]
-        init_line = editor.LineFromPosition(init_pos)
-        last_line = editor.LineFromPosition(editor.GetTextLength())
-
-        line_start = editor.PositionFromLine(init_line)
-        line_end = editor.GetLineEndPosition(init_line)
-
-        yield line_start, editor.GetTextRangeRaw(line_start, init_pos)
-
-        for line in xrange(init_line - 1, -1, -1):
-            yield editor.PositionFromLine(line), editor.GetLineRaw(line)
-
-        if wrap:
-            for line in xrange(last_line, init_line, -1):
-                yield editor.PositionFromLine(line), editor.GetLineRaw(line)
-
-            yield init_pos, editor.GetTextRangeRaw(init_pos, line_end)
-
-    def _Replace(self, editor, target=False):
-        text = _get_selected_or_target_text(editor, target)
-        if text:
-            if self.regexp:
-                repl = self.rx_find.sub(self.replace, text, 1)
-            else:
-                repl = self.replace
-            if target:
-                editor.ReplaceTarget(repl)
-            else:
-                editor.ReplaceSelection(repl)
-            return repl
-        return ""
-
-    def Find(self, editor, wrap=True, reverse=False):
-        reverse = reverse ^ self.reverse
-        iterator = self._IterFindLines if not reverse else self._IterFindLinesReversed
-        for pos, line in iterator(editor, wrap):
-            m = self.rx_find.search(line)
-            if m and reverse:
-                while True:
-                    start = m.end()
-                    m2 = self.rx_find.search(line, start)
-                    if not m2:
-                        break
-                    m = m2
-            if m and m.start() != m.end():
-                editor.CentreLine(editor.LineFromPosition(pos))
-                editor.GotoPos(pos + m.end())
-                editor.GotoPos(pos + m.start())
-                editor.SetSelection(pos + m.start(), pos + m.end())
-                return True
-        return False
-
-    def Replace(self, editor):
-        if self.rx_find.match(editor.GetSelectedText()):
-            self._Replace(editor)
-        return self.Find(editor)
-
-    def ReplaceAll(self, editor):
-        count = 0
-        editor.BeginUndoAction()
-        try:
-            editor.SetSelection(0, 0)
-            for pos, line in self._IterFindLines(editor, wrap=False):
-                line_num = editor.LineFromPosition(pos)
-                cur_pos = 0
-                while True:
-                    m = self.rx_find.search(line, pos=cur_pos)
-                    if not m or m.start() == m.end():
-                        break
-                    editor.SetTargetStart(pos + m.start())
-                    editor.SetTargetEnd(pos + m.end())
-                    repl = self._Replace(editor, target=True)
-                    line = editor.GetLineRaw(line_num)
-                    cur_pos = m.start() + len(repl)
-                    count += 1
-            return count
-        finally:
-            editor.EndUndoAction()
-
-    def LoadPerspective(self, p):
-        try:
-            self.case = bool(p.get("case_sensitive", False))
-            self.reverse = bool(p.get("reverse", False))
-            self.regexp = bool(p.get("is_regex", False))
-            self.find = unicode(p.get("find", ""))
-            self.replace = unicode(p.get("replace", ""))
-            self.find_history = p.get("find_history", [])[:10]
-            self.replace_history = p.get("replace_history", [])[:10]
-        except Exception:
-            pass
-
-    def SavePerspective(self):
-        return {
-            "case_sensitive": self.case,
-            "reverse": self.reverse,
-            "is_regex": self.regexp,
-            "find": self.find,
-            "replace": self.replace,
-            "find_history": self.find_history[:],
-            "replace_history": self.replace_history[:],
-        }
-
 class FindReplaceDialog(wx.Dialog):
     def __init__(self, editor, filename="", details=None):
         title = "Find and Replace"
@@ -0,0 +1,154 @@
+import os, re, threading
+
+# Ignore rules from .gitignore, .ignore and .git/info/exclude files.
+#
+# The rules of each directory are compiled once and cached, along with the
+# chain of rules which apply to each directory, from the root of the
+# repository (or the filesystem) down to the directory itself. Deeper rules
+# override shallower ones, and later rules in a file override earlier ones.
+#
+# Directories are only checked when they are walked, so names are matched
+# one path component at a time and files under an ignored directory are
+# never looked at.
+
+ignore_filenames = (".gitignore", ".ignore")
+
+def translate_segment(seg):
+    i, n = 0, len(seg)
+    res = []
+    while i < n:
+        c = seg[i]
+        i += 1
+        if c == "*":
+            res.append("[^/]*")
+        elif c == "?":
+            res.append("[^/]")
+        elif c == "\\" and i < n:
+            res.append(re.escape(seg[i]))
+            i += 1
+        elif c == "[":
+            j = i
+            if j < n and seg[j] in "!^":
+                j += 1
+            if j < n and seg[j] == "]":
+                j += 1
+            while j < n and seg[j] != "]":
+                j += 1
+            if j >= n:
+                res.append("\\[")
+            else:
+                chars = seg[i:j].replace("\\", "\\\\")
+                if chars[:1] in ("!", "^"):
+                    chars = "^" + chars[1:]
+                res.append("[%s]" % chars)
+                i = j + 1
+        else:
+            res.append(re.escape(c))
+    return "".join(res)
+
+def translate_pattern(pattern):
+    segs = pattern.split("/")
+    res = []
+    for i, seg in enumerate(segs):
+        last = i == len(segs) - 1
+        if seg == "**":
+            res.append(".*" if last else "(?:.*/)?")
+        else:
+            res.append(translate_segment(seg))
+            if not last:
+                res.append("/")
+    return "".join(res) + "\\Z"
+
+def compile_rule(line):
+    line = line.rstrip("\r\n")
+    if not line or line.startswith("#"):
+        return None
+    while line.endswith(" ") and not line.endswith("\\ "):
+        line = line[:-1]
+    if not line:
+        return None
+    negate = line.startswith("!")
+    if negate:
+        line = line[1:]
+    elif line.startswith("\\!") or line.startswith("\\#"):
+        line = line[1:]
+    dir_only = line.endswith("/")
+    line = line.rstrip("/")
+    if not line:
+        return None
+    anchored = "/" in line
+    line = line.lstrip("/")
+    try:
+        regex = re.compile(translate_pattern(line), re.DOTALL)
+    except re.error:
+        return None
+    return (regex.match, negate, dir_only, anchored)
+
+def read_rules(path):
+    try:
+        with open(path, "rU") as f:
+            lines = f.readlines()
+    except EnvironmentError:
+        return []
+    rules = []
+    for line in lines:
+        rule = compile_rule(line)
+        if rule:
+            rules.append(rule)
+    return rules
+
+def is_repo_root(dirpath):
+    return os.path.exists(os.path.join(dirpath, ".git"))
+
+class IgnoreRules(object):
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.dir_rules = {}
+        self.chains = {}
+
+    def _get_dir_rules(self, dirpath, repo_root):
+        rules = self.dir_rules.get(dirpath)
+        if rules is None:
+            rules = []
+            if repo_root:
+                rules.extend(read_rules(os.path.join(dirpath, ".git", "info", "exclude")))
+            for filename in ignore_filenames:
+                rules.extend(read_rules(os.path.join(dirpath, filename)))
+            self.dir_rules[dirpath] = rules
+        return rules
+
+    # Returns a list of (relative path prefix, rules), deepest first.
+    def _get_chain(self, dirpath):
+        chain = self.chains.get(dirpath)
+        if chain is None:
+            repo_root = is_repo_root(dirpath)
+            parent, name = os.path.split(dirpath)
+            if repo_root or not name or parent == dirpath:
+                chain = []
+            else:
+                chain = [(prefix + name + "/", rules) for prefix, rules in self._get_chain(parent)]
+            rules = self._get_dir_rules(dirpath, repo_root)
+            if rules:
+                chain.insert(0, ("", rules))
+            self.chains[dirpath] = chain
+        return chain
+
+    def is_ignored(self, dirpath, name, isdir=None):
+        with self.lock:
+            chain = self._get_chain(dirpath)
+        for prefix, rules in chain:
+            relpath = prefix + name
+            for match, negate, dir_only, anchored in reversed(rules):
+                if match(relpath if anchored else name):
+                    if dir_only:
+                        if isdir is None:
+                            isdir = os.path.isdir(os.path.join(dirpath, name))
+                        if not isdir:
+                            continue
+                    return not negate
+        return False
+
+    def invalidate(self, dirpath):
+        with self.lock:
+            self.dir_rules.pop(dirpath, None)
+            self.chains.clear()
@@ -0,0 +1,42 @@
+import collections
+
+# Tracks the length of every line of a document and the longest length, as
+# lines are replaced. Besides the per-line list, the number of lines of each
+# length is kept, so the longest length only needs recomputing (from the
+# distinct lengths, not the lines) when the last line of that length goes.
+
+class LineLengths(object):
+    def __init__(self, lengths=(0,)):
+        self.reset(lengths)
+
+    def reset(self, lengths):
+        self.lengths = list(lengths)
+        self.counts = collections.Counter(self.lengths)
+        self._max_length = None
+
+    def replace(self, first, last, new_lengths):
+        counts = self.counts
+        for length in self.lengths[first:last]:
+            count = counts[length] - 1
+            if count:
+                counts[length] = count
+            else:
+                del counts[length]
+                if length == self._max_length:
+                    self._max_length = None
+        max_length = self._max_length
+        for length in new_lengths:
+            counts[length] += 1
+            if max_length is not None and length > max_length:
+                max_length = length
+        self._max_length = max_length
+        self.lengths[first:last] = new_lengths
+
+    @property
+    def max_length(self):
+        if self._max_length is None:
+            self._max_length = max(self.counts) if self.counts else 0
+        return self._max_length
+
+    def __len__(self):
+        return len(self.lengths)
@@ -0,0 +1,126 @@
+import os, os.path, stat
+import fileutil
+from util import natural_order_key
+
+# Directory listing built on scandir where available, so the file type comes
+# from the directory read itself (d_type) rather than a stat per entry. Other
+# fields are only fetched from the filesystem when they are first used, and
+# only the mode, size and mtime are kept from the stat result.
+
+try:
+    scandir = os.scandir
+except AttributeError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+def mode_node_type(mode):
+    if stat.S_ISREG(mode):
+        return 'f'
+    if stat.S_ISDIR(mode):
+        return 'd'
+    return ''
+
+class FileInfo(object):
+    __slots__ = ("filename", "dirpath", "_node_type", "_mode", "_size", "_mtime",
+                 "_listable", "_hidden", "_sort_key")
+
+    def __init__(self, filename, dirpath, node_type=None, stat_result=None):
+        self.filename = filename
+        self.dirpath = dirpath
+        self._node_type = node_type
+        self._mode = None
+        self._listable = None
+        self._hidden = None
+        self._sort_key = None
+        if stat_result is not None:
+            self._set_stat(stat_result)
+
+    def _set_stat(self, st):
+        self._mode = st.st_mode
+        self._size = st.st_size
+        self._mtime = st.st_mtime
+
+    def _stat(self):
+        if self._mode is None:
+            self._set_stat(os.stat(self.path))
+
+    def __repr__(self):
+        return "FileInfo(%r, %r)" % (self.filename, self.dirpath)
+
+    @property
+    def path(self):
+        return os.path.join(self.dirpath, self.filename)
+
+    @property
+    def mode(self):
+        self._stat()
+        return self._mode
+
+    @property
+    def size(self):
+        self._stat()
+        return self._size
+
+    @property
+    def mtime(self):
+        self._stat()
+        return self._mtime
+
+    @property
+    def sort_key(self):
+        if self._sort_key is None:
+            self._sort_key = natural_order_key(self.filename)
+        return self._sort_key
+
+    @property
+    def node_type(self):
+        if self._node_type is None:
+            try:
+                self._node_type = mode_node_type(self.mode)
+            except OSError:
+                self._node_type = ''
+        return self._node_type
+
+    @property
+    def is_file(self):
+        return self.node_type == 'f'
+
+    @property
+    def is_dir(self):
+        return self.node_type == 'd'
+
+    @property
+    def listable(self):
+        if self._listable is None:
+            try:
+                self._listable = self.is_dir and os.access(self.path, os.X_OK)
+            except OSError:
+                self._listable = False
+        return self._listable
+
+    @property
+    def hidden(self):
+        if self._hidden is None:
+            self._hidden = fileutil.is_hidden_file(self.path)
+        return self._hidden
+
+def get_file_info(dirpath, filename):
+    stat_result = os.stat(os.path.join(dirpath, filename))
+    return FileInfo(filename, dirpath, mode_node_type(stat_result.st_mode), stat_result)
+
+def entry_node_type(entry):
+    try:
+        if entry.is_file():
+            return 'f'
+        if entry.is_dir():
+            return 'd'
+    except OSError:
+        pass
+    return ''
+
+def list_dir(dirpath):
+    if scandir is None:
+        return [FileInfo(filename, dirpath) for filename in os.listdir(dirpath)]
+    return [FileInfo(entry.name, dirpath, entry_node_type(entry)) for entry in scandir(dirpath)]
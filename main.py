@@ -1,6 +1,8 @@
 #!/usr/bin/env python2
 
-import sys
+import sys, time
+
+start_time = time.time()
 
 if sys.platform == "win32":
     import ctypes
@@ -8,7 +10,7 @@ if sys.platform == "win32":
     ctypes.windll.kernel32.SetErrorMode(SEM_FAILCRITICALERRORS)
     ctypes.windll.user32.SetProcessDPIAware()
 
-import os, getopt, traceback, warnings
+import os, getopt, traceback, warnings, multiprocessing
 
 if not hasattr(sys, "frozen"):
     module_dir = os.path.dirname(os.path.realpath(__file__))
@@ -24,31 +26,54 @@ class DevoAppHandler(object):
     def __init__(self, app):
         self.app = app
 
+    # For clients from before open_files was added
     @coroutine
     def process_args(self, args, cwd):
         try:
-            mainframe = self.app.mainframe
-            if mainframe.IsIconized():
-                mainframe.Iconize(False)
-            mainframe.Raise()
+            self.raise_window()
             args = DevoArgs(args, cwd)
             if args.project:
-                yield mainframe.OpenProject(args.project)
+                yield self.open_project(args.project)
             for filename in args.filenames:
-                yield mainframe.OpenEditor(filename)
+                yield self.app.mainframe.OpenEditor(filename)
         except Exception:
             pass
         yield True
 
+    def raise_window(self):
+        mainframe = self.app.mainframe
+        if mainframe.IsIconized():
+            mainframe.Iconize(False)
+        mainframe.Raise()
+        return True
+
+    @coroutine
+    def open_project(self, path):
+        yield self.app.mainframe.OpenProject(path)
+        yield True
+
+    @coroutine
+    def open_files(self, filenames, cwd=""):
+        mainframe = self.app.mainframe
+        futures = [mainframe.OpenEditor(os.path.join(cwd, filename)) for filename in filenames]
+        for future in futures:
+            try:
+                yield future
+            except Exception:
+                pass
+        yield True
+
 class DevoArgs(object):
     def __init__(self, args, cwd):
         self.raw_args = args
 
-        opts, args = getopt.gnu_getopt(args, "", ["project=", "new-instance", "no-fork"])
+        opts, args = getopt.gnu_getopt(args, "", ["project=", "new-instance", "no-fork", "trace=", "profile-startup"])
 
         self.project = None
         self.new_instance = False
         self.fork = True
+        self.trace = None
+        self.profile_startup = False
 
         for opt, arg in opts:
             if opt == "--project":
@@ -57,6 +82,10 @@ class DevoArgs(object):
                 self.new_instance = True
             elif opt == "--no-fork":
                 self.fork = False
+            elif opt == "--trace":
+                self.trace = os.path.join(cwd, arg)
+            elif opt == "--profile-startup":
+                self.profile_startup = True
 
         self.filenames = [os.path.join(cwd, filename) for filename in args]
 
@@ -67,6 +96,8 @@ class DevoApp(wx.App):
         self.first_drop = True
         self.mainframe = None
         self.listener = None
+        self.tracer = None
+        self.trace_filename = None
         wx.Log_SetActiveTarget(wx.LogStderr())
 
     def OnInit(self):
@@ -74,6 +105,9 @@ class DevoApp(wx.App):
 
     def Startup(self, args):
         from dialogs import dialogs
+        from startup_profile import start_startup_profile, startup_phase
+        if args.profile_startup:
+            start_startup_profile(start_time).add("initial imports", start_time, time.time())
         try:
             import async_wx
             from app_instance import AppListener, get_app_instance
@@ -82,6 +116,12 @@ class DevoApp(wx.App):
 
             async_wx.set_wx_scheduler()
 
+            if args.trace:
+                import async, async_trace
+                self.tracer = async_trace.AsyncTracer()
+                self.trace_filename = args.trace
+                async.set_tracer(self.tracer)
+
             config_dir = get_user_config_dir("devo")
             try:
                 mkpath(config_dir)
@@ -94,11 +134,15 @@ class DevoApp(wx.App):
                 instance = get_app_instance("devo")
                 if instance:
                     try:
-                        if instance.call("process_args", args.raw_args, os.getcwd()):
+                        if self.SendArgsToInstance(instance, args):
                             return False
                     except Exception:
                         pass
 
+            # Search worker processes are forked before any threads are started
+            self.StartSearchPool(config_dir)
+
+            if not args.new_instance:
                 self.listener = AppListener("devo", DevoAppHandler(self))
 
             if hasattr(sys, "frozen"):
@@ -107,9 +151,11 @@ class DevoApp(wx.App):
                 sys.stdout, self.stdout = self.log_file, sys.stdout
                 sys.stderr, self.stderr = self.log_file, sys.stderr
 
-            from mainframe import MainFrame
-            self.mainframe = MainFrame.__new__(MainFrame, args)
-            self.mainframe.__init__(args)
+            with startup_phase("import mainframe"):
+                from mainframe import MainFrame
+            with startup_phase("create main window"):
+                self.mainframe = MainFrame.__new__(MainFrame, args)
+                self.mainframe.__init__(args)
             self.SetTopWindow(self.mainframe)
 
             self.Bind(wx.EVT_END_SESSION, self.OnEndSession)
@@ -126,6 +172,30 @@ class DevoApp(wx.App):
             dialogs.error(None, message, "Initialization Error")
             return False
 
+    # The calls are sent as one batch, and the files are opened together
+    def SendArgsToInstance(self, instance, args):
+        calls = [("raise_window", (), {})]
+        if args.project:
+            calls.append(("open_project", (os.path.abspath(args.project),), {}))
+        if args.filenames:
+            calls.append(("open_files", (args.filenames,), {}))
+        instance.call_batch(calls)
+        if instance.legacy:
+            # Instances from before the batched protocol only have process_args
+            return instance.call("process_args", args.raw_args, os.getcwd())
+        return True
+
+    def StartSearchPool(self, config_dir):
+        from settings import read_settings
+        try:
+            settings = read_settings(os.path.join(config_dir, "devo.conf"))
+        except Exception:
+            return
+        workers = settings.get("search_workers", 1)
+        if workers != 1:
+            from search import start_search_pool
+            start_search_pool(workers)
+
     def MacOpenFile(self, filename):
         if not self.first_drop or hasattr(sys, "frozen"):
             self.mainframe.OpenEditor(filename)
@@ -142,6 +212,11 @@ class DevoApp(wx.App):
     def Shutdown(self):
         if self.listener:
             self.listener.shutdown()
+        if self.mainframe:
+            from search import shutdown_search_pool
+            shutdown_search_pool()
+        if self.tracer:
+            self.tracer.export_chrome_trace(self.trace_filename)
         if hasattr(sys, "frozen"):
             self.log_file.flush()
 
@@ -169,4 +244,5 @@ def main():
         sys.exit(1)
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     main()
@@ -1,28 +1,30 @@
-import sys, os, string, traceback, errno, shutil, subprocess, webbrowser
+import sys, os, time, string, traceback, errno, shutil, subprocess, webbrowser
+from contextlib import contextmanager
 import wx
 
 import aui
 import app_info, async, fileutil, ID
-from about_dialog import AboutDialog
-from async import async_call, coroutine, queued_coroutine, managed, CoroutineManager, CoroutineQueue
-from commands_dialog import CommandsDialog, save_options
+from async import async_call, async_call_priority, coroutine, queued_coroutine, managed, CoroutineManager, CoroutineQueue
+from async import PRIORITY_INTERACTIVE, PRIORITY_BULK
 from dialogs import dialogs
 from dirtree import DirNode
 from dirtree_filter import DirTreeFilter
-from edit_project_dialog import EditProjectDialog
-from editor import Editor
+from fileutil import FSYNC_NONE, FSYNC_FILE, FSYNC_DIRECTORY, FSYNC_POLICIES, sync_directories
+from editor import Editor, get_file_size, is_large_file
 from editor_dirtree import EditorDirTreeCtrl
 from file_monitor import FileMonitor
-from find_replace_dialog import FindReplaceDetails
+from file_viewer import FileViewer
+from find_replace_details import FindReplaceDetails
 from lru import LruQueue
 from menu import MenuItem
 from menu_defs import menubar
-from new_project_dialog import NewProjectDialog
 from preview import Preview, is_preview_available
 from resources import load_icon_bundle
 from search_ctrl import SearchCtrl
-from search_dialog import SearchDetails, SearchDialog
+from search_details import SearchDetails
+from search_index import SearchIndex, read_files_trigrams_cpu
 from settings import read_settings, write_settings
+from startup_profile import startup_phase, finish_startup_profile
 from shell import run_shell_command
 from styled_text_ctrl import StyledTextCtrl, MARKER_FIND, MARKER_ERROR
 from terminal_ctrl import TerminalCtrl
@@ -35,6 +37,9 @@ def make_project_filename(project_root):
 def make_session_filename(project_root):
     return os.path.join(project_root, ".devo-session")
 
+def make_index_filename(project_root):
+    return os.path.join(project_root, ".devo-index")
+
 class AppEnv(object):
     def __init__(self, mainframe):
         self._mainframe = mainframe
@@ -57,6 +62,9 @@ class AppEnv(object):
     def open_static_text(self, title, text):
         return self._mainframe.OpenStaticEditor(title, text)
 
+    def open_temporary_file(self, title, path):
+        return self._mainframe.OpenTemporaryViewer(title, path)
+
     def show_terminal(self):
         self._mainframe.ShowPane(self._mainframe.terminal)
 
@@ -89,8 +97,14 @@ class AppEnv(object):
     def stopped_file_monitor(self):
         return self._mainframe.fmon.stopped_context()
 
+    # Paths written by the editor are passed on to the search index
+    @contextmanager
     def updating_path(self, path):
-        return self._mainframe.fmon.updating_path(path)
+        try:
+            with self._mainframe.fmon.updating_path(path):
+                yield
+        finally:
+            self._mainframe.OnPathsChanged([path])
 
     def close_view(self, view):
         self._mainframe.ClosePage(view)
@@ -114,6 +128,10 @@ class AppEnv(object):
     def editor_font(self):
         return self._mainframe.editor_font
 
+    @property
+    def fsync_policy(self):
+        return self._mainframe.fsync_policy
+
 class NewEditorWriter(object):
     def __init__(self, env):
         self.env = env
@@ -123,6 +141,11 @@ class NewEditorWriter(object):
 
 MAX_RECENT_FILES = 20
 
+HIBERNATE_CHECK_INTERVAL = 60
+DEFAULT_HIBERNATE_IDLE_MINUTES = 30
+DEFAULT_HIBERNATE_MEMORY_MB = 256
+DEFAULT_LARGE_FILE_VIEWER_MB = 1024
+
 DEFAULT_WIDTH = 1200
 
 AUI_MANAGER_STYLE = aui.AUI_MGR_TRANSPARENT_HINT \
@@ -182,6 +205,12 @@ class MainFrame(wx.Frame, wx.FileDropTarget):
         self.editor_focus = None
         self.editor_highlight = [None, None]
         self.editor_font = get_font_from_settings({})
+        self.editor_last_shown = {}
+        self.hibernate_idle_time = DEFAULT_HIBERNATE_IDLE_MINUTES * 60
+        self.hibernate_memory_limit = DEFAULT_HIBERNATE_MEMORY_MB * 1024 * 1024
+        self.hibernate_timer = wx.Timer(self)
+        self.large_file_viewer_size = DEFAULT_LARGE_FILE_VIEWER_MB * 1024 * 1024
+        self.fsync_policy = FSYNC_NONE
         self.closing = False
         self.closed = False
 
@@ -191,6 +220,7 @@ class MainFrame(wx.Frame, wx.FileDropTarget):
         self.tree = EditorDirTreeCtrl(self, self.env, filter=self.filter)
         self.terminal = TerminalCtrl(self, self.env)
         self.search = SearchCtrl(self, self.env)
+        self.search_index = None
 
         self.manager.AddPane(self.tree,
             aui.AuiPaneInfo().Left().BestSize((220, -1)).CaptionVisible(False))
@@ -202,6 +232,8 @@ class MainFrame(wx.Frame, wx.FileDropTarget):
             aui.AuiPaneInfo().Hide().Top().BestSize((-1, 250)).Caption("Search"))
         self.manager.Update()
 
+        self.tree.sig_paths_changed.bind(self.OnPathsChanged)
+
         self.Bind(wx.EVT_CLOSE, self.OnClose)
         self.Bind(wx.EVT_ACTIVATE, self.OnActivate)
         self.Bind(wx.EVT_CHILD_FOCUS, self.OnChildFocus)
@@ -209,6 +241,7 @@ class MainFrame(wx.Frame, wx.FileDropTarget):
         self.Bind(aui.EVT_AUINOTEBOOK_PAGE_CLOSE, self.OnPageClose)
         self.Bind(aui.EVT_AUINOTEBOOK_PAGE_CHANGED, self.OnPageChanged)
         self.Bind(aui.EVT_AUINOTEBOOK_BG_DCLICK, self.OnTabAreaDClick)
+        self.Bind(wx.EVT_TIMER, self.OnHibernateTimer, self.hibernate_timer)
 
         self.Bind(wx.EVT_MENU, self.OnNewFile, id=ID.NEW)
         self.Bind(wx.EVT_MENU, self.OnOpenFile, id=ID.OPEN)
@@ -307,6 +340,12 @@ class MainFrame(wx.Frame, wx.FileDropTarget):
             if isinstance(x, Editor):
                 yield x
 
+    @property
+    def viewers(self):
+        for x in self.views:
+            if isinstance(x, FileViewer):
+                yield x
+
     @property
     def previews(self):
         for x in self.views:
@@ -377,7 +416,11 @@ class MainFrame(wx.Frame, wx.FileDropTarget):
             self.closing = False
 
     def _DoShutdown(self):
+        self.hibernate_timer.Stop()
         self.fmon.stop()
+        self.CloseSearchIndex()
+        for viewer in self.viewers:
+            viewer.RemoveTemporaryFile()
         async.shutdown_scheduler()
         self.tree.Destroy()
         self.search.Destroy()
@@ -397,7 +440,8 @@ class MainFrame(wx.Frame, wx.FileDropTarget):
     @queued_coroutine("cq")
     def Startup(self, args):
         try:
-            self.settings = (yield async_call(read_settings, self.settings_filename))
+            with startup_phase("read settings"):
+                self.settings = (yield async_call(read_settings, self.settings_filename))
         except Exception:
             self.settings = {}
             try:
@@ -427,16 +471,27 @@ class MainFrame(wx.Frame, wx.FileDropTarget):
             self.MoveWindowToRight(self.settings.get("window_start_width", width))
 
         self.editor_font = get_font_from_settings(self.settings)
+        self.search.workers = self.settings.get("search_workers", 1)
+        self.search.max_matches = self.settings.get("search_max_matches", self.search.max_matches)
+        self.search.max_file_matches = self.settings.get("search_max_file_matches", self.search.max_file_matches)
+        self.hibernate_idle_time = self.settings.get("editor_hibernate_minutes", DEFAULT_HIBERNATE_IDLE_MINUTES) * 60
+        self.hibernate_memory_limit = self.settings.get("editor_hibernate_memory_mb", DEFAULT_HIBERNATE_MEMORY_MB) * 1024 * 1024
+        self.hibernate_timer.Start(HIBERNATE_CHECK_INTERVAL * 1000)
+        self.large_file_viewer_size = self.settings.get("large_file_viewer_mb", DEFAULT_LARGE_FILE_VIEWER_MB) * 1024 * 1024
+        self.fsync_policy = self.settings.get("save_fsync", FSYNC_NONE)
+        if self.fsync_policy not in FSYNC_POLICIES:
+            self.fsync_policy = FSYNC_NONE
 
         self.recent_files = LruQueue(self.settings.get("recent_files", []), MAX_RECENT_FILES)
 
-        for project_path in self.settings.get("projects", ()):
-            try:
-                project = (yield async_call(read_settings, make_project_filename(project_path)))
-                project.setdefault("name", os.path.basename(project_path))
-                self.project_info[project_path] = project
-            except Exception:
-                pass
+        with startup_phase("read project list"):
+            for project_path in self.settings.get("projects", ()):
+                try:
+                    project = (yield async_call(read_settings, make_project_filename(project_path)))
+                    project.setdefault("name", os.path.basename(project_path))
+                    self.project_info[project_path] = project
+                except Exception:
+                    pass
 
         if "dialogs" in self.settings:
             dialogs.load_state(self.settings["dialogs"])
@@ -447,18 +502,19 @@ class MainFrame(wx.Frame, wx.FileDropTarget):
         if "search_details" in self.settings:
             self.search_details.LoadPerspective(self.settings["search_details"])
 
-        success = True
-        if args.project:
-            success = (yield self.OpenProject(args.project))
-        else:
-            last_project = self.settings.get("last_project")
-            if last_project:
-                success = (yield self.OpenProject(last_project))
+        with startup_phase("load project"):
+            success = True
+            if args.project:
+                success = (yield self.OpenProject(args.project))
             else:
-                yield self.OpenDefaultProject()
+                last_project = self.settings.get("last_project")
+                if last_project:
+                    success = (yield self.OpenProject(last_project))
+                else:
+                    yield self.OpenDefaultProject()
 
-        if not success:
-            yield self.OpenDefaultProject()
+            if not success:
+                yield self.OpenDefaultProject()
 
         for filename in args.filenames:
             self.OpenEditor(filename)
@@ -470,6 +526,11 @@ class MainFrame(wx.Frame, wx.FileDropTarget):
             elif window_state == "maximized":
                 wx.CallAfter(self.Maximize)
 
+        try:
+            finish_startup_profile(os.path.join(self.config_dir, "startup-profile.txt"))
+        except EnvironmentError:
+            pass
+
         yield self.SaveSettings()
 
     @managed("cm")
@@ -527,6 +588,11 @@ class MainFrame(wx.Frame, wx.FileDropTarget):
             except Exception as e:
                 dialogs.error(self, "Error saving project:\n\n%s" % e)
                 yield False
+            if self.search_index:
+                try:
+                    yield async_call_priority(PRIORITY_BULK, self.search_index.save)
+                except Exception:
+                    pass
             yield True
         finally:
             self.fmon.start(update_paths=False)
@@ -535,16 +601,21 @@ class MainFrame(wx.Frame, wx.FileDropTarget):
     @coroutine
     def LoadSession(self):
         session = (yield async_call(read_settings, self.session_filename))
+        selection = session.get("selection", -1)
 
         with frozen_window(self.notebook):
             errors = []
             try:
                 views = []
+                deferred = []
                 seen_paths = set()
 
-                for p in session.get("editors", ()):
+                # Only the selected editor is loaded now. The other editors
+                # read their files in the background and are filled in when
+                # their tab is first shown.
+                for i, p in enumerate(session.get("editors", ())):
                     view_type = p.get("view_type")
-                    view_types = dict(editor=self.NewEditor, preview=self.NewPreview)
+                    view_types = dict(editor=self.NewEditor, preview=self.NewPreview, viewer=self.NewFileViewer)
                     view = view_types.get(view_type, self.NewEditor)()
                     if "path" in p and view_type == "editor":
                         path = p["path"] = self.GetFullPath(p["path"])
@@ -552,6 +623,10 @@ class MainFrame(wx.Frame, wx.FileDropTarget):
                             views.append((view, None))
                             continue
                         seen_paths.add(path)
+                        if i != selection:
+                            deferred.append((view, view.DeferLoadPerspective(p)))
+                            views.append((view, False))
+                            continue
                     future = view.LoadPerspective(p)
                     views.append((view, future))
 
@@ -562,7 +637,7 @@ class MainFrame(wx.Frame, wx.FileDropTarget):
                 for i, (view, future) in reversed(list(enumerate(views))):
                     if future is None:
                         to_remove.append(i)
-                    else:
+                    elif future is not False:
                         try:
                             yield future
                         except Exception as e:
@@ -574,11 +649,9 @@ class MainFrame(wx.Frame, wx.FileDropTarget):
                 if "notebook" in session:
                     self.notebook.LoadPerspective(session["notebook"])
 
-                if "selection" in session:
-                    selection = session["selection"]
-                    if 0 <= selection < self.notebook.GetPageCount():
-                        self.notebook.SetSelection(selection)
-                        self.notebook.GetPage(selection).SetFocus()
+                if 0 <= selection < self.notebook.GetPageCount():
+                    self.notebook.SetSelection(selection)
+                    self.notebook.GetPage(selection).SetFocus()
 
                 # to_remove is already in reverse order
                 for i in to_remove:
@@ -589,6 +662,37 @@ class MainFrame(wx.Frame, wx.FileDropTarget):
                     dialogs.error(self, "Errors loading session:\n\n%s" %
                         ("\n\n".join(str(e) for e in errors)))
 
+        if deferred:
+            self.FinishDeferredLoads(deferred)
+
+    @managed("cm")
+    @coroutine
+    def FinishDeferredLoads(self, deferred):
+        for editor in self.editors:
+            if editor.pending and editor.IsShownOnScreen():
+                editor.Materialise()
+
+        errors = []
+        for editor, future in deferred:
+            if future is None:
+                continue
+            try:
+                yield future
+            except Exception as e:
+                if not editor or editor.pending_load is not future:
+                    continue
+                i = self.notebook.GetPageIndex(editor)
+                if i != wx.NOT_FOUND:
+                    with frozen_window(self.notebook):
+                        self.notebook.DeletePage(i)
+                    self.ForgetEditor(editor)
+                if not (isinstance(e, IOError) and e.errno == errno.ENOENT):
+                    errors.append(e)
+
+        if errors:
+            dialogs.error(self, "Errors loading session:\n\n%s" %
+                ("\n\n".join(str(e) for e in errors)))
+
     def DeleteAllPages(self):
         with frozen_window(self.notebook):
             for i in xrange(self.notebook.GetPageCount()-1, -1, -1):
@@ -614,10 +718,32 @@ class MainFrame(wx.Frame, wx.FileDropTarget):
 
         self.DeleteAllPages()
         self.tree.SetTopLevel([DirNode(self.project_root)])
+        self.UpdateSearchIndex()
         self.UpdateMenuBar()
         self.UpdateTitle()
         self.StartFileMonitor()
 
+    def UpdateSearchIndex(self):
+        if self.project_root and self.project.get("search_index", False):
+            if not (self.search_index and self.search_index.root == self.project_root):
+                self.CloseSearchIndex()
+                self.search_index = SearchIndex(make_index_filename(self.project_root), self.project_root,
+                                                read_trigrams=read_files_trigrams_cpu)
+                self.search.index = self.search_index
+                async_call_priority(PRIORITY_BULK, self.search_index.open)
+        else:
+            self.CloseSearchIndex()
+
+    def CloseSearchIndex(self):
+        if self.search_index:
+            self.search_index.close()
+            self.search_index = None
+            self.search.index = None
+
+    def OnPathsChanged(self, paths):
+        if self.search_index:
+            async_call_priority(PRIORITY_BULK, self.search_index.update_paths, paths)
+
     @managed("cm")
     @coroutine
     def OpenNewProject(self, project, project_root):
@@ -665,7 +791,8 @@ class MainFrame(wx.Frame, wx.FileDropTarget):
                 project.update(update)
                 self.SetProject(project, project_root)
                 try:
-                    yield self.LoadSession()
+                    with startup_phase("restore session"):
+                        yield self.LoadSession()
                 except IOError:
                     pass
                 if newly_added:
@@ -693,10 +820,12 @@ class MainFrame(wx.Frame, wx.FileDropTarget):
             self.project_filename = ""
             self.session_filename = os.path.join(self.config_dir, "session")
 
+            self.CloseSearchIndex()
             self.DeleteAllPages()
             self.tree.SetTopLevel()
             try:
-                yield self.LoadSession()
+                with startup_phase("restore session"):
+                    yield self.LoadSession()
             except Exception:
                 pass
             finally:
@@ -751,6 +880,8 @@ class MainFrame(wx.Frame, wx.FileDropTarget):
 
     def OnPageChanged(self, evt):
         editor = self.notebook.GetPage(evt.GetSelection())
+        if isinstance(editor, Editor) and editor.pending:
+            editor.Materialise()
         editor.SetFocus()
         self.SetStatusText(editor.status_text, 0)
         self.SetStatusText(editor.status_text_path, 1)
@@ -781,6 +912,12 @@ class MainFrame(wx.Frame, wx.FileDropTarget):
             self.AddPage(editor, index=index)
             return editor
 
+    def NewFileViewer(self, index=None):
+        with frozen_window(self.notebook):
+            viewer = FileViewer(self.notebook, self.env)
+            self.AddPage(viewer, index=index)
+            return viewer
+
     def NewPreview(self, index=None, url="", show_browser_ui=True):
         with frozen_window(self.notebook):
             preview = Preview(self.notebook, self.env, url=url, show_browser_ui=show_browser_ui)
@@ -801,6 +938,9 @@ class MainFrame(wx.Frame, wx.FileDropTarget):
     def FindEditor(self, path):
         return self._FindPath(path, self.editors)
 
+    def FindViewer(self, path):
+        return self._FindPath(path, self.viewers)
+
     def FindPreview(self, path):
         return self._FindPath(path, self.previews)
 
@@ -847,27 +987,56 @@ class MainFrame(wx.Frame, wx.FileDropTarget):
         path = self.GetFullPath(path)
         editor = self.FindEditor(path)
         if editor:
+            if editor.pending:
+                yield editor.Materialise()
             self.SetEditorLineAndMarker(editor, line, marker_type)
             self.ActivateView(editor)
             yield True
 
+        viewer = self.FindViewer(path)
+        if viewer:
+            self.ActivateView(viewer)
+            yield True
+
         try:
             if not os.path.exists(path):
                 dialogs.error(self, "File does not exist:\n\n%s" % path)
                 yield False
-            if not (yield async_call(is_text_file, path)):
+            if not (yield async_call_priority(PRIORITY_INTERACTIVE, is_text_file, path)):
                 if not dialogs.ask_open_binary(self, path):
                     yield False
         except EnvironmentError:
             yield False
 
+        # Files too big for the editor are shown a page at a time
+        if self.large_file_viewer_size and get_file_size(path) >= self.large_file_viewer_size:
+            viewer = self.NewFileViewer()
+            try:
+                viewer.Open(path)
+            except Exception as e:
+                self.notebook.DeletePage(self.notebook.GetPageIndex(viewer))
+                dialogs.error(self, "Error opening file:\n\n%s" % e)
+                yield False
+            self.AddRecentFile(path)
+            yield True
+
         editor = Editor(self.notebook, self.env, path)
+        # Large files are shown while they load
+        shown_early = is_large_file(path)
+        if shown_early:
+            with frozen_window(self.notebook):
+                self.AddPage(editor)
         if not (yield editor.TryLoadFile(path)):
-            editor.Destroy()
+            if shown_early:
+                self.notebook.DeletePage(self.notebook.GetPageIndex(editor))
+                self.ForgetEditor(editor)
+            else:
+                editor.Destroy()
             yield False
 
         with frozen_window(self.notebook):
-            self.AddPage(editor)
+            if not shown_early:
+                self.AddPage(editor)
             self.AddRecentFile(path)
             self.SetEditorLineAndMarker(editor, line, marker_type)
             editor.SetFocus()
@@ -882,6 +1051,14 @@ class MainFrame(wx.Frame, wx.FileDropTarget):
         editor = self.NewEditor()
         editor.SetStatic(title, text)
 
+    def OpenTemporaryViewer(self, title, path):
+        viewer = self.NewFileViewer()
+        try:
+            viewer.OpenTemporary(title, path)
+        except EnvironmentError as e:
+            self.ClosePage(viewer)
+            dialogs.error(self, "Error opening file:\n\n%s" % e)
+
     def OnNewFile(self, evt):
         self.NewEditor()
 
@@ -914,6 +1091,7 @@ class MainFrame(wx.Frame, wx.FileDropTarget):
         return True
 
     def GetNewProject(self, path=""):
+        from new_project_dialog import NewProjectDialog
         dlg = NewProjectDialog(self, path=path)
         try:
             if dlg.ShowModal() == wx.ID_OK:
@@ -945,10 +1123,12 @@ class MainFrame(wx.Frame, wx.FileDropTarget):
 
     def OnEditProject(self, evt):
         if self.project_filename:
+            from edit_project_dialog import EditProjectDialog
             dlg = EditProjectDialog(self, self.project)
             try:
                 if dlg.ShowModal() == wx.ID_OK:
                     dlg.UpdateProject(self.project)
+                    self.UpdateSearchIndex()
                     self.UpdateMenuBar()
                     self.UpdateTitle()
                     self.SaveProject()
@@ -1009,6 +1189,7 @@ class MainFrame(wx.Frame, wx.FileDropTarget):
         elif not self.search_details.path.strip():
             self.search_details.path = self.project_root
 
+        from search_dialog import SearchDialog
         dlg = SearchDialog(self, self.search_details)
         try:
             if dlg.ShowModal() == wx.ID_OK:
@@ -1023,6 +1204,7 @@ class MainFrame(wx.Frame, wx.FileDropTarget):
         self.Search()
 
     def OnConfigureGlobalCommands(self, evt):
+        from commands_dialog import CommandsDialog
         dlg = CommandsDialog(self, self.settings.get("commands", []), title="Global Commands")
         try:
             if dlg.ShowModal() == wx.ID_OK:
@@ -1035,6 +1217,7 @@ class MainFrame(wx.Frame, wx.FileDropTarget):
     def OnConfigureProjectCommands(self, evt):
         if not self.project_filename:
             return
+        from commands_dialog import CommandsDialog
         dlg = CommandsDialog(self, self.project.get("commands", []), title="Project Commands")
         try:
             if dlg.ShowModal() == wx.ID_OK:
@@ -1062,6 +1245,28 @@ class MainFrame(wx.Frame, wx.FileDropTarget):
             except Exception as e:
                 dialogs.error(self, "Error executing command:\n\n%s" % traceback.format_exc())
 
+    # Saves the editors concurrently on the thread pool. With the directory
+    # fsync policy, each file is synced as it is written and then each
+    # directory is synced once for the whole batch.
+    @coroutine
+    def SaveEditors(self, editors):
+        fsync = FSYNC_FILE if self.fsync_policy == FSYNC_DIRECTORY else self.fsync_policy
+        futures = [editor.Save(fsync) for editor in editors]
+        success = True
+        for future in futures:
+            try:
+                if not (yield future):
+                    success = False
+            except Exception:
+                success = False
+        if self.fsync_policy == FSYNC_DIRECTORY:
+            try:
+                yield async_call(sync_directories, [editor.path for editor in editors])
+            except EnvironmentError as e:
+                dialogs.error(self, "Error syncing saved files:\n\n%s" % e)
+                success = False
+        yield success
+
     @managed("cm")
     @coroutine
     def DoUserCommand(self, command):
@@ -1100,14 +1305,14 @@ class MainFrame(wx.Frame, wx.FileDropTarget):
         save_option = command.get("save", "")
         if not save_option:
             # Backwards compatibility
+            from commands_dialog import save_options
             save_option = dict(save_options).get(command.get("before", ""))
         if save_option == "save_current_file":
             if editor and editor.path and editor.modified and not (yield editor.Save()):
                 yield False
         elif save_option == "save_all_files":
-            for editor in self.editors:
-                if editor.path and editor.modified and not (yield editor.Save()):
-                    yield False
+            if not (yield self.SaveEditors([e for e in self.editors if e.path and e.modified])):
+                yield False
 
         detach = command.get("detach", False)
         killable = command.get("killable", True)
@@ -1241,6 +1446,7 @@ class MainFrame(wx.Frame, wx.FileDropTarget):
         webbrowser.open_new_tab(app_info.latest_release_url)
 
     def OnAboutBox(self, evt):
+        from about_dialog import AboutDialog
         dlg = AboutDialog(self, self.env)
         try:
             dlg.ShowModal()
@@ -1282,6 +1488,8 @@ class MainFrame(wx.Frame, wx.FileDropTarget):
     def OnActivate(self, evt):
         if evt.GetActive():
             self.TryNotifyUpdatedPaths()
+            if self.search_index:
+                async_call_priority(PRIORITY_BULK, self.search_index.check_files)
 
     def OnChildFocus(self, evt):
         focus = wx.Window.FindFocus()
@@ -1293,6 +1501,36 @@ class MainFrame(wx.Frame, wx.FileDropTarget):
                 return
             focus = focus.Parent
 
+    # Unmodified editors which haven't been shown for the idle time are
+    # hibernated, then the least recently shown ones are hibernated until
+    # the text held by editors is under the memory limit. A setting of 0
+    # disables either check.
+    def OnHibernateTimer(self, evt):
+        now = time.time()
+        prev_last_shown = self.editor_last_shown
+        self.editor_last_shown = {}
+        candidates = []
+        memory_used = 0
+        for editor in self.editors:
+            if editor.pending:
+                continue
+            size = editor.GetLength() * 2  # text and style bytes
+            memory_used += size
+            if editor.IsShownOnScreen() or editor is self.editor_focus:
+                last_shown = now
+            else:
+                last_shown = prev_last_shown.get(editor, now)
+                if editor.can_hibernate and editor not in self.editor_highlight:
+                    candidates.append((last_shown, size, editor))
+            self.editor_last_shown[editor] = last_shown
+        candidates.sort(key=lambda x: x[0])
+        for last_shown, size, editor in candidates:
+            idle = self.hibernate_idle_time and now - last_shown >= self.hibernate_idle_time
+            over_limit = self.hibernate_memory_limit and memory_used > self.hibernate_memory_limit
+            if idle or over_limit:
+                editor.Hibernate()
+                memory_used -= size
+
     def OnFilesChanged(self, updated_paths, deleted_paths):
         for path in updated_paths:
             self.updated_paths.add(path)
@@ -16,8 +16,8 @@ class Preview(wx.Panel):
 
         self.env = env
         self.show_browser_ui = show_browser_ui
-        self.sig_title_changed = Signal()
-        self.sig_status_changed = Signal()
+        self.sig_title_changed = Signal(coalesce=True)
+        self.sig_status_changed = Signal(coalesce=True)
 
         import wx.html2 as webview
         self.wv = webview.WebView.New(self, url=url)
@@ -1,6 +1,8 @@
-import os, re, traceback
-from dirtree_node import get_file_info
-from util import is_text_file
+import os, re, mmap, traceback, threading, collections, itertools, multiprocessing, sre_parse, sre_constants
+import multiprocessing.sharedctypes
+from listing import get_file_info, list_dir
+from text_encoding import SNIFF_SIZE, FALLBACK_ENCODING, get_data_encoding, get_encoding_cache, update_encoding_cache
+from util import is_text_file, get_text_file_cache, update_text_file_cache, unique
 
 class SearchAborted(Exception):
     pass
@@ -8,68 +10,199 @@ class SearchAborted(Exception):
 def null_filter(info):
     return True
 
+def decode_line(line, encoding):
+    try:
+        return line.decode(encoding)
+    except UnicodeDecodeError:
+        return line.decode(FALLBACK_ENCODING)
+
+def count_newlines(buf, start, end, chunk_size=1024*1024):
+    count = 0
+    while start < end:
+        stop = min(start + chunk_size, end)
+        count += buf[start:stop].count("\n")
+        start = stop
+    return count
+
+def iter_lines_matches(f, match, encoding):
+    match = getattr(match, "match_line", match)
+    for line_num, line in enumerate(f, 1):
+        line = decode_line(line.rstrip("\r\n"), encoding)
+        if match(line):
+            yield line_num, line
+
+# Runs the matcher's bytes pattern over the whole mapped file, so only lines
+# containing a candidate match are located, decoded and confirmed.
+def iter_buffer_matches(buf, bytes_search, match, encoding):
+    match = getattr(match, "match_line", match)
+    size = len(buf)
+    line_num = 1
+    line_num_pos = 0
+    pos = 0
+    while pos < size:
+        m = bytes_search(buf, pos)
+        if not m:
+            break
+        start = buf.rfind("\n", 0, m.start()) + 1
+        end = buf.find("\n", m.start())
+        if end == -1:
+            end = size
+        line_num += count_newlines(buf, line_num_pos, start)
+        line_num_pos = start
+        line = decode_line(buf[start:end].rstrip("\r\n"), encoding)
+        if match(line):
+            yield line_num, line
+        pos = end + 1
+
+# Unless an encoding is given, the file's encoding is detected as for the
+# editor (and cached), from the start of the file as it is read for the
+# search. Lines which don't decode with it fall back to ISO-8859-1.
+def iter_file_matches(filepath, match, encoding=None):
+    bytes_search = getattr(match, "bytes_search", None)
+    with open(filepath, "rb" if bytes_search else "r") as f:
+        if bytes_search:
+            try:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (EnvironmentError, ValueError):
+                # Empty files can't be mapped
+                if os.fstat(f.fileno()).st_size == 0:
+                    return
+            else:
+                try:
+                    if encoding is None:
+                        encoding = get_data_encoding(filepath, os.fstat(f.fileno()), buf)
+                    for result in iter_buffer_matches(buf, bytes_search, match, encoding):
+                        yield result
+                finally:
+                    buf.close()
+                return
+        if encoding is None:
+            data = f.read(SNIFF_SIZE)
+            f.seek(0)
+            encoding = get_data_encoding(filepath, os.fstat(f.fileno()), data)
+        for result in iter_lines_matches(f, match, encoding):
+            yield result
+
 class Search(object):
-    def __init__(self, path, match, output, file_filter=null_filter, dir_filter=null_filter):
+    def __init__(self, path, match, output, file_filter=null_filter, dir_filter=null_filter,
+                 index=None, ignore=None):
         self.path = path
         self.match = match
         self.output = output
         self.file_filter = file_filter
         self.dir_filter = dir_filter
-        self.encoding = "utf-8"
+        self.index = index
+        self.ignore = ignore
+        self.encoding = None
         self.quit = False
 
+    def _output_matches(self, filepath, matches):
+        matched_file = False
+        for line_num, line in matches:
+            if not matched_file:
+                self.output.add_file(self, filepath)
+                matched_file = True
+            self.output.add_line(self, line_num, line)
+            if self.quit:
+                raise SearchAborted()
+        if matched_file:
+            self.output.end_file(self)
+
     def _search_file(self, filepath):
         if self.quit:
             raise SearchAborted()
         self.output.begin_file(self, filepath)
         if not is_text_file(filepath):
             return
-        with open(filepath, "r") as f:
-            matched_file = False
-            for line_num, line in enumerate(f, 1):
-                line = line.rstrip("\r\n")
-                try:
-                    line = line.decode(self.encoding)
-                except UnicodeDecodeError:
-                    line = line.decode("latin-1")
-                if self.match(line):
-                    if not matched_file:
-                        self.output.add_file(self, filepath)
-                        matched_file = True
-                    self.output.add_line(self, line_num, line)
-                if self.quit:
-                    raise SearchAborted()
-            if matched_file:
-                self.output.end_file(self)
-
-    def _search_dir(self, dirpath):
-        if self.quit:
-            raise SearchAborted()
+        self._output_matches(filepath, iter_file_matches(filepath, self.match, self.encoding))
+
+    def _walk_dir(self, dirpath):
         try:
-            dirlist = os.listdir(dirpath)
+            dirlist = list_dir(dirpath)
         except OSError:
             pass
         else:
-            dirlist.sort()
-            for name in dirlist:
-                self._search(dirpath, name)
+            dirlist.sort(key=lambda info: info.filename)
+            ignore = self.ignore
+            for info in dirlist:
+                if ignore is not None and ignore.is_ignored(dirpath, info.filename, info.is_dir):
+                    continue
+                for filepath in self._walk_info(info):
+                    yield filepath
 
-    def _search(self, dirpath, name):
+    def _walk_info(self, info):
         if self.quit:
-            raise SearchAborted()
+            return
+        if info.is_file and self.file_filter(info):
+            yield info.path
+        elif info.is_dir and self.dir_filter(info):
+            for filepath in self._walk_dir(info.path):
+                yield filepath
+
+    def _walk(self, dirpath, name):
         try:
             info = get_file_info(dirpath, name)
-            if info.is_file and self.file_filter(info):
-                self._search_file(info.path)
-            elif info.is_dir and self.dir_filter(info):
-                self._search_dir(info.path)
         except OSError:
-            pass
+            return
+        for filepath in self._walk_info(info):
+            yield filepath
+
+    def _dir_allowed(self, dirpath, allowed_dirs):
+        allowed = allowed_dirs.get(dirpath)
+        if allowed is None:
+            allowed = True
+            parent, name = os.path.split(dirpath)
+            if dirpath != self.path:
+                allowed = self._dir_allowed(parent, allowed_dirs)
+                if allowed and self.ignore is not None:
+                    allowed = not self.ignore.is_ignored(parent, name, True)
+            if allowed:
+                try:
+                    info = get_file_info(parent, name)
+                    allowed = info.is_dir and self.dir_filter(info)
+                except OSError:
+                    allowed = False
+            allowed_dirs[dirpath] = allowed
+        return allowed
+
+    def _walk_candidates(self, candidates):
+        allowed_dirs = {}
+        for filepath in candidates:
+            if self.quit:
+                return
+            dirpath, name = os.path.split(filepath)
+            if not self._dir_allowed(dirpath, allowed_dirs):
+                continue
+            if self.ignore is not None and self.ignore.is_ignored(dirpath, name, False):
+                continue
+            try:
+                info = get_file_info(dirpath, name)
+            except OSError:
+                continue
+            if info.is_file and self.file_filter(info):
+                yield filepath
+
+    def _iter_files(self):
+        if self.index is not None:
+            self.path = os.path.normpath(self.path)
+            candidates = self.index.find_candidates(self.match.required_literals(), self.path)
+            if candidates is not None:
+                return self._walk_candidates(candidates)
+        return self._walk(*os.path.split(self.path))
+
+    def _search(self):
+        for filepath in self._iter_files():
+            try:
+                self._search_file(filepath)
+            except (OSError, IOError):
+                pass
+        if self.quit:
+            raise SearchAborted()
 
     def search(self):
         self.quit = False
         try:
-            self._search(*os.path.split(self.path))
+            self._search()
         except SearchAborted:
             self.output.abort_find(self)
         except Exception as e:
@@ -82,6 +215,127 @@ class Search(object):
     def stop(self):
         self.quit = True
 
+# Each parallel search has an id, which is stored in its slot of the shared
+# cancelled array when it is stopped. Workers check it between files, so a
+# stopped search doesn't keep the workers busy with its queued chunks.
+CANCELLED_SLOTS = 64
+
+_search_cancelled = None
+
+def _init_search_worker(cancelled):
+    global _search_cancelled
+    _search_cancelled = cancelled
+
+def _search_files_worker(search_id, match, encoding, filepaths, text_file_cache, encoding_cache):
+    update_text_file_cache(text_file_cache)
+    update_encoding_cache(encoding_cache)
+    results = []
+    for filepath in filepaths:
+        if _search_cancelled is not None and _search_cancelled[search_id % CANCELLED_SLOTS] == search_id:
+            break
+        try:
+            if is_text_file(filepath):
+                matches = list(iter_file_matches(filepath, match, encoding))
+            else:
+                matches = None
+        except (OSError, IOError):
+            matches = None
+        results.append((filepath, matches))
+    return results, get_text_file_cache(filepaths), get_encoding_cache(filepaths)
+
+# One pool of worker processes is shared by all parallel searches. Forking a
+# process with threads running isn't safe, so the pool is started once, at
+# startup before wx or any other threads are started, and kept with its
+# original size. Otherwise make_search searches serially.
+_search_pool = None
+_search_pool_workers = 0
+_search_pool_lock = threading.Lock()
+_search_ids = itertools.count(1)
+
+def start_search_pool(workers=None):
+    global _search_pool, _search_pool_workers, _search_cancelled
+    with _search_pool_lock:
+        if _search_pool is None:
+            _search_pool_workers = workers or multiprocessing.cpu_count()
+            _search_cancelled = multiprocessing.sharedctypes.RawArray("l", CANCELLED_SLOTS)
+            _search_pool = multiprocessing.Pool(_search_pool_workers,
+                _init_search_worker, (_search_cancelled,))
+        return _search_pool
+
+def get_search_pool():
+    return _search_pool
+
+def shutdown_search_pool():
+    global _search_pool
+    with _search_pool_lock:
+        if _search_pool is not None:
+            _search_pool.terminate()
+            _search_pool = None
+
+# The directory walk runs on the search thread, which keeps a bounded number
+# of chunks of paths queued for the worker processes. Results are consumed in
+# submission order so the output sees files in the same order as the serial
+# search.
+class ParallelSearch(Search):
+    def __init__(self, path, match, output, file_filter=null_filter, dir_filter=null_filter,
+                 index=None, ignore=None, workers=None, chunk_size=16):
+        Search.__init__(self, path, match, output, file_filter, dir_filter, index, ignore)
+        self.workers = workers or multiprocessing.cpu_count()
+        self.chunk_size = chunk_size
+        self.poll_interval = 0.1
+        with _search_pool_lock:
+            self.search_id = next(_search_ids)
+
+    def _iter_file_chunks(self):
+        chunk = []
+        for filepath in self._iter_files():
+            chunk.append(filepath)
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk and not self.quit:
+            yield chunk
+
+    def _wait_result(self, result):
+        while True:
+            if self.quit:
+                raise SearchAborted()
+            try:
+                return result.get(self.poll_interval)
+            except multiprocessing.TimeoutError:
+                pass
+
+    def _output_chunk(self, result):
+        chunk, text_file_cache, encoding_cache = self._wait_result(result)
+        update_text_file_cache(text_file_cache)
+        update_encoding_cache(encoding_cache)
+        for filepath, matches in chunk:
+            if self.quit:
+                raise SearchAborted()
+            self.output.begin_file(self, filepath)
+            if matches:
+                self._output_matches(filepath, matches)
+
+    def _search(self):
+        pool = start_search_pool(self.workers)
+        max_pending_chunks = _search_pool_workers * 2
+        pending = collections.deque()
+        for chunk in self._iter_file_chunks():
+            if len(pending) >= max_pending_chunks:
+                self._output_chunk(pending.popleft())
+            pending.append(pool.apply_async(_search_files_worker,
+                (self.search_id, self.match, self.encoding, chunk,
+                 get_text_file_cache(chunk), get_encoding_cache(chunk))))
+        while pending:
+            self._output_chunk(pending.popleft())
+        if self.quit:
+            raise SearchAborted()
+
+    def stop(self):
+        Search.stop(self)
+        if _search_cancelled is not None:
+            _search_cancelled[self.search_id % CANCELLED_SLOTS] = self.search_id
+
 class SearchFileOutput(object):
     def __init__(self, file):
         self.file = file
@@ -104,13 +358,133 @@ class SearchFileOutput(object):
     def end_find(self, finder):
         pass
 
+    def abort_find(self, finder):
+        pass
+
+class Matcher(object):
+    def __init__(self, pattern, case_sensitive=True, is_regexp=False):
+        self.pattern = pattern
+        self.case_sensitive = case_sensitive
+        self.is_regexp = is_regexp
+        self.__compile()
+
+    def __compile(self):
+        flags = re.UNICODE
+        if not self.case_sensitive:
+            flags |= re.IGNORECASE
+        if self.is_regexp:
+            self.search = re.compile(self.pattern, flags).search
+            parsed = sre_parse.parse(self.pattern)
+            self.literals = regexp_required_literals(parsed)
+            self.ignore_case = bool((flags | parsed.pattern.flags) & re.IGNORECASE)
+            self.match_line = self.__regexp_line_matcher(parsed)
+        else:
+            self.search = None
+            self.literals = split_ascii_runs(self.pattern)
+            self.ignore_case = not self.case_sensitive
+            self.match_line = self.__literal_line_matcher()
+        bytes_pattern = self.__bytes_pattern()
+        if bytes_pattern:
+            self.bytes_search = re.compile(bytes_pattern, re.IGNORECASE if self.ignore_case else 0).search
+        else:
+            self.bytes_search = None
+
+    def __literal_line_matcher(self):
+        text = self.pattern
+        if isinstance(text, str):
+            text = text.decode("latin-1")
+        if self.ignore_case:
+            text = text.lower()
+            return lambda line: text in line.lower()
+        return lambda line: text in line
+
+    # Rejects lines which lack the pattern's longest required literal before
+    # running the regexp. Case-sensitive patterns starting with a literal are
+    # left alone, since the regexp engine already scans for their prefix.
+    def __regexp_line_matcher(self, parsed):
+        search = self.search
+        if not self.literals:
+            return search
+        if not self.ignore_case and parsed and parsed[0][0] == sre_constants.LITERAL:
+            return search
+        literal = max(self.literals, key=len).decode("ascii")
+        if self.ignore_case:
+            literal = literal.lower()
+            return lambda line: literal in line.lower() and search(line)
+        return lambda line: literal in line and search(line)
+
+    # Returns a pattern for searching the raw file contents which matches at
+    # least every line that the matcher can match. Case-insensitive bytes
+    # patterns only fold ASCII, so they are only used for ASCII literals.
+    def __bytes_pattern(self):
+        if self.is_regexp:
+            if self.literals:
+                return re.escape(max(self.literals, key=len))
+            return None
+        text = self.pattern
+        if isinstance(text, str):
+            text = text.decode("latin-1")
+        try:
+            return re.escape(text.encode("ascii"))
+        except UnicodeEncodeError:
+            if self.ignore_case:
+                return None
+        encoded = [text.encode("utf-8")]
+        try:
+            encoded.append(text.encode("latin-1"))
+        except UnicodeEncodeError:
+            pass
+        return "|".join(re.escape(x) for x in unique(encoded))
+
+    def __call__(self, line):
+        return self.match_line(line)
+
+    def required_literals(self):
+        return self.literals
+
+    # Compiled pattern methods can't be pickled, so recompile in worker processes.
+    def __getstate__(self):
+        return (self.pattern, self.case_sensitive, self.is_regexp)
+
+    def __setstate__(self, state):
+        self.pattern, self.case_sensitive, self.is_regexp = state
+        self.__compile()
+
+re_non_ascii = re.compile(r"[^\x00-\x7F]+")
+
+def split_ascii_runs(s):
+    return [x.encode("ascii") for x in re_non_ascii.split(s) if x]
+
+def regexp_required_literals(parsed, literals=None):
+    # Collect runs of literal characters which every match must contain.
+    if literals is None:
+        literals = []
+    run = []
+    def flush():
+        if run:
+            literals.append("".join(run))
+            del run[:]
+    for op, av in parsed:
+        if op == sre_constants.LITERAL and av < 0x80:
+            run.append(chr(av))
+        elif op == sre_constants.SUBPATTERN:
+            flush()
+            regexp_required_literals(av[1], literals)
+        else:
+            flush()
+            if op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT) and av[0] >= 1:
+                regexp_required_literals(av[2], literals)
+    flush()
+    return literals
+
 def make_matcher(pattern, case_sensitive=True, is_regexp=False):
-    if not is_regexp:
-        pattern = "^.*" + re.escape(pattern)
-    flags = re.UNICODE
-    if not case_sensitive:
-        flags |= re.IGNORECASE
-    return re.compile(pattern, flags).search
+    return Matcher(pattern, case_sensitive, is_regexp)
+
+def make_search(path, match, output, file_filter=null_filter, dir_filter=null_filter,
+                index=None, ignore=None, workers=1):
+    if workers == 1 or get_search_pool() is None:
+        return Search(path, match, output, file_filter, dir_filter, index, ignore)
+    return ParallelSearch(path, match, output, file_filter, dir_filter, index, ignore, workers=workers)
 
 if __name__ == "__main__":
     import sys
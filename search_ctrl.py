@@ -1,8 +1,9 @@
-import sys, re, time
+import sys, os, re, time, tempfile, threading
 import wx
-from async import async_call
+from async import async_call_priority, PRIORITY_BULK
 from dirtree_filter import re_hidden_files, re_hidden_dirs
-from search import Search, make_matcher
+from ignore import IgnoreRules
+from search import make_search, make_matcher
 from styled_text_ctrl import MARKER_FIND
 from thread_output_ctrl import ThreadOutputCtrl
 from util import get_text_extent, compile_file_patterns
@@ -12,14 +13,96 @@ if sys.platform == "win32":
 else:
     r_path_start = re.compile(r"^/")
 
+def to_utf8(s):
+    return s.encode("utf-8") if isinstance(s, unicode) else s
+
+# Keeps count of the matches shown in the output against the caps, and
+# spools every match to a temporary file so the full results can be shown
+# on demand, a page at a time, without holding them in memory.
+class SearchResults(object):
+    def __init__(self, max_matches, max_file_matches):
+        self.max_matches = max_matches
+        self.max_file_matches = max_file_matches
+        self.num_shown = 0
+        self.num_omitted = 0
+        self.num_omitted_files = 0
+        self.file_matches = 0
+        self.file_omitted = 0
+        self.file_shown = False
+        self.lock = threading.Lock()
+        fd, self.spool_path = tempfile.mkstemp(prefix="devo-search-", suffix=".txt")
+        self.spool = os.fdopen(fd, "w+b")
+
+    @property
+    def capped(self):
+        return self.num_omitted > 0
+
+    def write_spool(self, s):
+        with self.lock:
+            if self.spool is not None:
+                self.spool.write(to_utf8(s))
+
+    def add_file(self, filepath):
+        self.write_spool(filepath + "\n")
+        self.file_matches = 0
+        self.file_omitted = 0
+        self.file_shown = self.num_shown < self.max_matches
+        return self.file_shown
+
+    def add_line(self, line_num, line):
+        self.write_spool(" %5d: %s\n" % (line_num, line))
+        self.file_matches += 1
+        if self.file_shown \
+        and self.file_matches <= self.max_file_matches \
+        and self.num_shown < self.max_matches:
+            self.num_shown += 1
+            return True
+        if not self.file_omitted:
+            self.num_omitted_files += 1
+        self.num_omitted += 1
+        self.file_omitted += 1
+        return False
+
+    def end_file(self):
+        self.write_spool("\n")
+        return self.file_shown, self.file_omitted
+
+    # Hands the spool file over to the caller, who becomes responsible for
+    # removing it
+    def detach_spool(self):
+        with self.lock:
+            if self.spool is None:
+                return None
+            self.spool.close()
+            self.spool = None
+            return self.spool_path
+
+    def close(self):
+        with self.lock:
+            if self.spool is not None:
+                self.spool.close()
+                self.spool = None
+                try:
+                    os.remove(self.spool_path)
+                except OSError:
+                    pass
+
 class SearchCtrl(wx.Panel):
     def __init__(self, parent, env):
         wx.Panel.__init__(self, parent)
         self.env = env
         self.max_line_length = 100
+        self.max_matches = 10000
+        self.max_file_matches = 1000
+        self.max_queue_size = 1024 * 1024
+        self.status_interval = 0.1
+        self.workers = 1
+        self.index = None
         self.finder = None
+        self.results = None
+        self.last_status_time = 0
 
-        self.output = ThreadOutputCtrl(self, env, auto_scroll=False)
+        self.output = ThreadOutputCtrl(self, env, auto_scroll=False, max_queue_size=self.max_queue_size)
 
         text_width, text_height = get_text_extent(self.GetFont(), "Copy to Editor")
         button_size = (text_width + 30, text_height + 10)
@@ -27,12 +110,15 @@ class SearchCtrl(wx.Panel):
         self.status_label = wx.StaticText(self)
         button_stop = wx.Button(self, label="&Stop", size=button_size)
         button_copy = wx.Button(self, label="&Copy to Editor", size=button_size)
+        button_show_all = wx.Button(self, label="Show &All", size=button_size)
         button_clear = wx.Button(self, label="C&lear", size=button_size)
         top_sizer = wx.BoxSizer(wx.HORIZONTAL)
         top_sizer.Add(button_stop, 0, wx.ALIGN_CENTER)
         top_sizer.AddSpacer(5)
         top_sizer.Add(button_copy, 0, wx.ALIGN_CENTER)
         top_sizer.AddSpacer(5)
+        top_sizer.Add(button_show_all, 0, wx.ALIGN_CENTER)
+        top_sizer.AddSpacer(5)
         top_sizer.Add(button_clear, 0, wx.ALIGN_CENTER)
         top_sizer.AddSpacer(5)
         top_sizer.Add(self.status_label, 0, wx.ALIGN_CENTER)
@@ -46,15 +132,20 @@ class SearchCtrl(wx.Panel):
 
         self.Bind(wx.EVT_BUTTON, self.OnStop, button_stop)
         self.Bind(wx.EVT_BUTTON, self.OnCopyToEditor, button_copy)
+        self.Bind(wx.EVT_BUTTON, self.OnShowAll, button_show_all)
         self.Bind(wx.EVT_BUTTON, self.OnClear, button_clear)
         self.Bind(wx.EVT_UPDATE_UI, self.OnUpdateStop, button_stop)
         self.Bind(wx.EVT_UPDATE_UI, self.OnUpdateClear, button_copy)
+        self.Bind(wx.EVT_UPDATE_UI, self.OnUpdateShowAll, button_show_all)
         self.Bind(wx.EVT_UPDATE_UI, self.OnUpdateClear, button_clear)
         self.output.Bind(wx.EVT_LEFT_DCLICK, self.OnLineDoubleClicked)
 
     def Destroy(self):
         if self.finder:
             self.finder.stop()
+        self.output.stop()
+        if self.results:
+            self.results.close()
         wx.Panel.Destroy(self)
 
     def OnStop(self, evt):
@@ -67,6 +158,9 @@ class SearchCtrl(wx.Panel):
     def Clear(self):
         self.output.ClearAll()
         self.env.clear_highlight(MARKER_FIND)
+        if self.results and not self.finder:
+            self.results.close()
+            self.results = None
 
     def OnClear(self, evt):
         self.Clear()
@@ -77,6 +171,16 @@ class SearchCtrl(wx.Panel):
     def OnUpdateClear(self, evt):
         evt.Enable(not self.output.IsEmpty())
 
+    def OnShowAll(self, evt):
+        if self.results and not self.finder:
+            path = self.results.detach_spool()
+            if path:
+                self.env.open_temporary_file("Search Results", path)
+
+    def OnUpdateShowAll(self, evt):
+        evt.Enable(bool(self.results and self.results.capped and self.results.spool
+                        and not self.finder))
+
     def OnLineDoubleClicked(self, evt):
         cur_line = mark_line = self.output.GetCurrentLine()
 
@@ -144,8 +248,16 @@ class SearchCtrl(wx.Panel):
 
         self.start_time = time.time()
         self.details = details
-        self.finder = Search(details.path, matcher, output=self, file_filter=file_filter, dir_filter=dir_filter)
-        async_call(self.finder.search)
+        if self.results:
+            self.results.close()
+        self.results = SearchResults(self.max_matches, self.max_file_matches)
+        # The index only covers files which are visible without details.hidden
+        index = self.index if not details.hidden else None
+        ignore = IgnoreRules() if not details.hidden else None
+        self.finder = make_search(details.path, matcher, output=self,
+            file_filter=file_filter, dir_filter=dir_filter, index=index, ignore=ignore,
+            workers=self.workers)
+        async_call_priority(PRIORITY_BULK, self.finder.search)
         self.Clear()
         self.output.start()
 
@@ -157,18 +269,28 @@ class SearchCtrl(wx.Panel):
             pass
 
     def begin_file(self, finder, filepath):
-        wx.CallAfter(self.__set_status, finder, filepath)
+        now = time.time()
+        if now - self.last_status_time >= self.status_interval:
+            self.last_status_time = now
+            wx.CallAfter(self.__set_status, finder, filepath)
 
     def add_file(self, finder, filepath):
-        self.output.write(filepath + "\n")
+        if finder is self.finder and self.results.add_file(filepath):
+            self.output.write(filepath + "\n")
 
     def add_line(self, finder, line_num, line):
-        if len(line) > self.max_line_length:
-            line = line[:self.max_line_length] + "..."
-        self.output.write(" %5d: %s\n" % (line_num, line))
+        if finder is self.finder and self.results.add_line(line_num, line):
+            if len(line) > self.max_line_length:
+                line = line[:self.max_line_length] + "..."
+            self.output.write(" %5d: %s\n" % (line_num, line))
 
     def end_file(self, finder):
-        self.output.write("\n")
+        if finder is self.finder:
+            shown, num_omitted = self.results.end_file()
+            if shown:
+                if num_omitted:
+                    self.output.write("        ... %d more matches in this file\n" % num_omitted)
+                self.output.write("\n")
 
     def __do_finish(self, finder):
         try:
@@ -183,6 +305,10 @@ class SearchCtrl(wx.Panel):
     def finish(self, finder, message):
         completed_time = time.time() - self.start_time
         if finder is self.finder:
+            results = self.results
+            if results.capped:
+                self.output.write("%d more matches in %d files (click Show All to see every match)\n\n"
+                                  % (results.num_omitted, results.num_omitted_files))
             self.output.write(message % (self.details.find, self.details.path, completed_time))
         wx.CallAfter(self.__do_finish, finder)
 
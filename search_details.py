@@ -0,0 +1,36 @@
+class SearchDetails(object):
+    def __init__(self, case=False, regexp=False, hidden=False, find="", find_history=(),
+                 file_patterns="*", path="", path_history=()):
+        self.case = case
+        self.regexp = regexp
+        self.hidden = hidden
+        self.find = find
+        self.find_history = find_history
+        self.file_patterns = file_patterns
+        self.path = path
+        self.path_history = path_history
+
+    def LoadPerspective(self, p):
+        try:
+            self.case = bool(p.get("case_sensitive", False))
+            self.regexp = bool(p.get("is_regex", False))
+            self.hidden = bool(p.get("hidden", False))
+            self.find = str(p.get("find", ""))
+            self.find_history = p.get("find_history", [])[:10]
+            self.file_patterns = str(p.get("file_patterns"))
+            self.path = str(p.get("path", ""))
+            self.path_history = p.get("path_history")[:10]
+        except Exception:
+            pass
+
+    def SavePerspective(self):
+        return {
+            "case_sensitive": self.case,
+            "is_regex": self.regexp,
+            "hidden": self.hidden,
+            "find": self.find,
+            "find_history": self.find_history[:],
+            "file_patterns": self.file_patterns,
+            "path": self.path,
+            "path_history": self.path_history[:],
+        }
@@ -0,0 +1,397 @@
+import os, stat, marshal, threading, string, array
+import fileutil
+from async import async_call_cpu
+from dirtree_filter import re_hidden_files, re_hidden_dirs
+from util import is_text_file
+
+# The index maps each trigram of the ASCII-lowercased file contents to the
+# files containing it. Queries intersect the postings of every trigram in the
+# pattern's required literals, giving a superset of the files which can match;
+# the matcher then confirms the matches against those files only.
+#
+# Files are only ever added to the index under a new id, so each posting is
+# a sorted array of ids, appended to as files are added. Ids of stale entries
+# are marked dead and filtered out of the postings when the index is saved.
+#
+# Files are kept up to date incrementally: the tree's monitor events and the
+# editor's saves are passed to update_paths. Those only cover the expanded
+# directories and the files written by the editor, so before each query the
+# index also checks the mtimes of the directories under the searched path,
+# and lists the changed ones again for added, removed and replaced entries.
+# Files edited in place elsewhere don't change their directory's mtime; they
+# are found by check_files, which runs in the background when the main
+# window is activated.
+
+INDEX_VERSION = 2
+
+lower_table = string.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+def get_trigrams(data):
+    data = data.translate(lower_table)
+    return set(data[i:i+3] for i in xrange(len(data) - 2))
+
+def get_literal_trigrams(literals):
+    trigrams = set()
+    for literal in literals:
+        trigrams.update(get_trigrams(literal))
+    return trigrams
+
+def path_sort_key(path):
+    return path.split(os.path.sep)
+
+# Returns the file's trigrams joined into one string, which is much cheaper
+# to pickle than a set, or False for files which can't be read.
+def read_file_trigrams(path):
+    try:
+        if is_text_file(path):
+            return "".join(get_trigrams(fileutil.read_file(path)))
+        return ""
+    except EnvironmentError:
+        return False
+
+def read_files_trigrams(paths):
+    return [read_file_trigrams(path) for path in paths]
+
+# Extracting the trigrams is pure Python and holds the GIL, stalling the main
+# thread while a project is indexed, so SearchIndex can be given this to do
+# it on the scheduler's worker processes instead. Chunks which fail (e.g. if
+# a worker dies) are done in this process.
+def read_files_trigrams_cpu(paths, chunk_size=16):
+    chunks = [paths[i:i+chunk_size] for i in xrange(0, len(paths), chunk_size)]
+    futures = [async_call_cpu(read_files_trigrams, chunk) for chunk in chunks]
+    results = []
+    for chunk, future in zip(chunks, futures):
+        try:
+            results.extend(future.wait())
+        except Exception:
+            results.extend(read_files_trigrams(chunk))
+    return results
+
+class SearchIndex(object):
+    def __init__(self, filename, root, max_file_size=8*1024*1024, read_trigrams=read_files_trigrams):
+        self.filename = filename
+        self.root = root
+        self.max_file_size = max_file_size
+        self.read_trigrams = read_trigrams
+        self.batch_size = 256
+        self.ready = False
+        self.dirty = False
+        self.checking_files = False
+        self.quit = False
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.file_ids = {}
+        self.paths = []
+        self.stamps = []
+        self.postings = {}
+        self.large_files = set()
+        self.dir_stamps = {}
+
+    def _remove_file(self, path):
+        file_id = self.file_ids.pop(path, None)
+        if file_id is not None:
+            self.paths[file_id] = None
+            self.large_files.discard(file_id)
+            self.dirty = True
+
+    def _add_file(self, path, stamp, trigrams):
+        self._remove_file(path)
+        file_id = len(self.paths)
+        self.file_ids[path] = file_id
+        self.paths.append(path)
+        self.stamps.append(stamp)
+        if trigrams is None:
+            self.large_files.add(file_id)
+        else:
+            postings = self.postings
+            for i in xrange(0, len(trigrams), 3):
+                trigram = trigrams[i:i+3]
+                file_ids = postings.get(trigram)
+                if file_ids is None:
+                    postings[trigram] = array.array("i", [file_id])
+                else:
+                    file_ids.append(file_id)
+        self.dirty = True
+
+    # Changed files are read in batches, which are flushed when they are
+    # full and by whoever started the batch once it is done.
+    def _index_file(self, path, st, batch):
+        stamp = (st.st_mtime, st.st_size)
+        with self.lock:
+            file_id = self.file_ids.get(path)
+            if file_id is not None and self.stamps[file_id] == stamp:
+                return
+            if st.st_size > self.max_file_size:
+                self._add_file(path, stamp, None)
+                return
+        batch.append((path, stamp))
+        if len(batch) >= self.batch_size:
+            self._flush(batch)
+
+    def _flush(self, batch):
+        if not batch:
+            return
+        results = self.read_trigrams([path for path, stamp in batch])
+        with self.lock:
+            for (path, stamp), trigrams in zip(batch, results):
+                if trigrams is not False:
+                    self._add_file(path, stamp, trigrams)
+        del batch[:]
+
+    def _is_hidden(self, dirpath, name, is_dir):
+        if fileutil.is_hidden_file(os.path.join(dirpath, name)):
+            return True
+        return bool((re_hidden_dirs if is_dir else re_hidden_files).match(name))
+
+    # Indexes the files under dirpath, adding the paths of the directories and
+    # files found to seen. The directory is stat'ed before it is listed, so a
+    # change made while listing it shows up as a changed mtime later on.
+    def _scan_dir(self, dirpath, seen, batch):
+        try:
+            mtime = os.stat(dirpath).st_mtime
+            names = os.listdir(dirpath)
+        except EnvironmentError:
+            return
+        with self.lock:
+            self.dir_stamps[dirpath] = mtime
+        seen.add(dirpath)
+        for name in names:
+            if self.quit:
+                return
+            path = os.path.join(dirpath, name)
+            try:
+                st = os.stat(path)
+                if stat.S_ISDIR(st.st_mode):
+                    if not (os.path.islink(path) or self._is_hidden(dirpath, name, True)):
+                        self._scan_dir(path, seen, batch)
+                elif stat.S_ISREG(st.st_mode):
+                    if not self._is_hidden(dirpath, name, False):
+                        self._index_file(path, st, batch)
+                        seen.add(path)
+            except EnvironmentError:
+                pass
+
+    # Lists a directory whose mtime has changed again. Its files are indexed
+    # again if they have changed, and only new subdirectories are scanned, as
+    # the existing ones are checked against their own mtimes.
+    def _rescan_dir(self, dirpath, seen, batch):
+        try:
+            mtime = os.stat(dirpath).st_mtime
+            names = os.listdir(dirpath)
+        except EnvironmentError:
+            return
+        with self.lock:
+            self.dir_stamps[dirpath] = mtime
+        seen.add(dirpath)
+        for name in names:
+            if self.quit:
+                return
+            path = os.path.join(dirpath, name)
+            try:
+                st = os.stat(path)
+                if stat.S_ISDIR(st.st_mode):
+                    if not (os.path.islink(path) or self._is_hidden(dirpath, name, True)):
+                        with self.lock:
+                            known = path in self.dir_stamps
+                        if known:
+                            seen.add(path)
+                        else:
+                            self._scan_dir(path, seen, batch)
+                elif stat.S_ISREG(st.st_mode):
+                    if not self._is_hidden(dirpath, name, False):
+                        self._index_file(path, st, batch)
+                        seen.add(path)
+            except EnvironmentError:
+                pass
+
+    def _remove_unseen(self, seen, is_scanned):
+        with self.lock:
+            for path in [x for x in self.file_ids if x not in seen and is_scanned(x)]:
+                self._remove_file(path)
+            for dirpath in [x for x in self.dir_stamps if x not in seen and is_scanned(x)]:
+                del self.dir_stamps[dirpath]
+
+    def refresh(self):
+        seen = set()
+        batch = []
+        self._scan_dir(self.root, seen, batch)
+        if self.quit:
+            return
+        self._flush(batch)
+        self._remove_unseen(seen, lambda path: True)
+        with self.lock:
+            self.ready = True
+
+    # Brings the directories under path up to date, checking only their
+    # mtimes. Returns False if that isn't possible, in which case the caller
+    # should walk the files itself.
+    def verify(self, path):
+        prefix = path + os.path.sep
+        with self.lock:
+            if path not in self.dir_stamps:
+                return False
+            dirs = [(x, mtime) for x, mtime in self.dir_stamps.iteritems()
+                    if x == path or x.startswith(prefix)]
+
+        seen = set()
+        rescanned = set()
+        removed = set()
+        batch = []
+        for dirpath, mtime in dirs:
+            if self.quit:
+                return False
+            try:
+                if os.stat(dirpath).st_mtime != mtime:
+                    rescanned.add(dirpath)
+                    self._rescan_dir(dirpath, seen, batch)
+            except OSError:
+                removed.add(dirpath)
+        self._flush(batch)
+
+        if rescanned or removed:
+            # Entries of the rescanned directories which weren't listed again
+            # are gone, along with everything under a directory which is gone
+            def is_removed(x):
+                if x in seen:
+                    return False
+                if os.path.dirname(x) in rescanned:
+                    return True
+                while True:
+                    if x in removed:
+                        return True
+                    parent = os.path.dirname(x)
+                    if parent == x:
+                        return False
+                    x = parent
+            self._remove_unseen(seen, is_removed)
+        return not self.quit
+
+    # Indexes the files which have changed since they were indexed, and
+    # removes the ones which are gone.
+    def check_files(self):
+        with self.lock:
+            if self.checking_files or not self.ready:
+                return
+            self.checking_files = True
+            paths = list(self.file_ids)
+        try:
+            batch = []
+            for path in paths:
+                if self.quit:
+                    return
+                try:
+                    self._index_file(path, os.stat(path), batch)
+                except EnvironmentError:
+                    with self.lock:
+                        self._remove_file(path)
+            self._flush(batch)
+        finally:
+            self.checking_files = False
+
+    def update_paths(self, paths):
+        batch = []
+        self._update_paths(paths, batch)
+        self._flush(batch)
+
+    def _update_paths(self, paths, batch):
+        for path in paths:
+            if self.quit:
+                return
+            if not path.startswith(self.root + os.path.sep):
+                continue
+            try:
+                st = os.stat(path)
+                dirpath, name = os.path.split(path)
+                if stat.S_ISREG(st.st_mode):
+                    if not self._is_hidden(dirpath, name, False):
+                        self._index_file(path, st, batch)
+                elif stat.S_ISDIR(st.st_mode):
+                    if not self._is_hidden(dirpath, name, True):
+                        self._update_paths([os.path.join(path, x) for x in os.listdir(path)], batch)
+            except EnvironmentError:
+                with self.lock:
+                    self._remove_file(path)
+
+    def load(self):
+        with open(self.filename, "rb") as f:
+            version, root, paths, stamps, postings, large_files = marshal.load(f)
+        if version != INDEX_VERSION or root != self.root:
+            return False
+        for trigram, file_ids in postings.iteritems():
+            postings[trigram] = array.array("i", file_ids)
+        with self.lock:
+            self.file_ids = dict((path, file_id) for file_id, path in enumerate(paths))
+            self.paths = paths
+            self.stamps = stamps
+            self.postings = postings
+            self.large_files = large_files
+            self.dir_stamps = {}
+            self.dirty = False
+        return True
+
+    def open(self):
+        try:
+            self.load()
+        except Exception:
+            self.clear()
+        self.refresh()
+        self.save()
+
+    def _compact(self):
+        live_ids = {}
+        paths = []
+        stamps = []
+        for file_id, path in enumerate(self.paths):
+            if path is not None:
+                live_ids[file_id] = len(paths)
+                paths.append(path)
+                stamps.append(self.stamps[file_id])
+        # Ids are renumbered in order, so the postings stay sorted
+        postings = {}
+        for trigram, file_ids in self.postings.iteritems():
+            file_ids = array.array("i", (live_ids[x] for x in file_ids if x in live_ids))
+            if file_ids:
+                postings[trigram] = file_ids
+        large_files = set(live_ids[x] for x in self.large_files if x in live_ids)
+        self.file_ids = dict((path, file_id) for file_id, path in enumerate(paths))
+        self.paths = paths
+        self.stamps = stamps
+        self.postings = postings
+        self.large_files = large_files
+
+    def save(self):
+        with self.lock:
+            if not (self.ready and self.dirty):
+                return
+            self._compact()
+            postings = dict((trigram, file_ids.tostring()) for trigram, file_ids in self.postings.iteritems())
+            data = marshal.dumps((INDEX_VERSION, self.root, self.paths, self.stamps,
+                                  postings, self.large_files))
+            self.dirty = False
+        fileutil.atomic_write_file(self.filename, data)
+
+    def close(self):
+        self.quit = True
+
+    def covers(self, path):
+        return self.ready and (path == self.root or path.startswith(self.root + os.path.sep))
+
+    def find_candidates(self, literals, path):
+        trigrams = get_literal_trigrams(literals)
+        if not trigrams or not self.covers(path) or not self.verify(path):
+            return None
+        with self.lock:
+            postings = sorted((self.postings.get(trigram, ()) for trigram in trigrams), key=len)
+            file_ids = set(postings[0])
+            for other in postings[1:]:
+                if not file_ids:
+                    break
+                file_ids.intersection_update(other)
+            file_ids.update(self.large_files)
+            paths = [self.paths[file_id] for file_id in file_ids]
+        prefix = path + os.path.sep
+        paths = [x for x in paths if x is not None and (x == path or x.startswith(prefix))]
+        paths.sort(key=path_sort_key)
+        return paths
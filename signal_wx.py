@@ -4,11 +4,20 @@ import threading
 import traceback
 import inspect
 import weakref
+import async
+
+# A coalescing signal collapses emissions made before the pending one is
+# dispatched into a single call. The call gets the latest arguments, or, if a
+# merge function is given, merge((args, kwargs), (new_args, new_kwargs)).
 
 class Signal(object):
-    def __init__(self, owner=None):
+    def __init__(self, owner=None, coalesce=False, merge=None):
         self.__lock = threading.Lock()
         self.__handlers = []
+        self.__coalesce = coalesce or merge is not None
+        self.__merge = merge
+        self.__pending_lock = threading.Lock()
+        self.__pending = None
         if isinstance(owner, wx.Window):
             owner.Bind(wx.EVT_WINDOW_DESTROY, lambda evt: self.destroy())
         elif owner is not None:
@@ -17,7 +26,31 @@ class Signal(object):
     def signal(self, *args, **kwargs):
         if self.__lock is None:
             return
-        wx.CallAfter(self.__dosignal, *args, **kwargs)
+        if self.__coalesce:
+            with self.__pending_lock:
+                if self.__pending is not None:
+                    if self.__merge is not None:
+                        self.__pending = self.__merge(self.__pending, (args, kwargs))
+                    else:
+                        self.__pending = (args, kwargs)
+                    return
+                self.__pending = (args, kwargs)
+            self.__post(self.__dopending)
+        else:
+            self.__post(self.__dosignal, *args, **kwargs)
+
+    def __post(self, func, *args, **kwargs):
+        scheduler = async.get_scheduler()
+        if scheduler is not None:
+            scheduler.post_call(func, *args, **kwargs)
+        else:
+            wx.CallAfter(func, *args, **kwargs)
+
+    def __dopending(self):
+        with self.__pending_lock:
+            args, kwargs = self.__pending
+            self.__pending = None
+        self.__dosignal(*args, **kwargs)
 
     def __dosignal(self, *args, **kwargs):
         if self.__lock is None:
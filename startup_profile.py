@@ -0,0 +1,56 @@
+import time
+from contextlib import contextmanager
+
+# Wall clock timings of the startup phases, enabled with --profile-startup.
+# Phases may be nested, and are written out in the order they started,
+# indented by depth, once startup has finished.
+
+class StartupProfile(object):
+    def __init__(self, start_time):
+        self.start_time = start_time
+        self.phases = []
+        self.depth = 0
+
+    def add(self, name, start, end):
+        self.phases.append((start, self.depth, name, end - start))
+
+    @contextmanager
+    def phase(self, name):
+        start = time.time()
+        self.depth += 1
+        try:
+            yield
+        finally:
+            self.depth -= 1
+            self.add(name, start, time.time())
+
+    def format(self):
+        lines = ["%-40s %10s %10s" % ("Phase", "Start", "Duration")]
+        for start, depth, name, duration in sorted(self.phases):
+            lines.append("%-40s %9.1fms %9.1fms" % (
+                "  " * depth + name, (start - self.start_time) * 1000, duration * 1000))
+        lines.append("%-40s %10s %9.1fms" % ("Total", "", (time.time() - self.start_time) * 1000))
+        return "\n".join(lines) + "\n"
+
+_profile = None
+
+def start_startup_profile(start_time):
+    global _profile
+    _profile = StartupProfile(start_time)
+    return _profile
+
+@contextmanager
+def _no_phase():
+    yield
+
+def startup_phase(name):
+    if _profile:
+        return _profile.phase(name)
+    return _no_phase()
+
+def finish_startup_profile(filename):
+    global _profile
+    if _profile:
+        profile, _profile = _profile, None
+        with open(filename, "w") as f:
+            f.write(profile.format())
@@ -6,8 +6,7 @@ import wx
 import wx.stc
 from contextlib import contextmanager
 
-from find_replace_dialog import FindReplaceDetails, FindReplaceDialog
-from go_to_line_dialog import GoToLineDialog
+from line_lengths import LineLengths
 from menu_defs import edit_menu
 from syntax import syntax_from_filename, syntax_plain
 from themes import default_theme
@@ -27,6 +26,9 @@ default_styles = [
 
 brace_chars = "[]{}()"
 
+# Splits text into lines, keeping their line ends
+line_end_keep_re = re.compile(r"[^\r\n]*(?:\r\n|\r|\n)|[^\r\n]*$")
+
 class StyledTextCtrl(wx.stc.StyledTextCtrl):
     name = ""
 
@@ -37,9 +39,13 @@ class StyledTextCtrl(wx.stc.StyledTextCtrl):
         self.SetSyntax(syntax_plain)
         self.SetScrollWidth(1)
         #self.SetScrollWidthTracking(True)
+        self.__line_lengths = LineLengths()
+        self.__scroll_width = 1
+        self.large_file_mode = False
 
         self.Bind(wx.EVT_KEY_DOWN, self.__OnKeyDown)
         self.Bind(wx.EVT_CONTEXT_MENU, self.__OnContextMenu)
+        self.Bind(wx.stc.EVT_STC_MODIFIED, self.__OnModified)
         self.Bind(wx.stc.EVT_STC_CHANGE, self.__OnChange)
         self.Bind(wx.stc.EVT_STC_UPDATEUI, self.__OnUpdateUI)
 
@@ -59,12 +65,48 @@ class StyledTextCtrl(wx.stc.StyledTextCtrl):
         self.SetFocus()
         self.PopupMenu(edit_menu.Create(hooks={"edit": self.GetDyanmicEditMenuItems()}))
 
+    def __GetLineLengths(self, first, last):
+        if last - first < 64 or self.GetEOLMode() == wx.stc.STC_EOL_CR:
+            return [self.LineLength(line) for line in xrange(first, last + 1)]
+        # Splitting the text is much faster for large insertions, like SetText
+        text = self.GetTextRangeRaw(self.PositionFromLine(first), self.PositionFromLine(last + 1))
+        if "\r" in text:
+            # A lone CR also ends a line, as in files with mixed line ends
+            lengths = [len(line) for line in line_end_keep_re.findall(text)]
+        else:
+            lengths = [len(line) + 1 for line in text.split("\n")]
+            lengths[-1] -= 1
+        if len(lengths) > last - first + 1:
+            lengths.pop()
+        return lengths
+
+    # Keeps the line lengths up to date from the modified lines only.
+    def __OnModified(self, evt):
+        if not self.large_file_mode and evt.GetModificationType() & (wx.stc.STC_MOD_INSERTTEXT | wx.stc.STC_MOD_DELETETEXT):
+            first = self.LineFromPosition(evt.GetPosition())
+            lines_added = evt.GetLinesAdded()
+            if lines_added >= 0:
+                lengths = self.__GetLineLengths(first, first + lines_added)
+                self.__line_lengths.replace(first, first + 1, lengths)
+            else:
+                self.__line_lengths.replace(first, first + 1 - lines_added, [self.LineLength(first)])
+        evt.Skip()
+
     def __OnChange(self, evt):
+        if not self.large_file_mode:
+            self.__UpdateScrollWidth()
+
+    def __UpdateScrollWidth(self):
         # Assumes that all styles use the same fixed-width font.
-        max_len = max(self.LineLength(line) for line in xrange(self.GetLineCount()))
-        self.SetScrollWidth((max_len + 1) * self.TextWidth(wx.stc.STC_STYLE_DEFAULT, "_"))
+        max_len = self.__line_lengths.max_length
+        width = (max_len + 1) * self.TextWidth(wx.stc.STC_STYLE_DEFAULT, "_")
+        if width != self.__scroll_width:
+            self.__scroll_width = width
+            self.SetScrollWidth(width)
 
     def __OnUpdateUI(self, evt):
+        if self.large_file_mode:
+            return
         if self.HasSelection():
             self.BraceHighlight(-1, -1)
             return
@@ -86,9 +128,11 @@ class StyledTextCtrl(wx.stc.StyledTextCtrl):
             font.Weight == wx.FONTWEIGHT_BOLD,
             font.Style in (wx.FONTSTYLE_ITALIC, wx.FONTSTYLE_SLANT), False)
 
+        syntax = syntax_plain if self.large_file_mode else self.syntax
+
         self.ClearDocumentStyle()
-        self.SetLexer(self.syntax.lexer)
-        self.SetKeyWords(0, self.syntax.keywords)
+        self.SetLexer(syntax.lexer)
+        self.SetKeyWords(0, syntax.keywords)
         self.StyleResetDefault()
         self.StyleSetFontAttr(wx.stc.STC_STYLE_DEFAULT, *font_info)
         self.StyleSetSpec(wx.stc.STC_STYLE_DEFAULT, "")
@@ -103,13 +147,32 @@ class StyledTextCtrl(wx.stc.StyledTextCtrl):
         for token_type, style_spec in default_styles:
             self.StyleSetSpec(token_type, style_spec)
 
-        for token_type, style_spec in self.syntax.get_style_specs(default_theme):
+        for token_type, style_spec in syntax.get_style_specs(default_theme):
             self.StyleSetSpec(token_type, style_spec)
 
-        self.SetIndent(self.syntax.indent_width)
-        self.SetTabWidth(self.syntax.tab_width)
-        self.SetUseTabs(self.syntax.use_tabs)
-        self.Colourise(0, -1)
+        self.SetIndent(syntax.indent_width)
+        self.SetTabWidth(syntax.tab_width)
+        self.SetUseTabs(syntax.use_tabs)
+        if not self.large_file_mode:
+            self.Colourise(0, -1)
+
+    # For very large files, lexing, brace matching, line length tracking and
+    # undo are turned off. Scintilla widens the scroll width itself, as the
+    # lines are drawn.
+    def SetLargeFileMode(self, large_file_mode):
+        if large_file_mode == self.large_file_mode:
+            return
+        self.large_file_mode = large_file_mode
+        self.SetUndoCollection(not large_file_mode)
+        self.SetScrollWidthTracking(large_file_mode)
+        if large_file_mode:
+            self.EmptyUndoBuffer()
+            self.BraceHighlight(-1, -1)
+        else:
+            self.__line_lengths.reset(self.__GetLineLengths(0, self.GetLineCount() - 1))
+            self.__scroll_width = None
+            self.__UpdateScrollWidth()
+        self.RefreshStyle()
 
     def SetSyntax(self, syntax):
         self.syntax = syntax
@@ -365,6 +428,7 @@ class StyledTextCtrl(wx.stc.StyledTextCtrl):
             find_details.regexp = False
             find_details.reverse = False
 
+        from find_replace_dialog import FindReplaceDialog
         dlg = FindReplaceDialog(self, self.name, find_details)
         try:
             dlg.ShowModal()
@@ -384,6 +448,7 @@ class StyledTextCtrl(wx.stc.StyledTextCtrl):
             self.env.find_details.Find(self, reverse=True)
 
     def GoToLine(self):
+        from go_to_line_dialog import GoToLineDialog
         dlg = GoToLineDialog(self, self.name, self.GetCurrentLine() + 1)
         try:
             if dlg.ShowModal() == wx.ID_OK:
@@ -2,7 +2,6 @@ import os.path
 import re
 from wx import stc
 
-from lexer_token_map import lexer_token_map
 from util import compile_file_patterns
 
 class Syntax(object):
@@ -17,11 +16,19 @@ class Syntax(object):
         self.tab_width = tab_width
         self.use_tabs = use_tabs
         self.keywords = keywords
-        file_patterns_list = file_patterns.split(";")
-        file_patterns = ";".join(file_patterns_list + [ext + ".in" for ext in file_patterns_list])
-        self.file_regex = compile_file_patterns(file_patterns)
+        self._file_regex = None
+
+    # Compiled on first use, so importing this module at startup is cheap
+    @property
+    def file_regex(self):
+        if self._file_regex is None:
+            file_patterns_list = self.file_patterns.split(";")
+            file_patterns = ";".join(file_patterns_list + [ext + ".in" for ext in file_patterns_list])
+            self._file_regex = compile_file_patterns(file_patterns)
+        return self._file_regex
 
     def get_style_specs(self, theme):
+        from lexer_token_map import lexer_token_map
         if self.lexer in lexer_token_map:
             token_map = lexer_token_map[self.lexer]
             for token_type_name, style_spec in theme:
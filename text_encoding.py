@@ -0,0 +1,111 @@
+import os, codecs, threading, collections
+
+# Picks the encoding of a text file once, from its BOM or by incrementally
+# decoding a bounded prefix as UTF-8, rather than decoding the whole file and
+# decoding it all again when that fails. Files which aren't UTF-8 are taken
+# to be ISO-8859-1, which can decode anything.
+#
+# The encoding of each file is cached along with its size and mtime, for as
+# long as the file is unchanged. The least recently used entries are dropped
+# when the cache is full.
+
+SNIFF_SIZE = 64 * 1024
+MAX_CACHE_ENTRIES = 10000
+
+FALLBACK_ENCODING = "iso-8859-1"
+
+# UTF-32 BOMs start with the UTF-16 ones, so they are checked first
+boms = [
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+]
+
+def detect_encoding(data, final=False):
+    for bom, encoding in boms:
+        if data.startswith(bom):
+            return encoding
+    try:
+        # Not final, unless data is the whole file, so a multi-byte
+        # character cut off at the end of the prefix isn't an error
+        codecs.getincrementaldecoder("utf-8")().decode(data, final)
+    except UnicodeDecodeError:
+        return FALLBACK_ENCODING
+    return "utf-8"
+
+def decode_text(data, encoding):
+    try:
+        return data.decode(encoding), encoding
+    except UnicodeDecodeError:
+        return data.decode(FALLBACK_ENCODING), FALLBACK_ENCODING
+
+_cache_lock = threading.Lock()
+_cache = collections.OrderedDict()
+
+def _get_cached(path, st):
+    with _cache_lock:
+        entry = _cache.pop(path, None)
+        if entry is None:
+            return None
+        _cache[path] = entry
+    if entry[0] == st.st_size and entry[1] == st.st_mtime:
+        return entry[2]
+
+def _set_cached(path, st, encoding):
+    with _cache_lock:
+        _cache.pop(path, None)
+        _cache[path] = (st.st_size, st.st_mtime, encoding)
+        if len(_cache) > MAX_CACHE_ENTRIES:
+            _cache.popitem(last=False)
+
+def get_file_encoding(path):
+    st = os.stat(path)
+    encoding = _get_cached(path, st)
+    if encoding is None:
+        with open(path, "rb") as f:
+            data = f.read(SNIFF_SIZE)
+        encoding = detect_encoding(data, len(data) >= st.st_size)
+        _set_cached(path, st, encoding)
+    return encoding
+
+# Like get_file_encoding, for a file whose start has already been read (or
+# mapped) by the caller, so it isn't read again.
+def get_data_encoding(path, st, data):
+    encoding = _get_cached(path, st)
+    if encoding is None:
+        encoding = detect_encoding(data[:SNIFF_SIZE], st.st_size <= SNIFF_SIZE)
+        _set_cached(path, st, encoding)
+    return encoding
+
+# Records the encoding actually used for a file, when decoding it with the
+# detected encoding failed past the sniffed prefix.
+def set_file_encoding(path, encoding):
+    try:
+        _set_cached(path, os.stat(path), encoding)
+    except OSError:
+        pass
+
+# Lets the encodings be shared with and gathered from worker processes
+def get_encoding_cache(paths):
+    with _cache_lock:
+        return dict((path, _cache[path]) for path in paths if path in _cache)
+
+def update_encoding_cache(entries):
+    with _cache_lock:
+        for path, entry in entries.iteritems():
+            _cache.pop(path, None)
+            _cache[path] = entry
+        while len(_cache) > MAX_CACHE_ENTRIES:
+            _cache.popitem(last=False)
+
+# Reads and decodes a whole file, returning the text and its encoding.
+def read_file_text(path):
+    with open(path, "rb") as f:
+        st = os.fstat(f.fileno())
+        data = f.read()
+    encoding = _get_cached(path, st) or detect_encoding(data[:SNIFF_SIZE], len(data) <= SNIFF_SIZE)
+    text, encoding = decode_text(data, encoding)
+    _set_cached(path, st, encoding)
+    return text, encoding
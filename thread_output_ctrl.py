@@ -3,13 +3,16 @@ import wx
 from styled_text_ctrl import StyledTextCtrl
 
 class ThreadOutputCtrl(StyledTextCtrl):
-    def __init__(self, parent, env, auto_scroll=False):
+    def __init__(self, parent, env, auto_scroll=False, max_queue_size=None):
         StyledTextCtrl.__init__(self, parent, env)
 
         self.auto_scroll = auto_scroll
+        self.max_queue_size = max_queue_size
 
-        self.__lock = threading.Lock()
+        self.__cond = threading.Condition()
         self.__queue = []
+        self.__queue_size = 0
+        self.__running = False
         self.__timer = wx.Timer(self)
 
         self.Bind(wx.EVT_TIMER, self.__OnTimer, self.__timer)
@@ -18,8 +21,10 @@ class ThreadOutputCtrl(StyledTextCtrl):
         self.flush()
 
     def flush(self):
-        with self.__lock:
+        with self.__cond:
             queue, self.__queue = self.__queue, []
+            self.__queue_size = 0
+            self.__cond.notify_all()
         lines = "".join(queue)
         if lines:
             with self.ModifyReadOnly():
@@ -30,16 +35,26 @@ class ThreadOutputCtrl(StyledTextCtrl):
 
     def start(self, interval=100):
         self.SetReadOnly(True)
+        with self.__cond:
+            self.__running = True
         self.__timer.Start(interval)
 
     def stop(self):
+        with self.__cond:
+            self.__running = False
+            self.__cond.notify_all()
         self.__timer.Stop()
         self.flush()
         self.SetReadOnly(False)
 
+    # Blocks writer threads while the queue is full, until the timer drains it.
     def write(self, s):
-        with self.__lock:
+        with self.__cond:
+            if self.max_queue_size is not None and not wx.Thread_IsMain():
+                while self.__running and self.__queue_size >= self.max_queue_size:
+                    self.__cond.wait(0.1)
             self.__queue.append(s)
+            self.__queue_size += len(s)
 
     def ClearAll(self):
         with self.ModifyReadOnly():
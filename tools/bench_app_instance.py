@@ -0,0 +1,100 @@
+#!/usr/bin/env python2
+# Time opening files through a running instance with the different ways of
+# calling it: a new connection per file (as when a script runs devo once per
+# file), one call per file on a persistent connection, pipelined calls, and
+# a single batched call.
+#
+# Usage: bench_app_instance.py [num_files]
+#
+# The instance runs in this process, with a handler which only records the
+# filenames, so the times are the IPC and main thread dispatch overhead.
+
+import sys, os, time, threading, Queue
+from multiprocessing.connection import Client
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+import async
+from app_instance import AppInstance, AppListener, make_instance_filename
+
+class MainThreadScheduler(async.Scheduler):
+    def __init__(self):
+        async.Scheduler.__init__(self, max_threads=1)
+        self.calls = Queue.Queue()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while True:
+            func, args, kwargs = self.calls.get()
+            func(*args, **kwargs)
+
+    def call(self, func, *args, **kwargs):
+        if threading.current_thread() is self.thread:
+            func(*args, **kwargs)
+        else:
+            self.post_call(func, *args, **kwargs)
+
+    def post_call(self, func, *args, **kwargs):
+        self.calls.put((func, args, kwargs))
+
+class Handler(object):
+    def __init__(self):
+        self.opened = []
+
+    def open_file(self, filename):
+        self.opened.append(filename)
+        return True
+
+    def open_files(self, filenames, cwd=""):
+        self.opened.extend(filenames)
+        return True
+
+def legacy_per_connection(address, filenames):
+    for filename in filenames:
+        client = Client(address)
+        client.send(("open_file", (filename,), {}))
+        client.recv()
+        client.close()
+
+def per_call(instance, filenames):
+    for filename in filenames:
+        instance.call("open_file", filename)
+
+def pipelined(instance, filenames):
+    request_ids = [instance.send("open_file", filename) for filename in filenames]
+    for request_id in request_ids:
+        instance.wait(request_id)
+
+def batched(instance, filenames):
+    instance.call("open_files", filenames)
+
+def main():
+    num_files = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    filenames = ["file%04d.txt" % i for i in xrange(num_files)]
+
+    async.set_scheduler(MainThreadScheduler())
+    handler = Handler()
+    listener = AppListener("devo-bench", handler)
+    try:
+        instance = AppInstance(make_instance_filename("devo-bench"))
+        print "%-24s %10s %14s" % ("Method", "Time", "Per file")
+        for label, func, arg in (
+                ("legacy, connect per file", legacy_per_connection, instance.address),
+                ("call per file", per_call, instance),
+                ("pipelined calls", pipelined, instance),
+                ("one batched call", batched, instance)):
+            del handler.opened[:]
+            start = time.time()
+            func(arg, filenames)
+            elapsed = time.time() - start
+            assert len(handler.opened) == num_files
+            print "%-24s %9.3fs %12.1fus" % (label, elapsed, elapsed / num_files * 1000000)
+        instance.close()
+    finally:
+        listener.shutdown()
+        async.shutdown_scheduler()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python2
+# Time util.is_text_file over a mixed corpus of text and binary files: the
+# original per-character regex count, the str.translate count with the cache
+# cleared before each pass, and repeat passes served from the cache.
+#
+# Usage: bench_is_text_file.py [num_files] [num_passes]
+
+import sys, os, time, random, shutil, tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+import util
+from util import non_printable_re
+
+def count_non_printable_regex(s):
+    count = 0
+    for c in s:
+        if non_printable_re.match(c):
+            count += 1
+    return count
+
+def is_text_file_regex(path):
+    with open(path, "rb") as f:
+        data = f.read(1024)
+    return not ("\0" in data or count_non_printable_regex(data) > len(data) // 6)
+
+source_line = "    def method(self, arg):  # comment with some\ttabs\n"
+
+def make_file(path, kind, rand):
+    if kind == "source":
+        data = source_line * rand.randrange(10, 200)
+    elif kind == "utf-8":
+        data = u"na\xefve caf\xe9 \u65e5\u672c\n".encode("utf-8") * rand.randrange(10, 200)
+    elif kind == "control":
+        # Text with escape codes, mostly printable
+        data = ("\x1b[1mbold\x1b[0m plain text\n") * rand.randrange(10, 200)
+    elif kind == "random":
+        data = "".join(chr(rand.randrange(256)) for i in xrange(4096))
+    else:
+        # Binary without NULs in the prefix, so every byte is classified
+        data = "".join(chr(rand.choice((1, 2, 3, 0x7f, 65, 66))) for i in xrange(2048))
+    with open(path, "wb") as f:
+        f.write(data)
+
+def time_passes(func, paths, num_passes, before_pass=None):
+    start = time.time()
+    for i in xrange(num_passes):
+        if before_pass:
+            before_pass()
+        for path in paths:
+            func(path)
+    return (time.time() - start) / (num_passes * len(paths))
+
+def clear_cache():
+    util._text_file_cache.clear()
+
+def main():
+    num_files = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    num_passes = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    rand = random.Random(0)
+    kinds = ["source", "utf-8", "control", "random", "binary"]
+    tmpdir = tempfile.mkdtemp()
+    try:
+        paths = []
+        for i in xrange(num_files):
+            path = os.path.join(tmpdir, "file%d" % i)
+            make_file(path, kinds[i % len(kinds)], rand)
+            paths.append(path)
+
+        for path in paths:
+            if is_text_file_regex(path) != util.is_text_file(path):
+                raise AssertionError("Verdicts differ for " + path)
+        num_text = sum(1 for path in paths if util.is_text_file(path))
+
+        regex_time = time_passes(is_text_file_regex, paths, num_passes)
+        translate_time = time_passes(util.is_text_file, paths, num_passes, clear_cache)
+        time_passes(util.is_text_file, paths, 1)
+        cached_time = time_passes(util.is_text_file, paths, num_passes)
+
+        print "Files: %d (%d text), passes: %d" % (num_files, num_text, num_passes)
+        print "%-12s %12s" % ("Method", "Per file")
+        print "%-12s %10.1fus" % ("regex", regex_time * 1000000)
+        print "%-12s %10.1fus" % ("translate", translate_time * 1000000)
+        print "%-12s %10.1fus" % ("cached", cached_time * 1000000)
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == "__main__":
+    main()
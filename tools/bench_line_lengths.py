@@ -0,0 +1,59 @@
+#!/usr/bin/env python2
+# Time the scroll width update done on every keystroke when typing into a
+# large document: the original scan of every line's length, against the
+# incremental line_lengths.LineLengths tracker.
+#
+# Usage: bench_line_lengths.py [num_lines] [num_keystrokes]
+#
+# The document is simulated with a list of line lengths, and LineLength is a
+# plain function standing in for the Scintilla call, which is slower through
+# wxPython, so the original scan is if anything faster here than in the editor.
+
+import sys, os, time, random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+from line_lengths import LineLengths
+
+def main():
+    num_lines = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    num_keys = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    random.seed(0)
+    lengths = [random.randrange(1, 100) for i in xrange(num_lines)]
+
+    def LineLength(line):
+        return lengths[line]
+
+    # Type at random places, with a newline every 20 keys
+    keys = [(random.randrange(num_lines // 2), i % 20 == 19) for i in xrange(num_keys)]
+
+    start = time.time()
+    for line, newline in keys:
+        if newline:
+            lengths[line:line + 1] = [1, lengths[line]]
+        else:
+            lengths[line] += 1
+        max(LineLength(line) for line in xrange(len(lengths)))
+    scan_time = (time.time() - start) / num_keys
+
+    random.seed(0)
+    lengths = [random.randrange(1, 100) for i in xrange(num_lines)]
+    tracker = LineLengths(lengths)
+    start = time.time()
+    for line, newline in keys:
+        if newline:
+            tracker.replace(line, line + 1, [1, LineLength(line)])
+            lengths[line:line + 1] = [1, lengths[line]]
+        else:
+            lengths[line] += 1
+            tracker.replace(line, line + 1, [LineLength(line)])
+        tracker.max_length
+    tracker_time = (time.time() - start) / num_keys
+
+    print "Lines: %d, keystrokes: %d" % (num_lines, num_keys)
+    print "%-12s %14s" % ("Method", "Per keystroke")
+    print "%-12s %12.3fms" % ("scan", scan_time * 1000)
+    print "%-12s %12.3fms" % ("incremental", tracker_time * 1000)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python2
+# Count the stat/access calls per directory entry made by the original
+# per-name get_file_info listing and by listing.list_dir, for the fields
+# used by the search walk and by the directory tree.
+#
+# Usage: bench_listing.py [directory]
+#
+# Without a directory, a synthetic directory of 50000 files is created.
+# Stat calls made inside scandir itself (only for symlinks, or on filesystems
+# which don't report d_type) are not counted.
+
+import sys, os, stat, time, shutil, tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+import listing
+
+counts = {}
+
+def counted(name):
+    func = getattr(os, name)
+    def wrapper(*args, **kwargs):
+        counts[name] = counts.get(name, 0) + 1
+        return func(*args, **kwargs)
+    return wrapper
+
+for name in ("stat", "lstat", "access"):
+    setattr(os, name, counted(name))
+
+def original_get_file_info(dirpath, filename):
+    path = os.path.join(dirpath, filename)
+    stat_result = os.stat(path)
+    hidden = filename.startswith(".")
+    if stat.S_ISDIR(stat_result.st_mode):
+        try:
+            listable = os.access(path, os.X_OK)
+        except OSError:
+            listable = False
+    else:
+        listable = False
+    return stat_result, listable, hidden
+
+def original_listing(dirpath, tree):
+    for filename in os.listdir(dirpath):
+        try:
+            original_get_file_info(dirpath, filename)
+        except OSError:
+            pass
+
+def new_listing(dirpath, tree):
+    for info in listing.list_dir(dirpath):
+        if tree:
+            if info.node_type:
+                info.hidden, info.listable
+        elif not info.hidden:
+            info.is_file or info.is_dir
+
+def run(func, dirpath, tree):
+    counts.clear()
+    start = time.time()
+    func(dirpath, tree)
+    return time.time() - start, sum(counts.values())
+
+def make_synthetic_dir(num_files=50000, num_dirs=500):
+    dirpath = tempfile.mkdtemp(prefix="bench_listing.")
+    for i in xrange(num_files):
+        open(os.path.join(dirpath, "file%05d.txt" % i), "w").close()
+    for i in xrange(num_dirs):
+        os.mkdir(os.path.join(dirpath, "dir%03d" % i))
+    return dirpath
+
+def main():
+    if len(sys.argv) > 1:
+        dirpath = sys.argv[1]
+        temp_dir = None
+    else:
+        dirpath = temp_dir = make_synthetic_dir()
+    try:
+        num_entries = len(os.listdir(dirpath))
+        print "Directory: %s (%d entries)" % (dirpath, num_entries)
+        print "scandir: %s" % ("available" if listing.scandir else "not available, using listdir")
+        print
+        print "%-10s %-8s %10s %10s %14s" % ("Listing", "Fields", "Time", "Calls", "Calls/entry")
+        for fields, tree in (("search", False), ("tree", True)):
+            for label, func in (("original", original_listing), ("listing", new_listing)):
+                elapsed, calls = run(func, dirpath, tree)
+                print "%-10s %-8s %9.3fs %10d %14.2f" % (
+                    label, fields, elapsed, calls, float(calls) / max(num_entries, 1))
+    finally:
+        if temp_dir:
+            shutil.rmtree(temp_dir)
+
+if __name__ == "__main__":
+    main()
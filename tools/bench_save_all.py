@@ -0,0 +1,67 @@
+#!/usr/bin/env python2
+# Time "save all files" for a set of modified editors: saving one file after
+# another, as before, against saving them all at once on a thread pool, for
+# each fsync policy. The last row saves again with nothing changed, which
+# only hashes the text and stats each file.
+#
+# Usage: bench_save_all.py [num_files] [file_kb] [num_threads] [dir]
+#
+# The files are written to a temporary directory under dir, which should be
+# on the disk being measured, as fsync costs vary widely between devices.
+
+import sys, os, time, shutil, tempfile
+from multiprocessing.pool import ThreadPool
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+from editor import write_text_file
+from fileutil import FSYNC_NONE, FSYNC_FILE, FSYNC_DIRECTORY, sync_directories
+
+def make_texts(num_files, file_kb):
+    line = u"    x = call(arg, other_arg)  # comment\n"
+    return [u"# file %d\n" % i + line * (file_kb * 1024 // len(line)) for i in xrange(num_files)]
+
+def save_serial(paths, texts, fsync):
+    for path, text in zip(paths, texts):
+        write_text_file(path, text, "utf-8", None, fsync)
+
+def save_concurrent(pool, paths, texts, fsync, saved_states=None):
+    if saved_states is None:
+        saved_states = [None] * len(paths)
+    file_fsync = FSYNC_FILE if fsync == FSYNC_DIRECTORY else fsync
+    results = [pool.apply_async(write_text_file, (path, text, "utf-8", state, file_fsync))
+               for path, text, state in zip(paths, texts, saved_states)]
+    states = [result.get()[1] for result in results]
+    if fsync == FSYNC_DIRECTORY:
+        sync_directories(paths)
+    return states
+
+def main():
+    num_files = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    file_kb = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    num_threads = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+    parent_dir = sys.argv[4] if len(sys.argv) > 4 else None
+    texts = make_texts(num_files, file_kb)
+    pool = ThreadPool(num_threads)
+    tmpdir = tempfile.mkdtemp(dir=parent_dir)
+    try:
+        paths = [os.path.join(tmpdir, "file%d.py" % i) for i in xrange(num_files)]
+        print "Files: %d x %dKB, threads: %d" % (num_files, file_kb, num_threads)
+        print "%-10s %12s %12s" % ("fsync", "serial", "concurrent")
+        for fsync in (FSYNC_NONE, FSYNC_FILE, FSYNC_DIRECTORY):
+            start = time.time()
+            save_serial(paths, texts, fsync)
+            serial_time = time.time() - start
+            start = time.time()
+            states = save_concurrent(pool, paths, texts, fsync)
+            concurrent_time = time.time() - start
+            print "%-10s %10.1fms %10.1fms" % (fsync, serial_time * 1000, concurrent_time * 1000)
+        start = time.time()
+        save_concurrent(pool, paths, texts, FSYNC_DIRECTORY, states)
+        print "%-10s %12s %10.1fms" % ("unchanged", "", (time.time() - start) * 1000)
+    finally:
+        pool.close()
+        shutil.rmtree(tmpdir)
+
+if __name__ == "__main__":
+    main()
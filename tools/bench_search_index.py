@@ -0,0 +1,58 @@
+#!/usr/bin/env python2
+# Time indexing a directory for search with the trigrams extracted on the
+# indexing thread and on the scheduler's process pool, and check that both
+# give the same index.
+#
+# Usage: bench_search_index.py [directory]
+#
+# The main process CPU time is the time the indexing spends holding the GIL,
+# which is what stalls the main thread in the application.
+
+import sys, os, time, tempfile, shutil, resource
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+import async
+from search_index import SearchIndex, read_files_trigrams, read_files_trigrams_cpu
+from bench_app_instance import MainThreadScheduler
+
+def get_cpu_time():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_utime
+
+def index_contents(index):
+    contents = {}
+    for trigram, file_ids in index.postings.iteritems():
+        for file_id in file_ids:
+            path = index.paths[file_id]
+            if path is not None:
+                contents.setdefault(path, set()).add(trigram)
+    return contents, set(index.paths[x] for x in index.large_files)
+
+def main():
+    root = os.path.realpath(sys.argv[1] if len(sys.argv) > 1 else
+                            os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+    async.set_scheduler(MainThreadScheduler())
+    tmpdir = tempfile.mkdtemp()
+    try:
+        results = []
+        for name, read_trigrams in (("thread", read_files_trigrams), ("process", read_files_trigrams_cpu)):
+            index = SearchIndex(os.path.join(tmpdir, name), root, read_trigrams=read_trigrams)
+            start_cpu = get_cpu_time()
+            start = time.time()
+            index.refresh()
+            elapsed = time.time() - start
+            cpu = get_cpu_time() - start_cpu
+            print "%-8s %d files, %.2fs, main process CPU %.2fs" % (
+                name, len(index.file_ids), elapsed, cpu)
+            results.append(index_contents(index))
+    finally:
+        async.get_scheduler().shutdown()
+        shutil.rmtree(tmpdir)
+    if results[0] != results[1]:
+        print "FAIL: the indexes differ"
+        return 1
+    print "OK: the indexes are the same"
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
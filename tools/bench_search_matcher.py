@@ -0,0 +1,90 @@
+#!/usr/bin/env python2
+# Compare the line matchers built by search.make_matcher against the
+# original "^.*" regexp matcher over a large corpus of lines.
+#
+# Usage: bench_search_matcher.py [corpus directory]
+#
+# Without a directory, a synthetic corpus of ~1 million lines is used.
+
+import sys, os, re, random, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+from search import make_matcher
+
+queries = [
+    # pattern, case_sensitive, is_regexp
+    ("import", True, False),
+    ("import", False, False),
+    ("SearchAborted", True, False),
+    ("zqxjv", False, False),
+    (r"def\s+make_\w+\(", True, True),
+    (r"(?i)self\.\w+\s*=\s*None", True, True),
+    (r"\d{4}-\d{2}", True, True),
+]
+
+def make_original_matcher(pattern, case_sensitive=True, is_regexp=False):
+    if not is_regexp:
+        pattern = "^.*" + re.escape(pattern)
+    flags = re.UNICODE
+    if not case_sensitive:
+        flags |= re.IGNORECASE
+    return re.compile(pattern, flags).search
+
+def synthetic_corpus(num_lines=1000000, seed=0):
+    rand = random.Random(seed)
+    words = ["self", "import", "return", "None", "def", "make_matcher", "value",
+             "for", "in", "if", "else", "2016-05", "SearchAborted", "lambda",
+             "x", "y", "=", "(", ")", ":", "#", "the", "quick", "brown", "fox"]
+    return [u" ".join(rand.choice(words) for _ in xrange(rand.randint(0, 16)))
+            for _ in xrange(num_lines)]
+
+def directory_corpus(path):
+    lines = []
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames[:] = [x for x in dirnames if not x.startswith(".")]
+        for filename in filenames:
+            try:
+                with open(os.path.join(dirpath, filename), "rb") as f:
+                    data = f.read()
+            except EnvironmentError:
+                continue
+            if "\0" in data[:1024]:
+                continue
+            lines.extend(data.decode("latin-1").splitlines())
+    return lines
+
+def time_matcher(match, lines, repeat=3):
+    best = None
+    for _ in xrange(repeat):
+        start = time.time()
+        count = 0
+        for line in lines:
+            if match(line):
+                count += 1
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, count
+
+def main():
+    if len(sys.argv) > 1:
+        lines = directory_corpus(sys.argv[1])
+    else:
+        lines = synthetic_corpus()
+    print "Corpus: %d lines, %d characters" % (len(lines), sum(len(x) for x in lines))
+    print
+    print "%-32s %-6s %-6s %10s %10s %8s %9s" % (
+        "Pattern", "Case", "Regexp", "Original", "New", "Speedup", "Matches")
+    for pattern, case_sensitive, is_regexp in queries:
+        original_time, original_count = time_matcher(
+            make_original_matcher(pattern, case_sensitive, is_regexp), lines)
+        new_time, new_count = time_matcher(
+            make_matcher(pattern, case_sensitive, is_regexp).match_line, lines)
+        if original_count != new_count:
+            print "MISMATCH for %r: %d vs %d" % (pattern, original_count, new_count)
+        print "%-32s %-6s %-6s %9.3fs %9.3fs %7.1fx %9d" % (
+            pattern, case_sensitive, is_regexp, original_time, new_time,
+            original_time / max(new_time, 1e-9), new_count)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python2
+# Check that the async thread pool keeps a thread free for interactive calls.
+#
+# Usage: check_async_priority.py [max_threads]
+#
+# Fills the pool with blocking background and bulk calls, checks that every
+# eligible call was given a thread and that the classes stayed within their
+# limits, then checks that an interactive call still runs while they block.
+
+import sys, os, time, threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+import async
+from async import AsyncCallThreadPool, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND, PRIORITY_BULK
+
+# Runs future callbacks on the calling thread; there is no main loop here
+class InlineScheduler(async.Scheduler):
+    def __init__(self):
+        async.Scheduler.__init__(self, max_threads=1)
+
+    def call(self, func, *args, **kwargs):
+        func(*args, **kwargs)
+
+    def post_call(self, func, *args, **kwargs):
+        func(*args, **kwargs)
+
+def wait_until(cond, timeout=5):
+    end = time.time() + timeout
+    while not cond():
+        if time.time() > end:
+            return False
+        time.sleep(0.01)
+    return True
+
+def main():
+    max_threads = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    if max_threads < 2:
+        print "A thread can only be kept free with at least 2 threads"
+        return 2
+    async.set_scheduler(InlineScheduler())
+    pool = AsyncCallThreadPool(max_threads)
+    release = threading.Event()
+    started = []
+    lock = threading.Lock()
+
+    def block(name):
+        with lock:
+            started.append(name)
+        release.wait()
+
+    # A burst of calls, bulk first so that it takes its share of threads
+    # before the background calls arrive
+    for i in xrange(max_threads):
+        pool.call(block, ("bulk",), {}, PRIORITY_BULK, caller=i)
+    for i in xrange(max_threads):
+        pool.call(block, ("background",), {}, PRIORITY_BACKGROUND, caller=i)
+
+    expected = max_threads - 1
+    if not wait_until(lambda: len(started) >= expected):
+        print "FAIL: only %d of %d blocking calls started" % (len(started), expected)
+        return 1
+    time.sleep(0.2)
+    stats = pool.get_stats()
+    running_bulk = stats[PRIORITY_BULK]["running"]
+    running_background = stats[PRIORITY_BACKGROUND]["running"]
+    print "running: %d bulk, %d background, %d threads" % (
+        running_bulk, running_background, len(pool.threads))
+    if running_bulk + running_background != expected:
+        print "FAIL: %d non-interactive calls running, expected %d" % (
+            running_bulk + running_background, expected)
+        return 1
+    if running_bulk > max(1, max_threads // 2):
+        print "FAIL: too many bulk calls running"
+        return 1
+
+    future = pool.call(lambda: "done", (), {}, PRIORITY_INTERACTIVE)
+    ran = wait_until(lambda: future.ready, timeout=2)
+    release.set()
+    pool.shutdown()
+    if not ran:
+        print "FAIL: interactive call didn't run while the pool was saturated"
+        return 1
+    print "OK: interactive call ran while the pool was saturated"
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
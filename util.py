@@ -1,4 +1,4 @@
-import sys, os.path, re
+import sys, os.path, re, threading, collections
 import wx
 
 class frozen_window(object):
@@ -106,19 +106,61 @@ def is_dead_object(win):
 non_printable_re = re.compile(r"[\0-\x07\x0E-\x1F\x7F]")
 line_end_re = re.compile(r"\r\n|\r|\n")
 
+non_printable_bytes = "".join(chr(c) for c in range(256) if non_printable_re.match(chr(c)))
+
+# Counts by deleting the non-printable bytes with str.translate, which is
+# much faster than matching each character with the regex
 def count_non_printable(s):
-    count = 0
-    for c in s:
-        if non_printable_re.match(c):
-            count += 1
-    return count
+    return len(s) - len(s.translate(None, non_printable_bytes))
+
+MAX_TEXT_FILE_CACHE_ENTRIES = 10000
+
+_text_file_cache_lock = threading.Lock()
+_text_file_cache = collections.OrderedDict()
 
 # Heuristic idea from Subversion:
 # http://subversion.apache.org/faq.html#binary-files
+def is_text_data(data):
+    return not ("\0" in data or count_non_printable(data) > len(data) // 6)
+
+# The verdict is cached along with the file's size and mtime, so files are
+# only read again after they change. The least recently used entries are
+# dropped when the cache is full.
 def is_text_file(path):
+    st = os.stat(path)
+    key = (st.st_size, st.st_mtime)
+    with _text_file_cache_lock:
+        entry = _text_file_cache.pop(path, None)
+        if entry:
+            _text_file_cache[path] = entry
+    if entry and entry[0] == key:
+        return entry[1]
     with open(path, "rb") as f:
         data = f.read(1024)
-    return not ("\0" in data or count_non_printable(data) > len(data) // 6)
+    result = is_text_data(data)
+    with _text_file_cache_lock:
+        _text_file_cache.pop(path, None)
+        _text_file_cache[path] = (key, result)
+        _trim_text_file_cache()
+    return result
+
+def _trim_text_file_cache():
+    while len(_text_file_cache) > MAX_TEXT_FILE_CACHE_ENTRIES:
+        _text_file_cache.popitem(last=False)
+
+# Lets the verdicts be shared with and gathered from worker processes
+def get_text_file_cache(paths=None):
+    with _text_file_cache_lock:
+        if paths is None:
+            return dict(_text_file_cache)
+        return dict((path, _text_file_cache[path]) for path in paths if path in _text_file_cache)
+
+def update_text_file_cache(entries):
+    with _text_file_cache_lock:
+        for path, entry in entries.iteritems():
+            _text_file_cache.pop(path, None)
+            _text_file_cache[path] = entry
+        _trim_text_file_cache()
 
 def clear_text_lines(text):
     text = non_printable_re.sub("", text)